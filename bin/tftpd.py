@@ -43,19 +43,26 @@ from builtins import object
 
 import sys
 import os
+import mmap
 import stat
 import errno
 import time
 import optparse
 import re
+import json
+import signal
+import shutil
 import socket
 import pwd
+import tempfile
+import threading
 import traceback
 import logging
 import logging.handlers
 import xmlrpc.client
 
-from collections import deque
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from fnmatch import fnmatch
 from cobbler.utils import local_get_cobbler_api_url
 from cobbler import settings
@@ -65,7 +72,6 @@ import cobbler.templar
 import Cheetah      # need exception types
 
 from struct import pack, unpack
-from subprocess import Popen, PIPE, STDOUT
 
 VERSION = 0.5
 
@@ -76,7 +82,8 @@ TFTP_OPCODE_ACK = 4
 TFTP_OPCODE_ERROR = 5
 TFTP_OPCODE_OACK = 6
 
-COBBLER_HANDLE = xmlrpc.client.Server(local_get_cobbler_api_url())
+# XMLRPC proxies can't be shared between threads, see cobbler_handle()
+COBBLER_HANDLES = threading.local()
 
 OPTIONS = {
     "port": "69",
@@ -86,6 +93,10 @@ OPTIONS = {
     "blksize": 512,         # that's the default, required
     "max_blksize": 1428,    # MTU - overhead
     "min_blksize": 512,     # the default is small enough already
+    "windowsize": 1,        # rfc7440, 1 is plain lock-step
+    "max_windowsize": 64,
+    "min_windowsize": 1,
+    "file_cache_size": 1024,  # MB of boot files kept mapped, 0: disabled
     "retries": 4,
     "verbose": False,
     "debug": False,
@@ -94,10 +105,14 @@ OPTIONS = {
     "cache": True,          # 'cache-time' = 300
     "cache-time": 5 * 300,
     "neg-cache-time": 10,
+    "workers": 0,           # processes sharing the port, 0: no pre-forking
+    "threads": 4,           # per process, for lookups and rendering
+    "snapshot_dir": None,   # where the master shares the snapshot with workers
     "active": 0,
-    "prefix": settings.Settings.tftpboot_location,
+    "prefix": settings.Settings().tftpboot_location,
     "logger": "stream",
-    "file_cmd": "/usr/bin/file",
+    "file_cmd": "/usr/bin/file",  # unused, templates are classified in-process
+    "render_cache_size": 1024,  # rendered templates to keep, 0: disabled
     "user": "nobody",
     # the well known socket.  needs to be global for timeout
     # Using the options hash as a hackaround for python's
@@ -119,6 +134,17 @@ ERRORS = [
 
 REQUESTS = None
 
+# Runs the lookups and template rendering of new requests, so they don't
+# block the transfers running on the IO loop
+EXECUTOR = None
+
+
+def cobbler_handle():
+    """Returns the XMLRPC proxy of the current thread"""
+    if not hasattr(COBBLER_HANDLES, "server"):
+        COBBLER_HANDLES.server = xmlrpc.client.Server(local_get_cobbler_api_url())
+    return COBBLER_HANDLES.server
+
 
 class RenderedFile(object):
     """
@@ -133,6 +159,8 @@ class RenderedFile(object):
         Provide the string to be served out as an argument to the
         constructor.  The data object needs to support slices.
         """
+        if isinstance(data, str):
+            data = data.encode("utf-8")
         self.data = data
         self.offset = 0
 
@@ -173,6 +201,9 @@ class Packet(object):
     def marshall(self):
         raise NotImplementedError("%s: Write marshall method" % repr(self))
 
+    def send(self, sock, address):
+        sock.sendto(self.marshall(), address)
+
     def is_error(self):
         return False
 
@@ -196,7 +227,7 @@ class RRQPacket(Packet):
 
         # opcode already extracted, and unpack is awkward for this
         # so pulling out strings by hand
-        (f, mode, rfc2347str) = data[2:].split('\0', 2)
+        (f, mode, rfc2347str) = data[2:].decode("latin-1").split('\0', 2)
 
         logging.debug("RRQ for file %s(%s) from %s" % (f, mode, remote_addr))
         # Ug.  Can't come up with a simplier way of doing this
@@ -230,7 +261,24 @@ class DATAPacket(Packet):
         self.blk_num = blk_num
 
     def marshall(self):
-        return pack("!HH %ds" % (len(self.data)), TFTP_OPCODE_DATA, self.blk_num & 0xFFFF, str(self.data))
+        return pack("!HH", TFTP_OPCODE_DATA, self.blk_num & 0xFFFF) + bytes(self.data)
+
+
+class DATAWindow(Packet):
+    """
+    A window of DATA packets (rfc7440).  They are all sent at once
+    and the client only acknowledges the last one it received.
+    """
+    def __init__(self, packets):
+        self.opcode = TFTP_OPCODE_DATA
+        self.packets = packets
+
+    def marshall(self):
+        raise NotImplementedError("A window is sent as separate packets")
+
+    def send(self, sock, address):
+        for packet in self.packets:
+            packet.send(sock, address)
 
 
 class ACKPacket(Packet):
@@ -261,23 +309,18 @@ class ERRORPacket(Packet):
         ERROR | 05    |  ErrorCode |   ErrMsg   |   0  |
               ------------------------------------------
     """
-    def __init__(self, data, local_sock, remote_addr):
-        Packet.__init__(self, data, local_sock, remote_addr)
-        self.error_code, = unpack("!h", data[2:4])
-        self.error_str = data[4:-1]
-        logging.debug("ERROR %d: %s from %s" % (self.error_code, self.error_str, remote_addr))
-
-# FIXME: disabled as per pyflakes, not really sure about this one..
-#    def __init__(self, error_code, error_str):
-#        self.error_code = error_code
-#        self.error_str  = error_str
+    def __init__(self, error_code, error_str):
+        self.opcode = TFTP_OPCODE_ERROR
+        self.error_code = error_code
+        self.error_str = error_str
 
     def is_error(self):
         return True
 
     def marshall(self):
-        return pack("!HH %dsB" % (len(self.error_str)),
-                    TFTP_OPCODE_ERROR, self.error_code, self.error_str, 0)
+        error_str = self.error_str.encode("latin-1")
+        return pack("!HH %dsB" % (len(error_str)),
+                    TFTP_OPCODE_ERROR, self.error_code, error_str, 0)
 
 
 class OACKPacket(Packet):
@@ -296,104 +339,373 @@ class OACKPacket(Packet):
         self.options = rfc2347
 
     def marshall(self):
-        optstr = "\0".join([str(x) for x in self.options])
+        optstr = "\0".join([str(x) for x in self.options]).encode("latin-1")
 
-        return pack("!H %ds c" % (len(optstr)), self.opcode, optstr, '\0')
+        return pack("!H %ds c" % (len(optstr)), self.opcode, optstr, b'\0')
 
 
-class XMLRPCSystem(object):
+class FileCache(object):
     """
-    Use XMLRPC to look up system attributes.  This is the recommended
-    method.
-
-    The cache is controlled by the "cache" option and the "cache-time"
-    option
+    A process-wide read-only cache of the files served from disk, e.g.
+    kernels, initrds and bootloaders.  The files are memory-mapped once
+    and shared by all transfers, which then slice their blocks out of
+    the mapping without any system call.  A file which was replaced on
+    disk (inode, mtime or size changed) is mapped again, the old mapping
+    stays valid until the last transfer using it is done.
     """
-    cache = {}
 
-    def __init__(self, ip_address=None, mac_address=None):
-        name = None
-        resolve = True
-
-        # Try the cache.
-        if ip_address in XMLRPCSystem.cache:
-            cache_ent = XMLRPCSystem.cache[ip_address]
-            now = time.time()
-            cache_time = float(OPTIONS["cache-time"])
-            neg_cache_time = float(OPTIONS["neg-cache-time"])
-
-            if cache_ent["time"] + cache_time > now:
-                name = cache_ent["name"]
-
-                if name is not None:
-                    logging.debug("Using cache name for system %s,%s" % (cache_ent["name"], ip_address))
-                    resolve = False
-                elif (name is None and mac_address is None and cache_ent["time"] + neg_cache_time > now):
-                    age = (cache_ent["time"] + neg_cache_time) - now
-                    logging.debug("Using neg-cache for system %s:%f" % (ip_address, age))
-                    resolve = False
-                else:
-                    age = (cache_ent["time"] + neg_cache_time) - now
-                    logging.debug("ignoring cache for %s:%d" % (ip_address, age))
+    def __init__(self):
+        self.files = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
 
-                # Don't bother trying to find it.. until the neg-cache-time
-                # expires anyway
-            else:
-                del XMLRPCSystem.cache[ip_address]
+    def get(self, path):
+        """
+        Get the content of a file.
 
-        # Not in the cache, try to find it.
-        if resolve:
-            query = {}
-            if mac_address is not None:
-                query["mac_address"] = mac_address.replace("-", ":").upper()
-            elif ip_address is not None:
-                query["ip_address"] = ip_address
+        :param path: The path of the file.
+        :return: A RenderedFile with a view of the mapped file.  Files
+                 larger than the cache are mapped just for this transfer.
+        :raises IOError: If the file can't be read.
+        """
+        stat_result = os.stat(path)
+        signature = (stat_result.st_ino, stat_result.st_mtime, stat_result.st_size)
+        with self.lock:
+            entry = self.files.get(path)
+            if entry is not None:
+                if entry[0] == signature:
+                    self.files.move_to_end(path)
+                    return RenderedFile(entry[1])
+                self.__drop(path)
+
+            data = self.__map(path, stat_result.st_size)
+            limit = OPTIONS["file_cache_size"] * 1024 * 1024
+            if len(data) > limit:
+                return RenderedFile(data)
+            while self.files and self.size + len(data) > limit:
+                self.__drop(next(iter(self.files)))
+            self.files[path] = (signature, data)
+            self.size += len(data)
+            return RenderedFile(data)
+
+    def __map(self, path, size):
+        """
+        Map a file into memory.
+
+        :param path: The path of the file.
+        :param size: The size of the file, empty files can't be mapped.
+        :return: A view of the whole file.
+        """
+        with open(path, "rb") as fd:
+            if size == 0:
+                return memoryview(b"")
+            return memoryview(mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def __drop(self, path):
+        """
+        Forget a file.  The mapping is closed once no transfer uses it.
+
+        :param path: The path of the file.
+        """
+        signature, data = self.files.pop(path)
+        self.size -= len(data)
 
+
+FILE_CACHE = FileCache()
+
+
+class SystemSnapshot(object):
+    """
+    A local copy of the TFTP attributes of all systems, indexed by MAC and
+    IP address.  It is refreshed incrementally by a background thread, which
+    polls last_modified_time and only fetches the systems changed since the
+    last refresh, so looking up a client never waits for XMLRPC.
+
+    With pre-forked workers only the master process refreshes the snapshot.
+    It publishes it to a file, which the workers reload when it changed.
+    """
+    # How many systems to fetch with one get_systems_for_tftp call
+    batch_size = 200
+
+    def __init__(self):
+        self.by_mac = {}
+        self.by_ip = {}
+        self.systems = {}
+        self.last_modified = None
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.last_refresh = 0
+        self.handle = None
+        self.path = None        # the file the snapshot is shared through
+        self.master = None      # pid of the process publishing it
+        self.loaded = None      # (inode, mtime) of the file last loaded
+        self.reload_lock = threading.Lock()
+        self.version = 0        # bumped whenever the systems change
+
+    def start(self):
+        """Load the snapshot and start the refresh thread"""
+        self.handle = xmlrpc.client.Server(local_get_cobbler_api_url())
+        thread = threading.Thread(target=self.run, name="system-snapshot")
+        thread.daemon = True
+        thread.start()
+
+    def run(self):
+        while True:
             try:
-                logging.debug("Searching for system %s" % repr(query))
-                systems = COBBLER_HANDLE.find_system(query)
-                if len(systems) > 1:
-                    raise RuntimeError("Args mapped to multiple systems")
-                elif len(systems) == 0:
-                    raise RuntimeError("%s,%s not found in Cobbler" % (ip_address, mac_address))
-                name = systems[0]
-
-            except RuntimeError as e:
-                logging.info(str(e))
-                name = None
+                self.refresh()
             except:
                 (etype, eval,) = sys.exc_info()[:2]
-                logging.warn("Exception retrieving rendered system: %s (%s):%s" %
-                             (name, eval, traceback.format_exc()))
-                name = None
+                logging.warn("Exception refreshing systems (%s):%s" %
+                             (eval, traceback.format_exc()))
+            self.wakeup.wait(float(OPTIONS["neg-cache-time"]))
+            self.wakeup.clear()
+
+    def follow(self, path, master):
+        """Use the snapshot the master process publishes to path"""
+        self.path = path
+        self.master = master
+
+    def request_refresh(self):
+        """A client was not found.  Refresh now, unless we just did"""
+        if time.time() - self.last_refresh > 1:
+            if self.master is None:
+                self.wakeup.set()
+                return
+            self.last_refresh = time.time()
+            try:
+                os.kill(self.master, signal.SIGUSR1)
+            except OSError:
+                pass
+
+    def find(self, ip_address=None, mac_address=None):
+        """Return the attributes of a system, or None"""
+        if self.master is not None:
+            self.reload()
+        with self.lock:
+            if mac_address is not None:
+                return self.by_mac.get(mac_address.replace("-", ":").lower())
+            return self.by_ip.get(ip_address)
 
-        if name is not None:
-            logging.debug("Materializing system %s" % name)
+    def refresh(self):
+        self.last_refresh = time.time()
+        modified = self.handle.last_modified_time()
+        if modified == self.last_modified:
+            return
+
+        names = self.handle.get_item_names("system")
+        if self.last_modified is None:
+            # first load
+            changed = names
+        else:
+            # the modified systems and those inheriting from a modified
+            # distro, profile or image
+            changed = self.handle.get_system_names_for_tftp_since(
+                self.last_modified)
+        names = set(names)
+
+        fetched = {}
+        for i in range(0, len(changed), self.batch_size):
+            batch = changed[i:i + self.batch_size]
+            results = self.handle.get_systems_for_tftp([{"name": n} for n in batch])
+            for (name, attrs) in zip(batch, results):
+                fetched[name] = attrs
+
+        systems = dict(self.systems)
+        systems.update(fetched)
+        for name in list(systems.keys()):
+            if name not in names or not systems[name]:
+                del systems[name]
+
+        self.update(systems)
+        if self.path is not None:
+            self.publish()
+        self.last_modified = modified
+        logging.debug("Refreshed %d of %d systems" % (len(fetched), len(systems)))
+
+    def update(self, systems):
+        """Replace the systems and rebuild the indexes"""
+        by_mac = {}
+        by_ip = {}
+        for attrs in list(systems.values()):
+            for (k, v) in list(attrs.items()):
+                if k.startswith("mac_address_") and v not in ("", "~"):
+                    by_mac[v.lower()] = attrs
+                elif k.startswith("ip_address_") and v not in ("", "~"):
+                    by_ip[v] = attrs
+
+        with self.lock:
+            self.systems = systems
+            self.by_mac = by_mac
+            self.by_ip = by_ip
+            self.version += 1
+
+    def publish(self):
+        """Write the snapshot for the workers, replacing the file atomically"""
+        (fd, tmp_path) = tempfile.mkstemp(dir=os.path.dirname(self.path))
+        with os.fdopen(fd, "w") as tmp_fd:
+            json.dump(self.systems, tmp_fd)
+        os.rename(tmp_path, self.path)
+
+    def reload(self):
+        """Load the snapshot published by the master, if it changed"""
+        with self.reload_lock:
             try:
-                self.system = COBBLER_HANDLE.get_system_as_rendered(name)
-                self.attrs = self.system
-                self.name = self.attrs["name"]
+                stat_result = os.stat(self.path)
+            except OSError:
+                return
+            signature = (stat_result.st_ino, stat_result.st_mtime)
+            if signature == self.loaded:
+                return
+            try:
+                with open(self.path) as fd:
+                    self.update(json.load(fd))
+            except (IOError, ValueError):
+                logging.warn("Unable to load the system snapshot %s" % self.path)
+                return
+            self.loaded = signature
+
+
+SNAPSHOT = SystemSnapshot()
+
+# The per-interface boot loader configurations Cobbler generates on request
+# instead of writing them to disk, with the loader to generate them for
+VIRTUAL_FILES = [
+    (re.compile("^pxelinux\\.cfg/01-((?:[0-9a-f]{2}-){5}[0-9a-f]{2})$"), "pxe"),
+    (re.compile("^grub/system/((?:[0-9a-f]{2}:){5}[0-9a-f]{2})$"), "grub"),
+]
+
+# The bytes "file" would consider text, anything else means binary
+TEXT_CHARS = bytes(bytearray([7, 8, 9, 10, 12, 13, 27]) + bytearray(range(0x20, 0x7f)) + bytearray(range(0x80, 0x100)))
+
+
+class TemplateCache(object):
+    """
+    Remembers which templates are text files, so they don't have to be
+    classified by running "file" for every request, and keeps rendered
+    templates, so the retries of the PXE firmware and repeated boots of
+    the same host are served from memory.
+
+    Templates are identified by path, inode, mtime and size.  A rendered
+    template is also specific to the system name and mtime.  The boot loader
+    configurations generated by Cobbler are kept the same way, by their
+    requested file name and without a signature.  The inherited
+    attributes are covered by the version of the SNAPSHOT or, without the
+    "cache" option, by expiring the output after "neg-cache-time" seconds.
+    """
+
+    def __init__(self):
+        self.kinds = {}
+        self.rendered = OrderedDict()
+        self.lock = threading.Lock()
+
+    def signature(self, path):
+        """Returns (inode, mtime, size) of a template or None if it's missing"""
+        try:
+            stat_result = os.stat(path)
+        except OSError:
+            return None
+        return (stat_result.st_ino, stat_result.st_mtime, stat_result.st_size)
+
+    def is_text(self, path, signature):
+        """Tells if a template is a text file which can be rendered"""
+        if signature is None:
+            return False
+        with self.lock:
+            entry = self.kinds.get(path)
+        if entry is not None and entry[0] == signature:
+            return entry[1]
+        try:
+            with open(path, "rb") as fd:
+                chunk = fd.read(4096)
+        except IOError:
+            return False
+        text = len(chunk) > 0 and not chunk.translate(None, TEXT_CHARS)
+        with self.lock:
+            self.kinds[path] = (signature, text)
+        return text
+
+    def get(self, path, signature, system):
+        """Returns the rendered template for a system, or None"""
+        key = self.__key(path, system)
+        with self.lock:
+            entry = self.rendered.get(key)
+            if entry is None or entry[0] != signature:
+                return None
+            self.rendered.move_to_end(key)
+            return entry[1]
+
+    def put(self, path, signature, system, data):
+        """Keeps the rendered template for a system"""
+        if OPTIONS["render_cache_size"] <= 0:
+            return
+        key = self.__key(path, system)
+        with self.lock:
+            self.rendered[key] = (signature, data)
+            self.rendered.move_to_end(key)
+            while len(self.rendered) > OPTIONS["render_cache_size"]:
+                self.rendered.popitem(last=False)
+
+    def __key(self, path, system):
+        if OPTIONS["cache"]:
+            generation = SNAPSHOT.version
+        else:
+            generation = int(time.time() / max(OPTIONS["neg-cache-time"], 1))
+        return (path, system.name, system.attrs.get("mtime"), generation)
+
+
+TEMPLATE_CACHE = TemplateCache()
+
+
+class XMLRPCSystem(object):
+    """
+    Use XMLRPC to look up system attributes.  This is the recommended
+    method.
+
+    With the "cache" option the systems are looked up in the local
+    SNAPSHOT, which is refreshed every "neg-cache-time" seconds and
+    whenever an unknown client shows up.  Without it every lookup is
+    one get_system_for_tftp call.
+    """
+
+    def __init__(self, ip_address=None, mac_address=None):
+        attrs = None
+        if OPTIONS["cache"]:
+            attrs = SNAPSHOT.find(ip_address, mac_address)
+            if attrs is None:
+                logging.info("%s,%s not found in Cobbler" % (ip_address, mac_address))
+                SNAPSHOT.request_refresh()
+        else:
+            try:
+                logging.debug("Searching for system %s,%s" % (ip_address, mac_address))
+                attrs = cobbler_handle().get_system_for_tftp(ip_address or "", mac_address or "") or None
             except:
                 (etype, eval,) = sys.exc_info()[:2]
-                logging.warn("Exception Materializing system %s (%s):%s" %
-                             (name, eval, traceback.format_exc()))
-                if ip_address in XMLRPCSystem.cache:
-                    del XMLRPCSystem.cache[ip_address]
-                self.system = None
-                self.attrs = dict()
-                self.name = str(ip_address)
+                logging.warn("Exception retrieving system: %s,%s (%s):%s" %
+                             (ip_address, mac_address, eval, traceback.format_exc()))
+
+        self.full_attrs = None
+        if attrs is not None:
+            self.system = attrs
+            self.attrs = self.system
+            self.name = self.attrs["name"]
         else:
             self.system = None
             self.attrs = dict()
             self.name = str(ip_address)
 
-        # fill the cache, negative entries too
-        if OPTIONS["cache"] and resolve:
-            logging.debug("Putting %s,%s into cache" % (name, ip_address))
-            XMLRPCSystem.cache[ip_address] = {
-                "name": name,
-                "time": time.time(),
-            }
+    def get_full_attrs(self):
+        """The complete rendered system, only needed to render templates"""
+        if self.system is None:
+            return self.attrs
+        if self.full_attrs is None:
+            try:
+                self.full_attrs = cobbler_handle().get_system_as_rendered(self.name)
+            except:
+                (etype, eval,) = sys.exc_info()[:2]
+                logging.warn("Exception Materializing system %s (%s):%s" %
+                             (self.name, eval, traceback.format_exc()))
+                return self.attrs
+        return self.full_attrs
 
 
 class Request(object):
@@ -411,10 +723,12 @@ class Request(object):
         self.req_options = rrq_packet.req_options
         self.options = dict()
         self.offset = 0
+        self.window_sent = 0
         self.local_sock = local_sock
         self.state = TFTP_OPCODE_RRQ
         self.expand = False
         self.templar = templar
+        self.virtual = None
 
         # Sanitize input more
         # Strip out \s
@@ -433,7 +747,6 @@ class Request(object):
             self.state = TFTP_OPCODE_ERROR
             self.filename = None
 
-        OPTIONS["active"] += 1
         self.system = XMLRPCSystem(self.remote_addr[0])
 
     def _remap_strip_ip(self, filename):
@@ -487,7 +800,7 @@ class Request(object):
         m = pattern.match(filename)
         if m:
             logging.debug("client requesting distro?")
-            p = COBBLER_HANDLE.get_distro_as_rendered(m.group(1))
+            p = cobbler_handle().get_distro_as_rendered(m.group(1))
             if p:
                 logging.debug("%s matched distro %s" % (filename, p["name"]))
                 if m.group(2) == os.path.basename(p["kernel"]):
@@ -582,8 +895,34 @@ class Request(object):
 
         return filename, None
 
+    def _remap_virtual(self, filename):
+        """pxelinux.cfg/01-<mac> and grub/system/<mac> are generated by
+           Cobbler on request, unless they exist on disk.  Returns the loader
+           to generate the file for, or None.
+        """
+        for (pattern, loader) in VIRTUAL_FILES:
+            m = pattern.match(filename)
+            if m:
+                break
+        else:
+            return None
+        if os.path.exists(os.path.join(OPTIONS["prefix"], filename)):
+            return None
+
+        # the host asking may not be known by its IP address yet
+        mac_address = m.group(1).replace("-", ":")
+        system = XMLRPCSystem(self.remote_addr[0], mac_address)
+        if system.system is None:
+            return None
+        self.system = system
+        self.virtual = (mac_address, loader)
+        return loader
+
     def _remap_name(self, filename):
         filename = filename.lstrip('/')  # assumed
+        if self._remap_virtual(filename) is not None:
+            return filename, "virtual"
+
         # If possible, ignore pxelinux.0 added things we already know
         trimmed = self._remap_strip_ip(filename)
 
@@ -616,10 +955,15 @@ class Request(object):
         # last try: try profiles
         return self._remap_via_profiles(trimmed)
 
-    def _render_template(self):
+    def _render_template(self, signature):
+        data = TEMPLATE_CACHE.get(self.filename, signature, self.system)
+        if data is not None:
+            return RenderedFile(data)
         try:
-            return RenderedFile(self.templar.render(open(self.filename, "r"),
-                                self.system.attrs, None))
+            rendered = RenderedFile(self.templar.render(open(self.filename, "r"),
+                                    self.system.get_full_attrs(), None))
+            TEMPLATE_CACHE.put(self.filename, signature, self.system, rendered.data)
+            return rendered
         except Cheetah.Parser.ParseError as e:
             logging.warn('Unable to expand template: %s: %s' % (self.filename, e))
             return None
@@ -627,6 +971,24 @@ class Request(object):
             logging.warn('Unable to expand template: %s: %s' % (self.filename, e))
             return None
 
+    def _render_virtual(self):
+        (mac_address, loader) = self.virtual
+        data = TEMPLATE_CACHE.get(self.filename, None, self.system)
+        if data is not None:
+            return RenderedFile(data)
+        try:
+            config = cobbler_handle().generate_system_config(mac_address, loader)
+        except:
+            (etype, eval,) = sys.exc_info()[:2]
+            logging.warn("Exception generating %s for %s (%s):%s" %
+                         (self.filename, self.system.name, eval, traceback.format_exc()))
+            return None
+        if not config:
+            return None
+        rendered = RenderedFile(config)
+        TEMPLATE_CACHE.put(self.filename, None, self.system, rendered.data)
+        return rendered
+
     def _setup_xfer(self):
         """Open the file to be loaded, or materalize the template.
            This method can set the state to be an ERROR state, so
@@ -638,12 +1000,9 @@ class Request(object):
         logging.debug('host %s getting %s: %s' %
                       (self.system.name, self.filename, self.type))
         if self.type == "template":
-            # TODO: Add file magic here
-            output = Popen([OPTIONS["file_cmd"], self.filename],
-                           stdout=PIPE, stderr=STDOUT,
-                           close_fds=True).communicate()[0]
-            if output.find(" text") >= 0:
-                self.file = self._render_template()
+            signature = TEMPLATE_CACHE.signature(self.filename)
+            if TEMPLATE_CACHE.is_text(self.filename, signature):
+                self.file = self._render_template(signature)
                 if self.file:
                     self.block_count = 0
                     self.file_size = len(self.file.data)
@@ -651,7 +1010,14 @@ class Request(object):
                 else:
                     logging.debug('Template failed to render.')
             else:
-                logging.debug('Not rendering binary file %s (%s).' % (self.filename, output))
+                logging.debug('Not rendering binary file %s.' % self.filename)
+        elif self.type == "virtual":
+            self.file = self._render_virtual()
+            if self.file:
+                self.block_count = 0
+                self.file_size = len(self.file.data)
+                return
+            logging.debug('No configuration generated for %s.' % self.filename)
         elif self.type == "hash_value":
             self.file = RenderedFile(self.system.attrs[self.filename])
             self.block_count = 0
@@ -668,15 +1034,16 @@ class Request(object):
                           (self.filename, self.remote_addr))
             # Templates are specified by an absolute path
             if self.type == "template":
-                self.file = open(self.filename, 'rb', 0)
+                path = self.filename
             else:
                 # TODO! restrict.  Chroot?
                 # We are sanitizing in the input, but a second line of defense
                 # wouldn't be a bad idea
-                self.file = open(OPTIONS["prefix"] + "/" + self.filename, 'rb', 0)
+                path = OPTIONS["prefix"] + "/" + self.filename
+            self.file = FILE_CACHE.get(path)
             self.block_count = 0
-            self.file_size = os.fstat(self.file.fileno()).st_size
-        except IOError:
+            self.file_size = len(self.file.data)
+        except (IOError, OSError):
             logging.debug('%s requested %s: file not found.' %
                           (self.remote_addr, self.filename))
             self.state = TFTP_OPCODE_ERROR
@@ -722,14 +1089,16 @@ class Request(object):
 
         if packet.opcode == TFTP_OPCODE_ACK:
             if self.state == TFTP_OPCODE_DATA:
-                # Incremement offset.  They got the last bit
+                # Incremement offset.  They got everything up to the
+                # acknowledged block of the window we sent.
                 # the FFFF are to permit wrap.  It's OK for the block
                 # number to wrap, since it's one client (and not unicast),
                 # so the client can figure that out.
-                if ((packet.block_number & 0xFFFF) == ((self.block_count + 1) & 0xFFFF)):
-                    # Only update if they actually ack the packet we
-                    # sent, but we'll still resend the last packet either way
-                    self.block_count += 1
+                acked = (packet.block_number - self.block_count) & 0xFFFF
+                if 0 < acked <= self.window_sent:
+                    # Only update if they actually ack a packet we
+                    # sent, the rest of the window is resent either way
+                    self.block_count += acked
 
                 self.state = TFTP_OPCODE_ACK
             elif self.state == TFTP_OPCODE_OACK:
@@ -753,25 +1122,35 @@ class Request(object):
         # that needing one means you didn't set your classes up right)
         # so ... have a set of if/elif statements.
 
-        # Fast path: it's an ACK.  Feed more data
+        # Fast path: it's an ACK.  Feed the next window of data
         if self.state == TFTP_OPCODE_ACK:
-            offset = self.block_count * self.options["blksize"]
+            blksize = self.options["blksize"]
+            offset = self.block_count * blksize
 
             if self.file_size < offset:
                 # We're done.
                 logging.info('Transfer of %s to %s done' % (self.filename, self.remote_addr))
                 return None
 
-            self.file.seek(self.block_count * self.options["blksize"])
-            data = self.file.read(self.options["blksize"])
+            packets = []
+            for block in range(self.block_count + 1, self.block_count + 1 + self.options["windowsize"]):
+                start = (block - 1) * blksize
+                if start > self.file_size:
+                    break
+                # Block Count starts at 1, so offset
+                data = self.file.data[start:start + blksize]
+                logging.log(9, "DATA to %s/%d, block_count %d/%d, size %d(%d/%d)" % (
+                    self.remote_addr[0], self.remote_addr[1],
+                    block, block & 0xFFFF, len(data), start + len(data), self.file_size))
+                packets.append(DATAPacket(data, block))
+                if len(data) < blksize:
+                    break
 
             self.state = TFTP_OPCODE_DATA
-            # Block Count starts at 1, so offset
-            logging.log(9, "DATA to %s/%d, block_count %d/%d, size %d(%d/%d)" % (
-                self.remote_addr[0], self.remote_addr[1],
-                self.block_count + 1, (self.block_count + 1) & 0xFFFF,
-                len(data), offset + len(data), self.file_size))
-            return DATAPacket(data, self.block_count + 1)
+            self.window_sent = len(packets)
+            if len(packets) == 1:
+                return packets[0]
+            return DATAWindow(packets)
 
         if self.state == 0:
             return None
@@ -795,7 +1174,8 @@ class Request(object):
                 return ERRORPacket(self.error_code, self.error_str)
 
             # make sure we have defaults
-            self.options = dict(blksize=OPTIONS["blksize"], timeout=OPTIONS["timeout"])
+            self.options = dict(blksize=OPTIONS["blksize"], timeout=OPTIONS["timeout"],
+                                windowsize=OPTIONS["windowsize"])
 
             accepted_opts = []
             # Sorry for the excessive complexity here.
@@ -837,7 +1217,8 @@ class Request(object):
         if self.state == TFTP_OPCODE_RRQ:
             # No options.  Fill in the defaults
             # and then recurse, pretending we just got the ACK to our OACK
-            self.options = dict(blksize=OPTIONS["blksize"], timeout=OPTIONS["timeout"])
+            self.options = dict(blksize=OPTIONS["blksize"], timeout=OPTIONS["timeout"],
+                                windowsize=OPTIONS["windowsize"])
 
             logging.debug("Using Options: %s" % (repr(self.options)))
 
@@ -928,7 +1309,7 @@ def handle_request(request, fd, events):
             try:
                 data, address = request.local_sock.recvfrom(request.options["blksize"])
             except socket.error as e:
-                if e[0] in (errno.EWOULDBLOCK, errno.EAGAIN):
+                if e.errno in (errno.EWOULDBLOCK, errno.EAGAIN):
                     return
                 else:
                     raise
@@ -943,9 +1324,9 @@ def handle_request(request, fd, events):
                 reply = request.reply()
 
                 if reply:
-                    request.local_sock.sendto(reply.marshall(), address)
+                    reply.send(request.local_sock, address)
 
-                if not reply or reply is ERRORPacket:
+                if not reply or reply.is_error():
                     request.finish()
             else:
                 raise NotImplementedError("Input from unexpected source")
@@ -988,7 +1369,7 @@ def new_req(sock, templar, fd, events):
         try:
             data, address = sock.recvfrom(OPTIONS["blksize"])
         except socket.error as e:
-            if e[0] not in (errno.EWOULDBLOCK, errno.EAGAIN):
+            if e.errno not in (errno.EWOULDBLOCK, errno.EAGAIN):
                 raise
             break
 
@@ -1007,27 +1388,151 @@ def new_req(sock, templar, fd, events):
         new_address.setblocking(0)
         packet.local_sock = new_address
 
-        # Create the request object to handle this request, and bind it
-        # to IO from the transient port
-        request = Request(packet, new_address, templar)
-        io_loop.add_handler(
-            new_address.fileno(),
-            partial(handle_request, request),
-            io_loop.READ)
-        request.timeout = io_loop.add_timeout(time.time() + OPTIONS["timeout"], lambda: request.handle_timeout())
+        # Looking up the host and rendering templates can take a while,
+        # so the request is created off the IO loop
+        OPTIONS["active"] += 1
+        EXECUTOR.submit(start_request, io_loop, packet, templar)
 
-        # Ask the request what to do now..
+    # After the while loop.  Re-add the idle timer
+    if OPTIONS["idle"] > 0:
+        OPTIONS["idle_timer"] = io_loop.add_timeout(time.time() + OPTIONS["idle"], lambda: idle_out())
+
+
+def start_request(io_loop, packet, templar):
+    """Runs in the EXECUTOR.  Creates the request object for a RRQ packet
+       and asks it what to do, which looks up the host and sets up the
+       transfer.  The request is then handed back to the IO loop.
+    """
+    request = Request(packet, packet.local_sock, templar)
+    try:
         reply = request.reply()
-        if reply:
-            new_address.sendto(reply.marshall(), address)
+    except:
+        (etype, eval,) = sys.exc_info()[:2]
+        logging.warn("Exception setting up %s for %s (%s):%s" %
+                     (request.filename, request.remote_addr, eval, traceback.format_exc()))
+        reply = None
+    io_loop.add_callback(begin_request, io_loop, request, reply)
 
-        if not reply or reply.is_error():
-            request.finish()
 
-    # After the while loop.  Re-add the idle timer
+def begin_request(io_loop, request, reply):
+    """Binds a new request to IO from its transient port and sends the
+       first reply.
+    """
+    io_loop.add_handler(
+        request.local_sock.fileno(),
+        partial(handle_request, request),
+        io_loop.READ)
+    request.timeout = io_loop.add_timeout(time.time() + OPTIONS["timeout"], lambda: request.handle_timeout())
+
+    if reply:
+        reply.send(request.local_sock, request.remote_addr)
+
+    if not reply or reply.is_error():
+        request.finish()
+
+
+def bind_socket():
+    """Binds a socket to the well-known port.  Pre-forked workers each get
+       their own, the kernel spreads the requests between them.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, 0)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if OPTIONS["workers"] > 0:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(("", OPTIONS["port"]))
+    return sock
+
+
+def serve():
+    """Handles requests on OPTIONS["sock"] until idle or interrupted"""
+    global EXECUTOR
+    EXECUTOR = ThreadPoolExecutor(max_workers=OPTIONS["threads"])
+
+    # This takes a while, so do it after we open the port, so we
+    # don't drop the packet that spawned us
+    templar = cobbler.templar.Templar(None)
+
+    io_loop = ioloop.IOLoop.instance()
+    io_loop.add_handler(OPTIONS["sock"].fileno(), partial(new_req, OPTIONS["sock"], templar), io_loop.READ)
+    # Shove the timeout into OPTIONS, because it's there
     if OPTIONS["idle"] > 0:
         OPTIONS["idle_timer"] = io_loop.add_timeout(time.time() + OPTIONS["idle"], lambda: idle_out())
 
+    logging.info('Starting Eventloop')
+    try:
+        try:
+            io_loop.start()
+        except KeyboardInterrupt:
+            # Someone hit ^C
+            logging.info('Exiting')
+    finally:
+        OPTIONS["sock"].close()
+        EXECUTOR.shutdown(wait=False)
+
+
+def fork_worker(sock, snapshot_path):
+    """Forks a worker process serving requests on sock"""
+    master = os.getpid()
+    pid = os.fork()
+    if pid:
+        return pid
+
+    global SNAPSHOT
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGUSR1, signal.SIG_DFL)
+    OPTIONS["sock"] = sock
+    if snapshot_path is not None:
+        # the refresh thread of the master didn't survive the fork
+        SNAPSHOT = SystemSnapshot()
+        SNAPSHOT.follow(snapshot_path, master)
+    try:
+        serve()
+    finally:
+        os._exit(0)
+
+
+def run_workers(socks):
+    """The master process: forks a worker per socket, restarts workers
+       that die and, with the "cache" option, keeps the system snapshot
+       up to date for all of them.
+    """
+    snapshot_path = None
+    if OPTIONS["cache"]:
+        snapshot_path = os.path.join(OPTIONS["snapshot_dir"], "systems.json")
+        SNAPSHOT.path = snapshot_path
+        signal.signal(signal.SIGUSR1, lambda signum, frame: SNAPSHOT.request_refresh())
+
+    workers = {}
+    for sock in socks:
+        workers[fork_worker(sock, snapshot_path)] = sock
+
+    # Start the refresh thread only now, so the workers aren't forked while
+    # it may hold a lock.  Restarted workers replace the snapshot and its
+    # locks right after the fork.
+    if OPTIONS["cache"]:
+        SNAPSHOT.start()
+
+    def stop(signum, frame):
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        if OPTIONS["snapshot_dir"] is not None:
+            shutil.rmtree(OPTIONS["snapshot_dir"], ignore_errors=True)
+        sys.exit(0)
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    while True:
+        (pid, status) = os.wait()
+        sock = workers.pop(pid, None)
+        if sock is not None:
+            logging.warn("Worker %d exited with status %d, restarting it" % (pid, status))
+            time.sleep(1)
+            workers[fork_worker(sock, snapshot_path)] = sock
+
 
 def main():
     # If we're called from xinetd, set idle to non-zero
@@ -1042,10 +1547,15 @@ def main():
         idle=dict(type="int", help="How long to wait for input"),
         timeout=dict(type="int", help="How long to wait for a given request"),
         max_blksize=dict(type="int", help="The maximum block size to permit"),
+        max_windowsize=dict(type="int", help="The maximum number of blocks to send per acknowledgement (rfc7440)"),
+        file_cache_size=dict(type="int", help="How many MB of boot files to keep memory-mapped, 0 to disable"),
         prefix=dict(type="string", help="Where files are stored by default [" + OPTIONS["prefix"] + "]"),
         logger=dict(type="string", help="How to log"),
-        file_cmd=dict(type="string", help="The location of the 'file' command"),
+        file_cmd=dict(type="string", help="Unused, text files are detected without it. Kept for compatibility"),
+        render_cache_size=dict(type="int", help="How many rendered templates to keep, 0 to disable"),
         user=dict(type="string", help="The user to run as [nobody]"),
+        workers=dict(type="int", help="How many processes share the port (SO_REUSEPORT), 0 for a single process"),
+        threads=dict(type="int", help="How many threads per process look up hosts and render templates"),
     )
 
     parser = optparse.OptionParser(
@@ -1057,11 +1567,11 @@ def main():
     parser.add_option('-d', '--debug', action='store_true', default=False,
                       help="Debug (vastly increases output verbosity)")
     parser.add_option('-c', '--cache', action='store_true', default=True,
-                      help="Use a cache to help find hosts w/o IP address")
+                      help="Keep a local snapshot of all systems to find hosts without asking Cobbler")
     parser.add_option('--cache-time', action='store', type="int", default=5 * 60,
-                      help="How long an ip->name mapping is valid")
+                      help="Unused, the snapshot is always up to date. Kept for compatibility")
     parser.add_option('--neg-cache-time', action='store', type="int", default=10,
-                      help="How long an ip->name mapping is valid")
+                      help="How often the snapshot is checked for changes")
 
     opts = list(opt_help.keys())
     opts.sort()
@@ -1102,44 +1612,40 @@ def main():
         logging.getLogger().setLevel(logging.WARN)
 
     if stat.S_ISSOCK(mode):
-        OPTIONS["sock"] = socket.fromfd(sys.stdin.fileno(), socket.AF_INET, socket.SOCK_DGRAM, 0)
+        # xinetd hands us the socket, so there is nothing to share
+        OPTIONS["workers"] = 0
+        socks = [socket.fromfd(sys.stdin.fileno(), socket.AF_INET, socket.SOCK_DGRAM, 0)]
     else:
-        OPTIONS["sock"] = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, 0)
-        OPTIONS["sock"].setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         try:
-            OPTIONS["sock"].bind(("", OPTIONS["port"]))
+            socks = [bind_socket() for i in range(max(OPTIONS["workers"], 1))]
         except socket.error as e:
-            if e[0] in (errno.EPERM, errno.EACCES):
+            if e.errno in (errno.EPERM, errno.EACCES):
                 print("Unable to bind to port %d" % OPTIONS["port"])
                 return -1
             else:
                 raise
 
-    OPTIONS["sock"].setblocking(0)
+    for sock in socks:
+        sock.setblocking(0)
+
+    if OPTIONS["workers"] > 0 and OPTIONS["cache"]:
+        OPTIONS["snapshot_dir"] = tempfile.mkdtemp(prefix="cobbler-tftpd-")
 
     if os.getuid() == 0:
         uid = pwd.getpwnam(OPTIONS["user"])[2]
+        if OPTIONS["workers"] > 0 and OPTIONS["cache"]:
+            os.chown(OPTIONS["snapshot_dir"], uid, -1)
         os.setreuid(uid, uid)
 
-    # This takes a while, so do it after we open the port, so we
-    # don't drop the packet that spawned us
-    templar = cobbler.templar.Templar(None)
+    if OPTIONS["workers"] > 0:
+        run_workers(socks)
+        return 0
 
-    io_loop = ioloop.IOLoop.instance()
-    io_loop.add_handler(OPTIONS["sock"].fileno(), partial(new_req, OPTIONS["sock"], templar), io_loop.READ)
-    # Shove the timeout into OPTIONS, because it's there
-    if OPTIONS["idle"] > 0:
-        OPTIONS["idle_timer"] = io_loop.add_timeout(time.time() + OPTIONS["idle"], lambda: idle_out())
+    if OPTIONS["cache"]:
+        SNAPSHOT.start()
 
-    logging.info('Starting Eventloop')
-    try:
-        try:
-            io_loop.start()
-        except KeyboardInterrupt:
-            # Someone hit ^C
-            logging.info('Exiting')
-    finally:
-        OPTIONS["sock"].close()
+    OPTIONS["sock"] = socks[0]
+    serve()
     return 0
 
 
@@ -61,11 +61,13 @@ class CobblerLiteSync(object):
         self.sync = collection_mgr.api.get_sync(verbose, logger=self.logger)
         self.sync.make_tftpboot()
 
-    def add_single_distro(self, name):
+    def add_single_distro(self, name, rebuild_menu=True):
         """
         Sync adding a single distro.
 
         :param name: The name of the distribution.
+        :param rebuild_menu: Whether to rebuild the grub/... menu or not.
+        :type rebuild_menu: bool
         """
         # get the distro record
         distro = self.distros.find(name=name)
@@ -95,7 +97,8 @@ class CobblerLiteSync(object):
         kids = distro.get_children()
         for k in kids:
             self.add_single_profile(k.name, rebuild_menu=False)
-        self.sync.tftpgen.make_pxe_menu()
+        if rebuild_menu:
+            self.sync.tftpgen.make_pxe_menu()
 
     def add_single_image(self, name):
         """
@@ -206,6 +209,40 @@ class CobblerLiteSync(object):
         # write the PXE files for the system
         self.tftpd.add_single_system(system)
 
+    def add_items(self, items):
+        """
+        Sync adding many objects at once. Files which are generated from all objects, like the PXE menu or the DHCP and
+        DNS host lists, are only regenerated once instead of once per object.
+
+        :param items: The objects which were added or edited.
+        :type items: list
+        """
+        rebuild_menu = False
+        systems = []
+        for item in items:
+            if item.COLLECTION_TYPE == "distro":
+                self.add_single_distro(item.name, rebuild_menu=False)
+                rebuild_menu = True
+            elif item.COLLECTION_TYPE == "profile":
+                self.add_single_profile(item.name, rebuild_menu=False)
+                rebuild_menu = True
+            elif item.COLLECTION_TYPE == "image":
+                image = self.images.find(name=item.name)
+                self.sync.tftpgen.copy_single_image_files(image)
+                systems.extend(image.get_children())
+                rebuild_menu = True
+            elif item.COLLECTION_TYPE == "system":
+                systems.append(item)
+        if systems:
+            if self.settings.manage_dhcp:
+                self.sync.dhcp.regen_ethers()
+            if self.settings.manage_dns:
+                self.sync.dns.regen_hosts()
+            for system in systems:
+                self.tftpd.add_single_system(system)
+        if rebuild_menu:
+            self.sync.tftpgen.make_pxe_menu()
+
     def remove_single_system(self, name):
         """
         Sync removing a single system.
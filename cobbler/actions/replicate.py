@@ -23,14 +23,23 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
 
 from builtins import str
 from builtins import object
+from concurrent.futures import ThreadPoolExecutor
 import fnmatch
 import os
+import tempfile
 import xmlrpc.client
 
+import simplejson
+
 from cobbler import clogger
 from cobbler import utils
 
 OBJ_TYPES = ["distro", "profile", "system", "repo", "image", "mgmtclass", "package", "file"]
+# The sequence number of the master's change log reached by the last replication and the objects which failed to
+# replicate and are fetched again by the next one, per master
+REPLICATE_STATE_FILE = "/var/lib/cobbler/replicate_state.json"
+# The largest sequence number XML-RPC can transfer, used to ask the master for its current sequence number
+MAX_SEQUENCE = 2 ** 31 - 1
 
 
 class Replicate(object):
@@ -47,6 +56,9 @@ class Replicate(object):
         self.api = collection_mgr.api
         self.remote = None
         self.uri = None
+        self.sequence = None
+        self.epoch = None
+        self.failed = {}
         if logger is None:
             logger = clogger.Logger()
         self.logger = logger
@@ -58,6 +70,8 @@ class Replicate(object):
         :param from_path: The source to rsync from.
         :param to_path: The destination to rsync to.
         :param type: If set to "repo" this will take the repo rsync options instead of the global ones.
+        :return: True if the transfer succeeded.
+        :rtype: bool
         """
         from_path = "%s::%s" % (self.master, from_path)
         if type == 'repo':
@@ -68,6 +82,40 @@ class Replicate(object):
         rc = utils.subprocess_call(self.logger, cmd, shell=True)
         if rc != 0:
             self.logger.info("rsync failed")
+        return rc == 0
+
+    def rsync_all(self, jobs):
+        """
+        Run many rsync transfers, at most ``replicate_rsync_jobs`` of them at the same time.
+
+        :param jobs: A list of tuples with the arguments for ``rsync_it()``.
+        :return: The jobs which failed.
+        :rtype: list
+        """
+        failed = []
+        workers = max(1, self.settings.replicate_rsync_jobs)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [(job, executor.submit(self.rsync_it, *job)) for job in jobs]
+            for (job, future) in futures:
+                try:
+                    if not future.result():
+                        failed.append(job)
+                except Exception:
+                    self.logger.error("Failed to rsync %s" % job[0])
+                    utils.log_exc(self.logger)
+                    failed.append(job)
+        return failed
+
+    def mark_failed(self, obj_type, uid, name):
+        """
+        Remember an object which could not be replicated, so the next replication fetches it again even if it does not
+        change on the master in the meantime.
+
+        :param obj_type: The type of the object.
+        :param uid: The uid of the object.
+        :param name: The name of the object on the master.
+        """
+        self.failed[(obj_type, uid)] = name
 
     # -------------------------------------------------------
 
@@ -87,6 +135,7 @@ class Replicate(object):
                     self.api.remove_item(obj_type, ldata["name"], recursive=True, logger=self.logger)
                 except Exception:
                     utils.log_exc(self.logger)
+                    self.mark_failed(obj_type, luid, ldata["name"])
 
     # -------------------------------------------------------
 
@@ -109,12 +158,8 @@ class Replicate(object):
                 creator = getattr(self.api, "new_%s" % obj_type)
                 newobj = creator()
                 newobj.from_dict(rdata)
-                try:
-                    self.logger.info("adding %s %s" % (obj_type, rdata["name"]))
-                    if not self.api.add_item(obj_type, newobj, logger=self.logger):
-                        self.logger.error("failed to add %s %s" % (obj_type, rdata["name"]))
-                except Exception:
-                    utils.log_exc(self.logger)
+                self.logger.info("adding %s %s" % (obj_type, rdata["name"]))
+                self.pending.append((obj_type, newobj))
 
     # -------------------------------------------------------
 
@@ -142,81 +187,263 @@ class Replicate(object):
                     creator = getattr(self.api, "new_%s" % obj_type)
                     newobj = creator()
                     newobj.from_dict(rdata)
-                    try:
-                        self.logger.info("updating %s %s" % (obj_type, rdata["name"]))
-                        if not self.api.add_item(obj_type, newobj):
-                            self.logger.error("failed to update %s %s" % (obj_type, rdata["name"]))
-                    except Exception:
-                        utils.log_exc(self.logger)
+                    self.logger.info("updating %s %s" % (obj_type, rdata["name"]))
+                    self.pending.append((obj_type, newobj))
 
     # -------------------------------------------------------
 
-    def replicate_data(self):
+    def commit_pending(self):
+        """
+        Add the new and updated objects collected by ``add_objects_not_on_local()`` and
+        ``replace_objects_newer_on_remote()`` in bulk. Objects need the objects they depend on to exist, so there is
+        one batch per object type and depth, added in order. If a batch fails its objects are added one by one, so a
+        single broken object does not keep the others from being replicated. Objects which still fail are fetched again
+        by the next replication.
+        """
+        for what in OBJ_TYPES:
+            items = [ref for (obj_type, ref) in self.pending if obj_type == what]
+            for depth in sorted(set(ref.depth for ref in items)):
+                batch = [(what, ref) for ref in items if ref.depth == depth]
+                try:
+                    self.api.add_items(batch, with_sync=False, logger=self.logger)
+                except Exception:
+                    utils.log_exc(self.logger)
+                    for (obj_type, ref) in batch:
+                        try:
+                            self.api.add_item(obj_type, ref, logger=self.logger)
+                        except Exception:
+                            self.logger.error("failed to add %s %s" % (obj_type, ref.name))
+                            utils.log_exc(self.logger)
+                            self.mark_failed(obj_type, ref.uid, ref.name)
+        self.pending = []
+
+    # -------------------------------------------------------
+
+    def load_state(self):
+        """
+        Get the state of the last successful replication from this master.
+
+        :return: The state or None if there was none with the same options.
+        """
+        try:
+            with open(REPLICATE_STATE_FILE, "r") as fd:
+                state = simplejson.load(fd).get(self.uri)
+        except (IOError, OSError, ValueError):
+            return None
+        if state is None or state.get("options") != self.options:
+            return None
+        return state
+
+    def save_state(self):
+        """
+        Remember the sequence number and epoch of the master's change log this replication has reached, together with
+        the objects which failed to replicate.
+        """
+        try:
+            with open(REPLICATE_STATE_FILE, "r") as fd:
+                data = simplejson.load(fd)
+        except (IOError, OSError, ValueError):
+            data = {}
+        failed = [[obj_type, uid, name] for ((obj_type, uid), name) in sorted(self.failed.items())]
+        data[self.uri] = {"sequence": self.sequence, "epoch": self.epoch, "options": self.options, "failed": failed}
+        (fd, tmp_path) = tempfile.mkstemp(dir=os.path.dirname(REPLICATE_STATE_FILE), prefix=".replicate_state.")
+        try:
+            with os.fdopen(fd, "w") as tmp_fd:
+                tmp_fd.write(simplejson.dumps(data))
+            os.replace(tmp_path, REPLICATE_STATE_FILE)
+        except:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def query_changes(self):
+        """
+        Ask the master for the changes since the last replication. Objects which failed to replicate last time are
+        fetched again: They are reported as modified if they still exist on the master, otherwise as deleted.
+
+        :return: The latest change of every changed object, or None if everything has to be replicated because there
+                 is no usable state or the master does not keep a change log.
+        """
+        self.sequence = None
+        self.epoch = None
+        try:
+            current = self.remote.get_changes(MAX_SEQUENCE)
+        except xmlrpc.client.Fault:
+            self.logger.info("The master has no change log, replicating everything")
+            return None
+        state = self.load_state()
+        if state is None:
+            (self.sequence, self.epoch) = (current["sequence"], current.get("epoch"))
+            return None
+        result = self.remote.get_changes(state["sequence"], "", True, state.get("epoch") or "")
+        if not result["complete"]:
+            self.logger.info("The change log of the master was compacted or started over, replicating everything")
+            (self.sequence, self.epoch) = (current["sequence"], current.get("epoch"))
+            return None
+        (self.sequence, self.epoch) = (result["sequence"], result.get("epoch"))
+        latest = {}
+        for change in result["changes"]:
+            if change["type"] in OBJ_TYPES:
+                latest[(change["type"], change["uid"])] = change
+        for (obj_type, uid, name) in state.get("failed", []):
+            if (obj_type, uid) in latest:
+                continue
+            self.logger.info("retrying %s %s" % (obj_type, name))
+            change = {"change": "delete", "type": obj_type, "name": name, "uid": uid}
+            item = self.remote.get_item(obj_type, name)
+            if isinstance(item, dict) and item.get("uid") == uid:
+                change.update({"change": "modify", "item": item})
+            latest[(obj_type, uid)] = change
+        return list(latest.values())
+
+    def fetch_dependencies(self):
+        """
+        Get the objects the changed objects depend on from the master, so the include map can be generated for them.
+        """
+        names = {}
+        for what in OBJ_TYPES:
+            names[what] = set(rdata["name"] for rdata in self.remote_data[what])
+        todo = [(what, rdata) for what in OBJ_TYPES for rdata in self.remote_data[what]]
+        while todo:
+            (what, rdata) = todo.pop()
+            deps = []
+            if what == "system":
+                deps = [("profile", rdata.get("profile", "")), ("image", rdata.get("image", ""))]
+            elif what == "profile":
+                deps = [("profile", rdata.get("parent", "")), ("distro", rdata.get("distro", ""))]
+                if isinstance(rdata.get("repos"), list):
+                    deps.extend(("repo", repo) for repo in rdata["repos"])
+            for (dep_type, dep_name) in deps:
+                if dep_name in ("", "~", "<<inherit>>") or dep_name in names[dep_type]:
+                    continue
+                dep = self.remote.get_item(dep_type, dep_name)
+                if not isinstance(dep, dict):
+                    continue
+                names[dep_type].add(dep_name)
+                self.remote_data[dep_type].append(dep)
+                todo.append((dep_type, dep))
+
+    def remove_objects_deleted_on_master(self, changes):
         """
-        Replicate the local and remote data to each another.
+        Remove the objects on this slave which were deleted on the master.
 
+        :param changes: The changes from ``query_changes()``.
+        """
+        locals = {}
+        for what in OBJ_TYPES:
+            locals[what] = utils.lod_to_dod(self.local_data[what], "uid")
+        for change in changes:
+            if change["change"] != "delete":
+                continue
+            if change["type"] == "system" and len(self.system_patterns) == 0:
+                continue
+            if change["uid"] in locals[change["type"]]:
+                name = locals[change["type"]][change["uid"]]["name"]
+                try:
+                    self.logger.info("removing %s %s" % (change["type"], name))
+                    self.api.remove_item(change["type"], name, recursive=True, logger=self.logger)
+                except Exception:
+                    utils.log_exc(self.logger)
+                    self.mark_failed(change["type"], change["uid"], name)
+
+    # -------------------------------------------------------
+
+    def replicate_data(self):
+        """
+        Replicate the local and remote data to each another. If the master keeps a change log only the objects which
+        changed since the last successful replication are transferred.
         """
         self.local_data = {}
         self.remote_data = {}
+        self.pending = []
+        self.failed = {}
         self.remote_settings = self.remote.get_settings()
 
-        self.logger.info("Querying Both Servers")
         for what in OBJ_TYPES:
-            self.remote_data[what] = self.remote.get_items(what)
-            self.local_data[what] = self.local.get_items(what)
-
-        self.generate_include_map()
+            self.local_data[what] = [{"uid": x.uid, "name": x.name, "mtime": x.mtime} for x in self.api.get_items(what)]
+
+        changes = self.query_changes()
+        if changes is None:
+            self.logger.info("Querying Master")
+            for what in OBJ_TYPES:
+                self.remote_data[what] = self.remote.get_items(what)
+            self.generate_include_map()
+        else:
+            self.logger.info("Querying %d Objects Changed On Master" % len(changes))
+            for what in OBJ_TYPES:
+                self.remote_data[what] = [change["item"] for change in changes
+                                          if change["type"] == what and "item" in change]
+            self.fetch_dependencies()
+            self.generate_include_map()
+            # objects replicated by an earlier run are kept up to date even if they don't match the patterns anymore
+            for what in OBJ_TYPES:
+                locals = utils.lod_to_dod(self.local_data[what], "uid")
+                for rdata in self.remote_data[what]:
+                    if rdata["uid"] in locals:
+                        self.must_include[what][rdata["name"]] = 1
+            # mirrored repos change without their objects changing
+            local_repos = set(x["name"] for x in self.local_data["repo"])
+            for repo in self.remote.get_item_names("repo"):
+                if repo in local_repos:
+                    self.must_include["repo"][repo] = 1
 
         if self.prune:
             self.logger.info("Removing Objects Not Stored On Master")
-            obj_types = OBJ_TYPES[:]
-            if len(self.system_patterns) == 0 and "system" in obj_types:
-                obj_types.remove("system")
-            for what in obj_types:
-                self.remove_objects_not_on_master(what)
+            if changes is None:
+                obj_types = OBJ_TYPES[:]
+                if len(self.system_patterns) == 0 and "system" in obj_types:
+                    obj_types.remove("system")
+                for what in obj_types:
+                    self.remove_objects_not_on_master(what)
+            else:
+                self.remove_objects_deleted_on_master(changes)
         else:
             self.logger.info("*NOT* Removing Objects Not Stored On Master")
 
         if not self.omit_data:
-            self.logger.info("Rsyncing distros")
+            jobs = []
+            # the objects whose data the jobs transfer
+            job_objects = {}
             for distro in list(self.must_include["distro"].keys()):
                 if self.must_include["distro"][distro] == 1:
-                    self.logger.info("Rsyncing distro %s" % distro)
-                    target = self.remote.get_distro(distro)
+                    target = self.remote_dict["distro"].get(distro)
+                    if target is None:
+                        self.logger.error("Failed to rsync distro %s" % distro)
+                        continue
                     target_webdir = os.path.join(self.remote_settings["webdir"], "distro_mirror")
                     tail = utils.path_tail(target_webdir, target["kernel"])
                     if tail != "":
-                        try:
-                            # path_tail(a,b) returns something that looks like
-                            # an absolute path, but it's really the sub-path
-                            # from a that is contained in b. That means we want
-                            # the first element of the path
-                            dest = os.path.join(self.settings.webdir, "distro_mirror", tail.split("/")[1])
-                            self.rsync_it("distro-%s" % target["name"], dest)
-                        except:
-                            self.logger.error("Failed to rsync distro %s" % distro)
-                            continue
+                        # path_tail(a,b) returns something that looks like
+                        # an absolute path, but it's really the sub-path
+                        # from a that is contained in b. That means we want
+                        # the first element of the path
+                        dest = os.path.join(self.settings.webdir, "distro_mirror", tail.split("/")[1])
+                        jobs.append(("distro-%s" % target["name"], dest))
+                        job_objects[jobs[-1]] = ("distro", target["uid"], target["name"])
                     else:
                         self.logger.warning("Skipping distro %s, as it doesn't appear to live under distro_mirror" % distro)
 
-            self.logger.info("Rsyncing repos")
             for repo in list(self.must_include["repo"].keys()):
                 if self.must_include["repo"][repo] == 1:
-                    self.rsync_it("repo-%s" % repo, os.path.join(self.settings.webdir, "repo_mirror", repo), "repo")
-
-            self.logger.info("Rsyncing distro repo configs")
-            self.rsync_it("cobbler-distros/config/", os.path.join(self.settings.webdir, "distro_mirror", "config"))
-            self.logger.info("Rsyncing automatic installation templates & snippets")
-            self.rsync_it("cobbler-autoinstalls", "/var/lib/cobbler/autoinstall_templates")
-            self.rsync_it("cobbler-snippets", "/var/lib/cobbler/autoinstall_snippets")
-            self.logger.info("Rsyncing triggers")
-            self.rsync_it("cobbler-triggers", "/var/lib/cobbler/triggers")
-            self.logger.info("Rsyncing scripts")
-            self.rsync_it("cobbler-scripts", "/var/lib/cobbler/scripts")
+                    jobs.append(("repo-%s" % repo, os.path.join(self.settings.webdir, "repo_mirror", repo), "repo"))
+                    target = self.remote_dict["repo"].get(repo)
+                    if target is not None:
+                        job_objects[jobs[-1]] = ("repo", target["uid"], repo)
+
+            jobs.append(("cobbler-distros/config/", os.path.join(self.settings.webdir, "distro_mirror", "config")))
+            jobs.append(("cobbler-autoinstalls", "/var/lib/cobbler/autoinstall_templates"))
+            jobs.append(("cobbler-snippets", "/var/lib/cobbler/autoinstall_snippets"))
+            jobs.append(("cobbler-triggers", "/var/lib/cobbler/triggers"))
+            jobs.append(("cobbler-scripts", "/var/lib/cobbler/scripts"))
+            self.logger.info("Rsyncing distros, repos, distro repo configs, automatic installation templates, snippets, "
+                             "triggers and scripts")
+            for job in self.rsync_all(jobs):
+                if job in job_objects:
+                    self.mark_failed(*job_objects[job])
         else:
             self.logger.info("*NOT* Rsyncing Data")
 
-        self.logger.info("Removing Objects Not Stored On Local")
+        self.logger.info("Adding Objects Not Stored On Local")
         for what in OBJ_TYPES:
             self.add_objects_not_on_local(what)
 
@@ -224,6 +451,8 @@ class Replicate(object):
         for what in OBJ_TYPES:
             self.replace_objects_newer_on_remote(what)
 
+        self.commit_pending()
+
     def link_distros(self):
         """
         Link a distro from its location into the web directory to make it available for usage.
@@ -397,11 +626,17 @@ class Replicate(object):
         self.remote = xmlrpc.client.Server(self.uri)
         self.logger.debug("test BETA")
         self.remote.ping()
-        self.local = xmlrpc.client.Server("http://127.0.0.1:%s/cobbler_api" % self.settings.http_port)
-        self.local.ping()
+        self.options = [self.distro_patterns, self.profile_patterns, self.system_patterns, self.repo_patterns,
+                        self.image_patterns, self.mgmtclass_patterns, self.package_patterns, self.file_patterns,
+                        self.prune, self.omit_data, self.sync_all]
 
         self.replicate_data()
         self.link_distros()
         self.logger.info("Syncing")
         self.api.sync(logger=self.logger)
+        if self.sequence is not None:
+            if self.failed:
+                self.logger.warning("%d objects failed to replicate, they are retried by the next replication"
+                                    % len(self.failed))
+            self.save_state()
         self.logger.info("Done")
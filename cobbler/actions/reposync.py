@@ -23,11 +23,18 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
 
 from builtins import range
 from builtins import object
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import os
 import os.path
 import pipes
 import stat
 import shutil
+import threading
+import time
+import urllib.parse
+
+import simplejson
 
 HAS_LIBREPO = True
 try:
@@ -40,6 +47,13 @@ from cobbler import utils
 from cobbler import download_manager
 from cobbler.utils import os_release
 
+# Stored in a mirrored repo, the fingerprint of the upstream metadata the mirror was last synced from.
+FINGERPRINT_FILE = ".upstream_fingerprint"
+# Seconds to wait for the upstream metadata when fingerprinting it.
+FINGERPRINT_TIMEOUT = 60
+# The version of the installed createrepo, probed once.
+CREATEREPO_VERSION = None
+
 
 def repo_walker(top, func, arg):
     """
@@ -101,6 +115,11 @@ class RepoSync(object):
         self.nofail = nofail
         self.logger = logger
         self.dlmgr = download_manager.DownloadManager(self.collection_mgr, self.logger)
+        # the environment of the repo the current thread syncs
+        self.local = threading.local()
+        self.host_slots = {}
+        self.host_slots_lock = threading.Lock()
+        self.aborted = False
 
         if logger is None:
             self.logger = clogger.Logger()
@@ -111,9 +130,10 @@ class RepoSync(object):
 
     def run(self, name=None, verbose=True):
         """
-        Syncs the current repo configuration file with the filesystem.
+        Syncs the current repo configuration file with the filesystem. Up to ``reposync_workers`` repos are synced at
+        the same time, at most ``reposync_host_connections`` of them from the same upstream host.
 
-        :param name: The name of the repository to synchronize.
+        :param name: The name of the repository to synchronize, or a list of names.
         :param verbose: If the action should be logged verbose or not.
         :type verbose: bool
         """
@@ -127,69 +147,128 @@ class RepoSync(object):
 
         self.verbose = verbose
 
-        report_failure = False
+        names = name
+        if isinstance(names, str):
+            names = [names]
+        repos = []
         for repo in self.repos:
-            if name is not None and repo.name != name:
-                # Invoked to sync only a specific repo, this is not the one
+            if names is not None and repo.name not in names:
+                # Invoked to sync only specific repos, this is not one of them
                 continue
-            elif name is None and not repo.keep_updated:
+            elif names is None and not repo.keep_updated:
                 # Invoked to run against all repos, but this one is off
                 self.logger.info("%s is set to not be updated" % repo.name)
                 continue
+            repos.append(repo)
+
+        self.aborted = False
+        with ThreadPoolExecutor(max_workers=max(1, self.settings.reposync_workers)) as executor:
+            results = list(executor.map(self.sync_repo, repos))
+
+        failed = [result["name"] for result in results if result["state"] == "failed"]
+        for result in results:
+            self.logger.info("reposync of %(name)s: %(state)s (%(time).1fs)" % result)
+        if failed:
+            if not self.nofail:
+                utils.die(self.logger, "reposync failed, retry limit reached, aborting: %s" % ", ".join(failed))
+            utils.die(self.logger, "overall reposync failed, %d of %d repos failed to synchronize: %s"
+                      % (len(failed), len(results), ", ".join(failed)))
+
+    def sync_repo(self, repo):
+        """
+        Sync a single repo, retrying as often as configured. External commands run with the environment of the repo
+        instead of Cobbler's own one, so repos can be synced in parallel.
 
-            repo_mirror = os.path.join(self.settings.webdir, "repo_mirror")
-            repo_path = os.path.join(repo_mirror, repo.name)
-
-            if not os.path.isdir(repo_path) and not repo.mirror.lower().startswith("rhn://"):
-                os.makedirs(repo_path)
-
-            # Set the environment keys specified for this repo and save the old one if they modify an existing variable.
-
-            env = repo.environment
-            old_env = {}
-
-            for k in list(env.keys()):
-                self.logger.debug("setting repo environment: %s=%s" % (k, env[k]))
-                if env[k] is not None:
-                    if os.getenv(k):
-                        old_env[k] = os.getenv(k)
-                    else:
-                        os.environ[k] = env[k]
-
-            # Which may actually NOT reposync if the repo is set to not mirror locally but that's a technicality.
-
-            for x in range(self.tries + 1, 1, -1):
-                success = False
-                try:
-                    self.sync(repo)
-                    success = True
-                    break
-                except:
-                    utils.log_exc(self.logger)
-                    self.logger.warning("reposync failed, tries left: %s" % (x - 2))
-
-            # Cleanup/restore any environment variables that were added or changed above.
-
-            for k in list(env.keys()):
-                if env[k] is not None:
-                    if k in old_env:
-                        self.logger.debug("resetting repo environment: %s=%s" % (k, old_env[k]))
-                        os.environ[k] = old_env[k]
-                    else:
-                        self.logger.debug("removing repo environment: %s=%s" % (k, env[k]))
-                        del os.environ[k]
-
-            if not success:
-                report_failure = True
-                if not self.nofail:
-                    utils.die(self.logger, "reposync failed, retry limit reached, aborting")
-                else:
-                    self.logger.error("reposync failed, retry limit reached, skipping")
+        :param repo: The repo to sync.
+        :return: The name of the repo, the state ("complete", "failed" or "skipped"), the time the sync took and the
+                 error of the last try.
+        :rtype: dict
+        """
+        result = {"name": repo.name, "state": "skipped", "time": 0.0, "error": ""}
+        if self.aborted:
+            # an earlier repo failed and nofail is not set
+            return result
 
-            self.update_permissions(repo_path)
+        repo_mirror = os.path.join(self.settings.webdir, "repo_mirror")
+        repo_path = os.path.join(repo_mirror, repo.name)
 
-        if report_failure:
-            utils.die(self.logger, "overall reposync failed, at least one repo failed to synchronize")
+        if not os.path.isdir(repo_path) and not repo.mirror.lower().startswith("rhn://"):
+            os.makedirs(repo_path)
+
+        self.local.env = self.repo_environment(repo)
+        start = time.time()
+        success = False
+        try:
+            with self.host_slot(repo):
+                # Which may actually NOT reposync if the repo is set to not mirror locally but that's a technicality.
+                for x in range(self.tries + 1, 1, -1):
+                    try:
+                        self.sync(repo)
+                        success = True
+                        break
+                    except Exception as e:
+                        result["error"] = str(e)
+                        utils.log_exc(self.logger)
+                        self.logger.warning("reposync of %s failed, tries left: %s" % (repo.name, x - 2))
+        finally:
+            self.local.env = None
+        result["time"] = time.time() - start
+
+        if success:
+            result["state"] = "complete"
+        else:
+            result["state"] = "failed"
+            if not self.nofail:
+                self.aborted = True
+                self.logger.error("reposync of %s failed, retry limit reached, aborting" % repo.name)
+            else:
+                self.logger.error("reposync of %s failed, retry limit reached, skipping" % repo.name)
+
+        self.update_permissions(repo_path)
+        return result
+
+    def repo_environment(self, repo):
+        """
+        The environment the external commands syncing a repo run with: Cobbler's environment plus the variables set for
+        the repo.
+
+        :param repo: The repo to sync.
+        :return: The environment or None if the repo does not set any variables.
+        :rtype: dict
+        """
+        variables = dict((k, v) for (k, v) in list(repo.environment.items()) if v is not None)
+        if not variables:
+            return None
+        env = dict(os.environ)
+        for k in variables:
+            self.logger.debug("setting repo environment for %s: %s=%s" % (repo.name, k, variables[k]))
+        env.update(variables)
+        return env
+
+    def host_slot(self, repo):
+        """
+        The semaphore limiting the number of repos synced at the same time from the upstream host of a repo.
+
+        :param repo: The repo to sync.
+        :return: The semaphore of the host, or a lock nobody else holds if there is no limit.
+        """
+        limit = self.settings.reposync_host_connections
+        if limit <= 0:
+            return threading.Lock()
+        host = urllib.parse.urlparse(repo.mirror.strip()).hostname or repo.mirror.strip()
+        with self.host_slots_lock:
+            if host not in self.host_slots:
+                self.host_slots[host] = threading.BoundedSemaphore(limit)
+            return self.host_slots[host]
+
+    def subprocess_call(self, cmd):
+        """
+        Run a command with the environment of the repo the current thread syncs.
+
+        :param cmd: The command to execute.
+        :return: The return code of the process.
+        """
+        return utils.subprocess_call(self.logger, cmd, env=getattr(self.local, "env", None))
 
     # ==================================================================================
 
@@ -261,26 +340,138 @@ class RepoSync(object):
                 if "prestodelta" in rd: 
                     # need createrepo >= 0.9.7 to add deltas 
                     if utils.get_family() in ("redhat", "suse"): 
-                        cmd = "/usr/bin/rpmquery --queryformat=%{VERSION} createrepo" 
-                        createrepo_ver = utils.subprocess_get(self.logger, cmd) 
-                        if not createrepo_ver[0:1].isdigit(): 
-                            cmd = "/usr/bin/rpmquery --queryformat=%{VERSION} createrepo_c" 
-                            createrepo_ver = utils.subprocess_get(self.logger, cmd) 
-                        if utils.compare_versions_gt(createrepo_ver, "0.9.7"): 
+                        if utils.compare_versions_gt(self.createrepo_version(), "0.9.7"): 
                             mdoptions.append("--deltas") 
                         else: 
                             self.logger.error("this repo has presto metadata; you must upgrade createrepo to >= 0.9.7 first and then need to resync the repo through Cobbler.") 
 
             blended = utils.blender(self.api, False, repo)
             flags = blended.get("createrepo_flags", "(ERROR: FLAGS)")
+            if os.path.isfile(os.path.join(dirname, "repodata", "repomd.xml")) and "--update" not in flags.split():
+                # only read the packages which were added or changed since the last run
+                mdoptions.append("--update")
             try:
                 cmd = "createrepo %s %s %s" % (" ".join(mdoptions), flags, pipes.quote(dirname))
-                utils.subprocess_call(self.logger, cmd)
+                self.subprocess_call(cmd)
             except:
                 utils.log_exc(self.logger)
                 self.logger.error("createrepo failed.")
             del fnames[:]           # we're in the right place
 
+    def createrepo_version(self):
+        """
+        The version of the installed createrepo or createrepo_c. It is only queried once.
+
+        :return: The version.
+        :rtype: str
+        """
+        global CREATEREPO_VERSION
+        if CREATEREPO_VERSION is None:
+            cmd = "/usr/bin/rpmquery --queryformat=%{VERSION} createrepo"
+            createrepo_ver = utils.subprocess_get(self.logger, cmd)
+            if not createrepo_ver[0:1].isdigit():
+                cmd = "/usr/bin/rpmquery --queryformat=%{VERSION} createrepo_c"
+                createrepo_ver = utils.subprocess_get(self.logger, cmd)
+            CREATEREPO_VERSION = createrepo_ver
+        return CREATEREPO_VERSION
+
+    # ====================================================================================
+
+    def upstream_fingerprint(self, repo):
+        """
+        Fingerprint the upstream metadata of a repo, ``repomd.xml`` for yum and the ``Release`` files for apt, together
+        with the settings of the repo which change what gets mirrored.
+
+        :param repo: The repo to fingerprint.
+        :return: The fingerprint or None if it can't be computed, e.g. for mirrorlists. Then the repo is always synced.
+        :rtype: str
+        """
+        mirror = repo.mirror.strip().rstrip("/")
+        if not mirror.startswith(("http://", "https://")):
+            return None
+        if repo.breed == "yum" and repo.mirror_type == "baseurl":
+            urls = [mirror + "/repodata/repomd.xml"]
+        elif repo.breed == "apt":
+            urls = [mirror + "/dists/%s/Release" % dist for dist in repo.apt_dists]
+        else:
+            return None
+
+        blended = utils.blender(self.api, False, repo)
+        digest = hashlib.sha256()
+        digest.update(simplejson.dumps([mirror, repo.arch, repo.rpm_list, repo.yumopts, repo.apt_components,
+                                        blended.get("createrepo_flags", ""), self.rflags], sort_keys=True).encode())
+        proxy = self.repo_proxy(repo)
+        proxies = {"http": proxy, "https": proxy} if proxy else {}
+        (cert, verify) = self.gen_urlgrab_ssl_opts(repo.yumopts)
+        for url in urls:
+            try:
+                response = self.dlmgr.urlread(url, proxies=proxies, cert=cert, verify=verify,
+                                              timeout=FINGERPRINT_TIMEOUT)
+            except Exception as e:
+                self.logger.warning("could not fetch %s, syncing %s anyway: %s" % (url, repo.name, e))
+                return None
+            if response.status_code != 200:
+                self.logger.warning("could not fetch %s, syncing %s anyway: HTTP %s"
+                                    % (url, repo.name, response.status_code))
+                return None
+            digest.update(response.content)
+        return digest.hexdigest()
+
+    def upstream_unchanged(self, repo, dest_path, metadata_path):
+        """
+        Check whether a mirror is complete and its upstream has not changed since it was synced. If it has, the stored
+        fingerprint is removed, it is only written again by store_fingerprint() after the sync succeeded.
+
+        :param repo: The repo to check.
+        :param dest_path: The directory of the mirror.
+        :param metadata_path: A file or directory the mirror has when it is complete.
+        :return: Whether the sync can be skipped and the current fingerprint.
+        :rtype: tuple
+        """
+        fingerprint = self.upstream_fingerprint(repo)
+        fingerprint_path = os.path.join(dest_path, FINGERPRINT_FILE)
+        stored = None
+        if os.path.isfile(fingerprint_path):
+            with open(fingerprint_path, "r") as fh:
+                stored = fh.read().strip()
+        if fingerprint is not None and fingerprint == stored and os.path.exists(metadata_path):
+            self.logger.info("upstream of %s has not changed, skipping" % repo.name)
+            return (True, fingerprint)
+        if stored is not None:
+            os.remove(fingerprint_path)
+        return (False, fingerprint)
+
+    def store_fingerprint(self, dest_path, fingerprint):
+        """
+        Remember the fingerprint of the upstream metadata a mirror was synced from.
+
+        :param dest_path: The directory of the mirror.
+        :param fingerprint: The fingerprint, nothing is stored if it is None.
+        """
+        if fingerprint is None:
+            return
+        with open(os.path.join(dest_path, FINGERPRINT_FILE), "w") as fh:
+            fh.write(fingerprint + "\n")
+
+    def repo_proxy(self, repo):
+        """
+        The proxy to reach the upstream of a repo with: the one of the repo, the ``proxy_url_ext`` setting if the repo
+        inherits it, or the one set in the environment of the repo.
+
+        :param repo: The repo.
+        :return: The proxy URL or None.
+        """
+        proxy = None
+        if repo.proxy == '<<inherit>>':
+            proxy = self.settings.proxy_url_ext
+        elif repo.proxy != '<<None>>' and repo.proxy != '':
+            proxy = repo.proxy
+        if not proxy:
+            # librepo and requests run in this process, so the repo environment has to be passed on explicitly
+            env = getattr(self.local, "env", None) or {}
+            proxy = env.get("https_proxy") or env.get("http_proxy")
+        return proxy or None
+
     # ====================================================================================
 
     def wget_sync(self, repo):
@@ -301,7 +492,7 @@ class RepoSync(object):
 
         # FIXME: wrapper for subprocess that logs to logger
         cmd = "wget -N -np -r -l inf -nd -P %s %s" % (pipes.quote(dest_path), pipes.quote(repo_mirror))
-        rc = utils.subprocess_call(self.logger, cmd)
+        rc = self.subprocess_call(cmd)
 
         if rc != 0:
             utils.die(self.logger, "cobbler reposync failed")
@@ -344,7 +535,7 @@ class RepoSync(object):
             flags = self.settings.reposync_rsync_flags
 
         cmd = "rsync %s --delete-after %s --delete --exclude-from=/etc/cobbler/rsync.exclude %s %s" % (flags, spacer, pipes.quote(repo.mirror), pipes.quote(dest_path))
-        rc = utils.subprocess_call(self.logger, cmd)
+        rc = self.subprocess_call(cmd)
 
         if rc != 0:
             utils.die(self.logger, "cobbler reposync failed")
@@ -444,7 +635,7 @@ class RepoSync(object):
         # rhn://, execute all queued commands here. Any failure at any point stops the operation.
 
         if repo.mirror_locally:
-            utils.subprocess_call(self.logger, cmd)
+            self.subprocess_call(cmd)
 
         # Some more special case handling for RHN. Create the config file now, because the directory didn't exist
         # earlier.
@@ -503,6 +694,11 @@ class RepoSync(object):
         if not repo.mirror_locally:
             return
 
+        (unchanged, fingerprint) = self.upstream_unchanged(repo, dest_path,
+                                                           os.path.join(dest_path, "repodata", "repomd.xml"))
+        if unchanged:
+            return
+
         # command to run
         cmd = self.reposync_cmd()
         # flag indicating not to pull the whole repo
@@ -514,7 +710,9 @@ class RepoSync(object):
 
         # create yum config file for use by reposync
         temp_path = os.path.join(dest_path, ".origin")
- 
+        repodata_path = os.path.join(temp_path, "repodata")
+        repomd_path = os.path.join(repodata_path, "repomd.xml")
+
         if not os.path.isdir(temp_path):
             # FIXME: there's a chance this might break the RHN D/L case
             os.makedirs(temp_path)
@@ -555,16 +753,12 @@ class RepoSync(object):
         # Now regardless of whether we're doing yumdownloader or reposync or whether the repo was http://, ftp://, or
         # rhn://, execute all queued commands here.  Any failure at any point stops the operation.
 
-        rc = utils.subprocess_call(self.logger, cmd)
+        rc = self.subprocess_call(cmd)
         if rc != 0:
             utils.die(self.logger, "cobbler reposync failed")
 
         # download any metadata we can use
-        proxy = None
-        if repo.proxy == '<<inherit>>':
-            proxy = self.settings.proxy_url_ext
-        elif repo.proxy != '<<None>>' and repo.proxy != '':
-            proxy = repo.proxy
+        proxy = self.repo_proxy(repo)
         (cert, verify) = self.gen_urlgrab_ssl_opts(repo.yumopts)
 
         if os.path.exists(repodata_path) and not os.path.isfile(repomd_path):
@@ -621,6 +815,8 @@ class RepoSync(object):
         if repo.mirror_locally:
             repo_walker(dest_path, self.createrepo_walker, repo)
 
+        self.store_fingerprint(dest_path, fingerprint)
+
     # ====================================================================================
 
     def apt_sync(self, repo):
@@ -654,6 +850,10 @@ class RepoSync(object):
             # mirror = repo.mirror.replace("@@suite@@",repo.os_version)
             mirror = repo.mirror
 
+            (unchanged, fingerprint) = self.upstream_unchanged(repo, dest_path, os.path.join(dest_path, "dists"))
+            if unchanged:
+                return
+
             idx = mirror.find("://")
             method = mirror[:idx]
             mirror = mirror[idx + 3:]
@@ -689,13 +889,15 @@ class RepoSync(object):
 
             # Set's an environment variable for subprocess, otherwise debmirror will fail as it needs this variable to
             # exist.
-            # FIXME: might this break anything? So far it doesn't
-            os.putenv("HOME", "/var/lib/cobbler")
+            env = dict(getattr(self.local, "env", None) or os.environ)
+            env["HOME"] = "/var/lib/cobbler"
 
-            rc = utils.subprocess_call(self.logger, cmd)
+            rc = utils.subprocess_call(self.logger, cmd, env=env)
             if rc != 0:
                 utils.die(self.logger, "cobbler reposync failed")
 
+            self.store_fingerprint(dest_path, fingerprint)
+
     def create_local_file(self, dest_path, repo, output=True):
         """
         Creates Yum config files for use by reposync
@@ -809,7 +1011,7 @@ class RepoSync(object):
 
         cmd1 = "chown -R " + owner + " %s" % repo_path
 
-        utils.subprocess_call(self.logger, cmd1)
+        self.subprocess_call(cmd1)
 
         cmd2 = "chmod -R 755 %s" % repo_path
-        utils.subprocess_call(self.logger, cmd2)
+        self.subprocess_call(cmd2)
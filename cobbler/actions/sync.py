@@ -28,6 +28,7 @@ import time
 
 from cobbler.cexceptions import CX
 from cobbler import clogger
+from cobbler import sync_manifest
 from cobbler import templar
 from cobbler import tftpgen
 from cobbler import utils
@@ -99,24 +100,47 @@ class CobblerSync(object):
         self.repos = self.collection_mgr.repos()
 
         # execute the core of the sync operation
-        self.logger.info("cleaning trees")
-        self.clean_trees()
-
-        # Have the tftpd module handle copying bootloaders, distros, images, and all_system_files
-        self.tftpd.sync(self.verbose)
-        # Copy distros to the webdir
-        # Adding in the exception handling to not blow up if files have been moved (or the path references an NFS
-        # directory that's no longer mounted)
-        for d in self.distros:
-            try:
-                self.logger.info("copying files for distro: %s" % d.name)
-                self.tftpgen.copy_single_distro_files(d, self.settings.webdir, True)
-                self.tftpgen.write_templates(d, write_file=True)
-            except CX as e:
-                self.logger.error(e.value)
-
-        # make the default pxe menu anyway...
-        self.tftpgen.make_pxe_menu()
+        # An incremental sync keeps the trees and only replaces the files whose inputs changed. A full sync starts
+        # from scratch, but records what it generated as well so the next incremental sync can build upon it.
+        manifest = sync_manifest.SyncManifest(logger=self.logger)
+        # Image files may have appeared or vanished since the menu items were cached.
+        tftpgen.invalidate_menu_items()
+        if self.settings.incremental_sync:
+            self.logger.info("loading sync manifest")
+            manifest.load()
+            self.make_tftpboot()
+        else:
+            self.logger.info("cleaning trees")
+            self.clean_trees()
+
+        sync_manifest.activate(manifest)
+        # the sums of the kernels and initrds linked into the caches are written once at the end
+        utils.begin_hash_batch()
+        try:
+            # Have the tftpd module handle copying bootloaders, distros, images, and all_system_files
+            self.tftpd.sync(self.verbose)
+            # Copy distros to the webdir
+            # Adding in the exception handling to not blow up if files have been moved (or the path references an NFS
+            # directory that's no longer mounted)
+            for d in self.distros:
+                try:
+                    self.logger.info("copying files for distro: %s" % d.name)
+                    self.tftpgen.copy_single_distro_files(d, self.settings.webdir, True)
+                    self.tftpgen.write_templates(d, write_file=True)
+                except CX as e:
+                    self.logger.error(e.value)
+
+            # make the default pxe menu anyway...
+            self.tftpgen.make_pxe_menu()
+        finally:
+            utils.end_hash_batch(self.logger)
+            sync_manifest.deactivate()
+
+        if self.settings.incremental_sync:
+            self.logger.info("removing orphaned files")
+            manifest.remove_orphans()
+            self.clean_image_trees()
+        manifest.save()
 
         if self.settings.manage_dhcp:
             self.write_dhcp()
@@ -136,6 +160,11 @@ class CobblerSync(object):
             self.logger.info("rendering Rsync files")
             self.rsync_gen()
 
+        stats = utils.blender_cache_stats()
+        self.logger.info("blender cache: %(hits)s hits, %(misses)s misses, %(entries)s entries" % stats)
+        stats = templar.template_cache_stats()
+        self.logger.info("template cache: %(hits)s hits, %(misses)s misses, %(entries)s entries" % stats)
+
         # run post-triggers
         self.logger.info("running post-sync triggers")
         utils.run_triggers(self.api, None, "/var/lib/cobbler/triggers/sync/post/*", logger=self.logger)
@@ -193,6 +222,31 @@ class CobblerSync(object):
         utils.rmtree_contents(self.yaboot_cfg_dir, logger=self.logger)
         utils.rmtree_contents(self.rendered_dir, logger=self.logger)
 
+    def clean_image_trees(self):
+        """
+        Remove the image directories of distros and the image files of images which don't exist anymore. A full sync
+        empties these trees in ``clean_trees()``. An incremental sync keeps them, the manifest only removes the single
+        files which are not generated anymore, but not the directories they were in.
+        """
+        distro_names = [d.name for d in self.distros]
+        for dirtree in [self.images_dir, os.path.join(self.settings.webdir, "images")]:
+            if not os.path.isdir(dirtree):
+                continue
+            for x in os.listdir(dirtree):
+                path = os.path.join(dirtree, x)
+                if x not in distro_names and os.path.isdir(path) and not os.path.islink(path):
+                    self.logger.info("removing orphaned distro directory: %s" % path)
+                    utils.rmtree(path, logger=self.logger)
+
+        image_names = [i.name for i in self.collection_mgr.images()]
+        images2_dir = os.path.join(self.bootloc, "images2")
+        if os.path.isdir(images2_dir):
+            for x in os.listdir(images2_dir):
+                path = os.path.join(images2_dir, x)
+                if x not in image_names and not os.path.isdir(path):
+                    self.logger.info("removing orphaned image file: %s" % path)
+                    utils.rmfile(path, logger=self.logger)
+
     def write_dhcp(self):
         """
         Write all files which are associated to DHCP.
@@ -211,12 +265,14 @@ class CobblerSync(object):
 
     def clean_link_cache(self):
         """
-        All files which are linked into the cache will be deleted so the cache can be rebuild.
+        All files which are not linked anywhere else anymore will be deleted from the cache. The database with the sums
+        of the cached files is kept.
         """
         for dirtree in [os.path.join(self.bootloc, 'images'), self.settings.webdir]:
             cachedir = os.path.join(dirtree, '.link_cache')
             if os.path.isdir(cachedir):
-                cmd = "find %s -maxdepth 1 -type f -links 1 -exec rm -f '{}' ';'" % cachedir
+                cmd = "find %s -maxdepth 1 -type f -links 1 ! -name '%s*' -exec rm -f '{}' ';'" \
+                      % (cachedir, utils.HASH_DB_FILE)
                 utils.subprocess_call(self.logger, cmd)
 
     def rsync_gen(self):
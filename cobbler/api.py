@@ -25,8 +25,10 @@ from configparser import ConfigParser
 import os
 import random
 import tempfile
+import time
 
-from cobbler.actions import status, dlcontent, hardlink, sync, buildiso, replicate, report, log, acl, check, reposync
+from cobbler.actions import status, dlcontent, hardlink, sync, buildiso, replicate, report, log, acl, check, reposync, \
+    litesync
 from cobbler import autoinstall_manager
 from cobbler import clogger
 from cobbler.cobbler_collections import manager
@@ -738,6 +740,68 @@ class CobblerAPI(object):
         self.log("add_item(%s)" % what, [ref.name])
         self.get_items(what).add(ref, check_for_duplicate_names=check_for_duplicate_names, save=save, logger=logger)
 
+    def add_items(self, items, with_sync=True, logger=None):
+        """
+        Add many items at once. All items are validated and their pre triggers are run before anything is changed. The
+        items are then persisted while holding the serializer lock only once, and the files depending on them are
+        regenerated with a single lite sync. The change and post triggers run for every item, as they do for
+        ``add_item()``.
+
+        Because everything is validated before the first item is added, the items can only reference objects which
+        are stored already. A batch may therefore not contain a new object together with the objects which reference
+        it, e.g. a new distro and its profiles. Add those in separate batches, in dependency order.
+
+        :param items: A list of tuples with the item type and the item to add.
+        :type items: list
+        :param with_sync: If the files depending on the items should be regenerated. Callers which run a full sync
+                          afterwards can skip it.
+        :type with_sync: bool
+        :param logger: The logger to audit the action with.
+        :raises CX: If an item is invalid or references a new object of the same batch.
+        """
+        self.log("add_items", [ref.name for (what, ref) in items])
+        new = set((what, ref.name.lower()) for (what, ref) in items if self.get_item(what, ref.name) is None)
+        for (what, ref) in items:
+            if ref.COLLECTION_TYPE != what:
+                raise CX(_("API error: storing wrong data type in collection"))
+            references = []
+            if what == "profile":
+                references = [("distro", ref.distro), ("profile", ref.parent)]
+            elif what == "system":
+                references = [("profile", ref.profile), ("image", ref.image)]
+            for (ref_type, ref_name) in references:
+                if isinstance(ref_name, str) and (ref_type, ref_name.lower()) in new:
+                    raise CX(_("%s %s references the %s %s which is added by the same batch, add it in an earlier "
+                               "batch") % (what, ref.name, ref_type, ref_name))
+            ref.check_if_valid()
+        # failure of a pre trigger will prevent all objects from being added
+        for (what, ref) in items:
+            utils.run_triggers(self, ref, "/var/lib/cobbler/triggers/add/%s/pre/*" % what, [], logger)
+
+        now = time.time()
+        serialize = []
+        changes = []
+        for (what, ref) in items:
+            if ref.ctime == 0:
+                ref.ctime = now
+            ref.mtime = now
+            collection = self.get_items(what)
+            if collection.get(ref.name) is None:
+                changes.append("add")
+            else:
+                changes.append("modify")
+            collection.add(ref, logger=logger)
+            serialize.append((collection, ref))
+        self._collection_mgr.serialize_items(serialize, changes)
+
+        if with_sync:
+            lite_sync = litesync.CobblerLiteSync(self._collection_mgr, logger=logger)
+            lite_sync.add_items([ref for (what, ref) in items])
+
+        for (what, ref) in items:
+            utils.run_triggers(self, ref, "/var/lib/cobbler/triggers/change/*", [], logger)
+            utils.run_triggers(self, ref, "/var/lib/cobbler/triggers/add/%s/post/*" % what, [], logger)
+
     def add_distro(self, ref, check_for_duplicate_names=False, save=True, logger=None):
         """
         Add a distribution to Cobbler.
@@ -973,6 +1037,21 @@ class CobblerAPI(object):
                     results2.append(x.to_dict())
         return results2
 
+    def get_changes(self, sequence, what=None, epoch=None):
+        """
+        Returns the changes to the objects after a sequence number of the change log. Unlike the ``get_*_since``
+        functions this also reports deletions and renames and does not depend on the clocks being in sync.
+
+        :param sequence: The sequence number returned by the last call, 0 for everything in the change log.
+        :param what: Only return the changes of this object type.
+        :param epoch: The epoch returned by the last call, None if unknown.
+        :return: The list of changes, the sequence number to pass next time, whether the list is complete and the epoch
+                 to pass next time. If the list is not complete, the change log was compacted past the sequence number
+                 or started over and all objects have to be fetched again.
+        :rtype: tuple
+        """
+        return self._collection_mgr.change_log().changes_since(sequence, what, epoch)
+
     def get_distros_since(self, mtime, collapse=False):
         """
         Returns distros modified since a certain time (in seconds since Epoch)
@@ -1240,6 +1319,25 @@ class CobblerAPI(object):
 
     # ==========================================================================
 
+    def generate_system_config(self, mac_address, loader="pxe"):
+        """
+        Generate the boot loader configuration of the system interface with a MAC address, as it would be written to
+        ``pxelinux.cfg/01-<mac>`` or ``grub/system/<mac>``.
+
+        :param mac_address: The MAC address of the interface.
+        :param loader: Either "pxe" or "grub".
+        :return: The generated configuration file or None if there is no such interface or it doesn't boot from one.
+        """
+        self.log("generate_system_config")
+        mac_address = mac_address.replace("-", ":").lower()
+        for obj in self.find_items("system", criteria={"mac_address": mac_address.upper()}):
+            for interface in list(obj.interfaces.keys()):
+                if (obj.get_mac_address(interface) or "").lower() == mac_address:
+                    return self.tftpgen.generate_system_config(obj, interface, loader)
+        return None
+
+    # ==========================================================================
+
     def generate_bootcfg(self, profile, system):
         """
         Generate a boot configuration. The system wins over the profile.
@@ -1378,7 +1476,7 @@ class CobblerAPI(object):
         Take the contents of ``/var/lib/cobbler/repos`` and update them -- or create the initial copy if no contents
         exist yet.
 
-        :param name: The name of the repository to run reposync for.
+        :param name: The name of the repository to run reposync for, or a list of names.
         :param tries: How many tries should be executed before the action fails.
         :param nofail: If True then the action will fail, otherwise the action will just be skipped. This respects the
                        ``tries`` parameter.
@@ -4,6 +4,7 @@ import os
 
 from cobbler import autoinstallgen
 from cobbler import clogger
+from cobbler import template_api
 from cobbler import utils
 from cobbler.cexceptions import CX
 
@@ -134,6 +135,7 @@ class AutoInstallationManager(object):
         fileh = open(file_full_path, "w+")
         fileh.write(data)
         fileh.close()
+        template_api.snippet_cache_invalidate(file_full_path)
 
         return True
 
@@ -253,6 +255,7 @@ class AutoInstallationManager(object):
 
         file_full_path = "%s/%s" % (self.snippets_base_dir, file_path)
         os.remove(file_full_path)
+        template_api.snippet_cache_invalidate(file_full_path)
 
         return True
 
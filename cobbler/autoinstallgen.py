@@ -22,15 +22,41 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
 """
 
 from builtins import object
+import collections
+import threading
 import urllib.parse
 import xml.dom.minidom
 
+from cobbler import template_api
 from cobbler import templar
 from cobbler import utils
 from cobbler import validate
 from cobbler.cexceptions import FileNotFoundException, CX
 from cobbler.utils import _
 
+# Rendered automatic installation files keyed by object type and name, together with everything they were rendered
+# from, in least recently used order. See AutoInstallationGen.generate_autoinstall().
+AUTOINSTALL_CACHE = collections.OrderedDict()
+AUTOINSTALL_CACHE_LOCK = threading.Lock()
+# One lock per cache key, so concurrent requests for the same file wait for a single render instead of all rendering it.
+# The locks are created on first use and dropped together with their cache entry.
+AUTOINSTALL_RENDER_LOCKS = {}
+
+DEFAULT_AUTOINSTALL_CACHE_SIZE = 1024
+
+
+def forget_autoinstall(obj_type, name):
+    """
+    Drop the cached automatic installation file of an object, e.g. because the object was removed or renamed.
+
+    :param obj_type: "profile" or "system".
+    :param name: The name of the object.
+    """
+    key = (obj_type, name)
+    with AUTOINSTALL_CACHE_LOCK:
+        AUTOINSTALL_CACHE.pop(key, None)
+        AUTOINSTALL_RENDER_LOCKS.pop(key, None)
+
 
 class AutoInstallationGen(object):
     """
@@ -297,11 +323,101 @@ class AutoInstallationGen(object):
             obj = profile
             obj_type = "profile"
 
+        size = self.__autoinstall_cache_size()
+        if not self.settings.cache_enabled or size <= 0:
+            return self.__render_autoinstall(profile, system)[0]
+
+        # During mass installations many hosts fetch the same file at once. The file is rendered once and kept until
+        # Cobbler's data (see last_modified_time()), the objects, the template or one of the snippets changes.
+        key = (obj_type, obj.name)
+        with AUTOINSTALL_CACHE_LOCK:
+            render_lock = AUTOINSTALL_RENDER_LOCKS.get(key)
+            if render_lock is None:
+                render_lock = threading.Lock()
+                AUTOINSTALL_RENDER_LOCKS[key] = render_lock
+        with render_lock:
+            signature = self.__autoinstall_signature(obj)
+            with AUTOINSTALL_CACHE_LOCK:
+                cached = AUTOINSTALL_CACHE.get(key)
+                if cached is not None:
+                    AUTOINSTALL_CACHE.move_to_end(key)
+            if cached is not None and cached["signature"] == signature and self.__files_unchanged(cached["files"]):
+                self.templar.last_errors = cached["errors"]
+                return cached["data"]
+
+            template_api.start_recording_snippets()
+            try:
+                (data, autoinstall_path) = self.__render_autoinstall(profile, system)
+            finally:
+                files = template_api.stop_recording_snippets()
+            if False in files.values():
+                # Remote snippets can change at any time.
+                forget_autoinstall(obj_type, obj.name)
+                return data
+            if autoinstall_path is not None:
+                files[autoinstall_path] = template_api.snippet_file_signature(autoinstall_path)
+            entry = {"signature": signature, "files": files, "data": data, "errors": self.templar.last_errors}
+            with AUTOINSTALL_CACHE_LOCK:
+                AUTOINSTALL_CACHE[key] = entry
+                AUTOINSTALL_CACHE.move_to_end(key)
+                while len(AUTOINSTALL_CACHE) > size:
+                    (old_key, _) = AUTOINSTALL_CACHE.popitem(last=False)
+                    AUTOINSTALL_RENDER_LOCKS.pop(old_key, None)
+            return data
+
+    def __autoinstall_cache_size(self):
+        """
+        Get the maximum number of rendered automatic installation files to keep.
+
+        :rtype: int
+        """
+        if self.settings:
+            return self.settings.autoinstall_cache_size
+        return DEFAULT_AUTOINSTALL_CACHE_SIZE
+
+    def __autoinstall_signature(self, obj):
+        """
+        Describe the state of Cobbler an automatic installation file of an object is rendered from.
+
+        :param obj: The profile or system.
+        :return: The signature as a tuple.
+        """
+        nodes = [(getattr(node, "mtime", None), utils.blender_cache_generation(node))
+                 for node in utils.grab_tree(self.api, obj)]
+        return (id(self.collection_mgr), self.api.last_modified_time(), nodes)
+
+    def __files_unchanged(self, files):
+        """
+        Check if the template and the snippets a cached file was rendered from are unchanged.
+
+        :param files: A dict with the paths of the files and their signatures when they were read.
+        :rtype: bool
+        """
+        for (path, signature) in files.items():
+            if template_api.snippet_file_signature(path) != signature:
+                return False
+        return True
+
+    def __render_autoinstall(self, profile=None, system=None):
+        """
+        Render an automatic installation file without looking at the cache. See ``generate_autoinstall()``.
+
+        :param profile: The profile to use for generating the autoinstall config/script.
+        :param system: The system to use for generating the autoinstall config/script.
+        :return: The rendered file and the path of the template, which is None if no template was read.
+        :rtype: tuple
+        """
+        obj = system
+        obj_type = "system"
+        if system is None:
+            obj = profile
+            obj_type = "profile"
+
         meta = utils.blender(self.api, False, obj)
         autoinstall_rel_path = meta["autoinstall"]
 
         if not autoinstall_rel_path:
-            return "# automatic installation file value missing or invalid at %s %s" % (obj_type, obj.name)
+            return "# automatic installation file value missing or invalid at %s %s" % (obj_type, obj.name), None
 
         # get parent distro
         distro = profile.get_conceptual_parent()
@@ -334,12 +450,12 @@ class AutoInstallationGen(object):
 
             data = self.templar.render(raw_data, meta, None, obj)
 
-            return data
+            return data, autoinstall_path
         except FileNotFoundException:
             error_msg = "automatic installation file %s not found at %s" \
                         % (meta["autoinstall"], self.settings.autoinstall_templates_dir)
             self.api.logger.warning(error_msg)
-            return "# %s" % error_msg
+            return "# %s" % error_msg, autoinstall_path
 
     def generate_autoinstall_for_profile(self, g):
         """
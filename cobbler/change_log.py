@@ -0,0 +1,214 @@
+"""
+Append-only log of the changes to the Cobbler objects. Every add, modification, rename and deletion gets a sequence
+number, so clients can ask for the changes after the last sequence number they have seen instead of scanning all
+objects for their mtime. Every log has a random epoch, which changes whenever the sequence numbers can't be trusted to
+continue where the client left off, e.g. because the log was lost or could not be written.
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+02110-1301  USA
+"""
+
+from builtins import object
+import bisect
+import contextlib
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+import simplejson
+
+from cobbler import clogger
+
+CHANGE_LOG_FILE = "/var/lib/cobbler/change_log"
+# The log is compacted when it grows beyond this number of entries.
+MAX_ENTRIES = 10000
+
+
+class ChangeLog(object):
+    """
+    The changes to the Cobbler objects, ordered by their sequence number.
+    """
+
+    def __init__(self, filename=CHANGE_LOG_FILE, max_entries=MAX_ENTRIES, logger=None):
+        """
+        Constructor
+
+        :param filename: Where the log is persisted.
+        :param max_entries: The number of entries after which the log is compacted.
+        :param logger: The logger to audit all actions with.
+        """
+        self.filename = filename
+        self.max_entries = max_entries
+        self.logger = logger
+        if self.logger is None:
+            self.logger = clogger.Logger()
+        self.entries = []
+        self.sequences = []
+        self.sequence = 0
+        self.horizon = 0
+        self.epoch = uuid.uuid4().hex
+        self.renames = {}
+        self.lock = threading.Lock()
+
+    def load(self):
+        """
+        Load the log from disk. A truncated last line, e.g. from a crash while appending, is ignored. A missing log or
+        one without an epoch starts a new epoch, so clients which knew the old sequence numbers resync.
+        """
+        with self.lock:
+            self.entries = []
+            self.sequence = 0
+            self.horizon = 0
+            self.epoch = None
+            if os.path.exists(self.filename):
+                with open(self.filename, "r") as fd:
+                    for line in fd:
+                        try:
+                            entry = simplejson.loads(line)
+                        except ValueError:
+                            self.logger.warning("ignoring damaged line in change log %s" % self.filename)
+                            continue
+                        if "horizon" in entry:
+                            self.horizon = entry["horizon"]
+                            self.sequence = max(self.sequence, entry["horizon"])
+                            self.epoch = entry.get("epoch", self.epoch)
+                            continue
+                        self.entries.append(entry)
+                        self.sequence = max(self.sequence, entry["sequence"])
+            self.sequences = [entry["sequence"] for entry in self.entries]
+            if self.epoch is None:
+                self.epoch = uuid.uuid4().hex
+                self.__rewrite()
+
+    def record(self, change, collection_type, ref):
+        """
+        Append a change to the log.
+
+        :param change: One of "add", "modify" or "delete".
+        :param collection_type: The type of the object, e.g. "system".
+        :param ref: The changed object.
+        """
+        with self.lock:
+            rename = self.renames.get((collection_type, ref.name.lower()))
+            if rename is not None:
+                if change == "delete":
+                    # the old object of a rename, the "rename" entry of the new one covers it
+                    return
+                change = "rename"
+            self.sequence += 1
+            entry = {
+                "sequence": self.sequence,
+                "change": change,
+                "type": collection_type,
+                "name": ref.name,
+                "uid": ref.uid,
+                "time": time.time(),
+            }
+            if rename is not None:
+                entry["old_name"] = rename
+            self.entries.append(entry)
+            self.sequences.append(self.sequence)
+            try:
+                with open(self.filename, "a") as fd:
+                    fd.write(simplejson.dumps(entry) + "\n")
+            except (IOError, OSError) as e:
+                # After a restart the sequence numbers would continue from the last persisted change and could
+                # repeat numbers clients have already seen. A new epoch makes those clients resync.
+                self.logger.warning("could not append to change log %s: %s" % (self.filename, e))
+                self.epoch = uuid.uuid4().hex
+            if len(self.entries) > self.max_entries:
+                self.__compact()
+
+    @contextlib.contextmanager
+    def renaming(self, collection_type, oldname, newname):
+        """
+        Record the add of the new object and the delete of the old one which make up a rename as a single "rename".
+
+        :param collection_type: The type of the object, e.g. "system".
+        :param oldname: The name before the rename.
+        :param newname: The name after the rename.
+        """
+        with self.lock:
+            self.renames[(collection_type, newname.lower())] = oldname
+            self.renames[(collection_type, oldname.lower())] = oldname
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.renames.pop((collection_type, newname.lower()), None)
+                self.renames.pop((collection_type, oldname.lower()), None)
+
+    def changes_since(self, sequence, collection_type=None, epoch=None):
+        """
+        Get the changes after a sequence number.
+
+        :param sequence: The last sequence number the caller has seen, 0 for all changes in the log.
+        :param collection_type: Only return the changes of this object type.
+        :param epoch: The epoch the caller got together with the sequence number, None if it doesn't know one.
+        :return: The changes, the sequence number to ask with next time, whether the changes are complete and the epoch
+                 to ask with next time. They are not complete if the log was compacted past the sequence number, if
+                 the epoch changed or if the sequence number is from the future, e.g. because the log was lost. Then
+                 the caller has to fetch all objects again.
+        :rtype: tuple
+        """
+        with self.lock:
+            start = bisect.bisect_right(self.sequences, sequence)
+            changes = self.entries[start:]
+            if collection_type is not None:
+                changes = [entry for entry in changes if entry["type"] == collection_type]
+            complete = self.horizon <= sequence <= self.sequence and epoch in (None, self.epoch)
+            return (changes, self.sequence, complete, self.epoch)
+
+    def __compact(self):
+        """
+        Shrink the log: Only the last change of every object and all renames are kept and, if that is not enough, the
+        oldest changes are dropped. Callers which missed a superseded change still get the later one, so the horizon
+        only moves past the oldest changes dropped to make room and callers which have not seen all of them get told
+        to do a full resync. The caller must hold the lock.
+        """
+        latest = {}
+        for entry in self.entries:
+            latest[(entry["type"], entry["uid"])] = entry["sequence"]
+        entries = [entry for entry in self.entries
+                   if entry["change"] == "rename" or latest[(entry["type"], entry["uid"])] == entry["sequence"]]
+        keep = self.max_entries // 2
+        if len(entries) > keep:
+            self.horizon = max(self.horizon, entries[-keep - 1]["sequence"])
+            entries = entries[-keep:]
+        self.entries = entries
+        self.sequences = [entry["sequence"] for entry in entries]
+        self.__rewrite()
+
+    def __rewrite(self):
+        """
+        Replace the log on disk with the entries in memory, headed by the horizon and the epoch. The caller must hold
+        the lock.
+        """
+        lines = [simplejson.dumps({"horizon": self.horizon, "epoch": self.epoch})]
+        lines.extend(simplejson.dumps(entry) for entry in self.entries)
+        (fd, tmp_path) = (None, None)
+        try:
+            (fd, tmp_path) = tempfile.mkstemp(dir=os.path.dirname(self.filename),
+                                              prefix=".%s." % os.path.basename(self.filename))
+            with os.fdopen(fd, "w") as tmp_fd:
+                tmp_fd.write("\n".join(lines) + "\n")
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, self.filename)
+        except (IOError, OSError) as e:
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            self.logger.warning("could not write change log %s: %s" % (self.filename, e))
@@ -791,8 +791,7 @@ class CobblerCLI(object):
         :param task_id: The id of the task to be pretty printed.
         """
         print("task started: %s" % task_id)
-        events = self.remote.get_events()
-        (etime, name, status, who_viewed) = events[task_id]
+        (etime, name, status, who_viewed) = self.remote.get_task_status(task_id)[:4]
         atime = time.asctime(time.localtime(etime))
         print("task started (id=%s, time=%s)" % (name, atime))
 
@@ -802,30 +801,29 @@ class CobblerCLI(object):
 
         :param task_id: The id of the task to follow.
         """
-        logfile = "/var/log/cobbler/tasks/%s.log" % task_id
-        # adapted from:  http://code.activestate.com/recipes/157035/
-        file = open(logfile, 'r')
-        # Find the size of the file and move to the end
-        # st_results = os.stat(filename)
-        # st_size = st_results[6]
-        # file.seek(st_size)
-
+        offset = 0
+        pending = ""
         while 1:
-            where = file.tell()
-            line = file.readline()
-            if line.find("### TASK COMPLETE ###") != -1:
-                print("*** TASK COMPLETE ***")
-                return 0
-            if line.find("### TASK FAILED ###") != -1:
-                print("!!! TASK FAILED !!!")
-                return 1
-            if not line:
-                time.sleep(1)
-                file.seek(where)
-            else:
+            # only fetch what was written since the last call
+            tail = self.remote.get_event_log_tail(task_id, offset)
+            offset = tail["offset"]
+            lines = (pending + tail["data"]).split("\n")
+            pending = lines.pop()
+            for line in lines:
+                if line.find("### TASK COMPLETE ###") != -1:
+                    print("*** TASK COMPLETE ***")
+                    return 0
+                if line.find("### TASK FAILED ###") != -1:
+                    print("!!! TASK FAILED !!!")
+                    return 1
+                if line.find("### TASK CANCELED ###") != -1:
+                    print("!!! TASK CANCELED !!!")
+                    return 1
                 if line.find(" | "):
                     line = line.split(" | ")[-1]
-                print(line, end='')
+                print(line)
+            if not tail["data"]:
+                time.sleep(1)
 
     def print_object_help(self, object_type):
         """
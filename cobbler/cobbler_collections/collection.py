@@ -21,6 +21,7 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
 from builtins import range
 from builtins import object
 from cobbler import utils
+import bisect
 import time
 import os
 from threading import Lock
@@ -37,6 +38,14 @@ class Collection(object):
     Base class for any serializable list of things.
     """
 
+    # Fields which are kept in secondary hash indexes so exact-match finds don't need to scan the whole collection.
+    # Fields an item doesn't have are simply skipped.
+    INDEXED_FIELDS = ["hostname", "profile", "distro", "image", "parent"]
+    # Same as above but for the per interface values of systems.
+    INDEXED_INTERFACE_FIELDS = ["mac_address", "ip_address", "dns_name"]
+    # Fields the collection is kept sorted by, so a page of a listing can be sliced out without sorting everything.
+    SORTED_FIELDS = ["name", "profile", "distro", "mtime", "status", "netboot_enabled", "mirror"]
+
     def __init__(self, collection_mgr):
         """
         Constructor.
@@ -48,6 +57,17 @@ class Collection(object):
         self.api = self.collection_mgr.api
         self.lite_sync = None
         self.lock = Lock()
+        self.indexes = {}
+        self.indexed_keys = {}
+        # Bumped whenever an object is added or removed, so caches of data derived from the whole collection (e.g.
+        # the PXE menu) can tell if they are still valid.
+        self.version = 0
+        for field in self.INDEXED_FIELDS + self.INDEXED_INTERFACE_FIELDS + ["interface"]:
+            self.indexes[field] = {}
+        self.sorted_views = {}
+        self.sorted_keys = {}
+        for field in self.SORTED_FIELDS:
+            self.sorted_views[field] = []
 
     def __iter__(self):
         """
@@ -135,7 +155,10 @@ class Collection(object):
 
         self.lock.acquire()
         try:
-            for (name, obj) in list(self.listing.items()):
+            candidates = self.__find_candidates(kargs)
+            if candidates is None:
+                candidates = list(self.listing.values())
+            for obj in candidates:
                 if obj.find_match(kargs, no_errors=no_errors):
                     matches.append(obj)
         finally:
@@ -148,6 +171,156 @@ class Collection(object):
         else:
             return matches
 
+    def __find_candidates(self, kargs):
+        """
+        Narrow down the objects a search has to look at by using the secondary indexes. Only exact matches can be
+        answered by the indexes, globs, negations and unindexed fields need the full scan. Every candidate still has to
+        pass ``find_match()``, so entries of an object which changed since it was indexed never produce a false match.
+        The indexes only know the state an object had when it was last passed to ``add()`` or ``reindex()``, so every
+        code path which edits a stored object in place has to call one of them afterwards. The caller must hold the
+        lock.
+
+        :param kargs: The already rekeyed search dict.
+        :return: A list of candidate objects or None if no key of the search is indexed.
+        """
+        best = None
+        for (key, value) in list(kargs.items()):
+            if not isinstance(value, str) or value.startswith("~"):
+                continue
+            if '?' in value or '*' in value or '[' in value:
+                continue
+            if key == "name":
+                obj = self.listing.get(value.lower())
+                return [obj] if obj is not None else []
+            if key not in self.indexes:
+                continue
+            names = list(self.indexes[key].get(value.lower(), {}).keys())
+            if key in self.INDEXED_INTERFACE_FIELDS:
+                # find_match() also accepts a value which is equal to the name of an interface
+                names.extend(self.indexes["interface"].get(value.lower(), {}).keys())
+            if best is None or len(names) < len(best):
+                best = names
+        if best is None:
+            return None
+        return [self.listing[name] for name in dict.fromkeys(best) if name in self.listing]
+
+    def add_to_indexes(self, ref):
+        """
+        Add an object to the secondary indexes. Old entries for an object with the same name are dropped first. The
+        caller must hold the lock.
+
+        :param ref: The object to index.
+        """
+        name = ref.name.lower()
+        self.remove_from_indexes(name)
+        keys = []
+        for field in self.INDEXED_FIELDS:
+            keys.append((field, getattr(ref, field, None)))
+        for (iname, intf) in list(getattr(ref, "interfaces", {}).items()):
+            keys.append(("interface", iname))
+            for field in self.INDEXED_INTERFACE_FIELDS:
+                keys.append((field, intf.get(field)))
+        keys = [(field, value.lower()) for (field, value) in keys if isinstance(value, str)]
+        for (field, value) in keys:
+            self.indexes[field].setdefault(value, {})[name] = True
+        self.indexed_keys[name] = keys
+        sorted_keys = {}
+        for field in self.SORTED_FIELDS:
+            sorted_keys[field] = self.sort_key(ref, field)
+            bisect.insort(self.sorted_views[field], sorted_keys[field])
+        self.sorted_keys[name] = sorted_keys
+
+    def reindex(self, ref):
+        """
+        Refresh the secondary indexes and drop the cached dictionary and blender results for an object which was
+        modified in place without being added again. Objects which are not (or no longer) part of this collection are
+        ignored.
+
+        :param ref: The modified object.
+        """
+        self.lock.acquire()
+        try:
+            if self.listing.get(ref.name.lower()) is ref:
+                item_base.Item.remove_from_cache(ref)
+                utils.blender_cache_invalidate(ref)
+                self.add_to_indexes(ref)
+        finally:
+            self.lock.release()
+
+    def remove_from_indexes(self, name):
+        """
+        Remove an object from the secondary indexes. This uses the keys recorded while indexing, so it is correct even
+        if the object was modified in place since then. The caller must hold the lock.
+
+        :param name: The name of the object.
+        """
+        name = name.lower()
+        for (field, value) in self.indexed_keys.pop(name, []):
+            bucket = self.indexes[field].get(value)
+            if bucket is None:
+                continue
+            bucket.pop(name, None)
+            if not bucket:
+                del self.indexes[field][value]
+        for (field, key) in list(self.sorted_keys.pop(name, {}).items()):
+            view = self.sorted_views[field]
+            i = bisect.bisect_left(view, key)
+            if i < len(view) and view[i] == key:
+                del view[i]
+
+    @staticmethod
+    def sort_key(ref, field):
+        """
+        Get the key an object has in a sorted view. Objects with the same value are ordered by name, strings are
+        ordered after numbers and booleans so mixed values can still be compared.
+
+        :param ref: The object.
+        :param field: The field to sort by.
+        :return: The key as a tuple.
+        :rtype: tuple
+        """
+        value = getattr(ref, field, "")
+        if value is None:
+            value = ""
+        return (isinstance(value, str), value, ref.name)
+
+    def sorted_page(self, sort_field="name", reverse=False, start=0, count=25, after=None, objects=None):
+        """
+        Get a part of the collection in the order of a sorted view. Only the objects of the page are looked at.
+
+        :param sort_field: One of ``SORTED_FIELDS``.
+        :param reverse: If the page is taken from the descending order.
+        :param start: The position of the first object of the page. Ignored if ``after`` is given.
+        :param count: The maximum number of objects to return.
+        :param after: The sort key of the last object of the previous page. The page starts right behind it, which stays
+                      correct if objects were added or removed in between.
+        :type after: tuple
+        :param objects: Page through these objects, e.g. the results of a search, instead of the whole collection.
+        :return: The objects of the page and their sort keys.
+        :rtype: tuple
+        """
+        self.lock.acquire()
+        try:
+            if objects is None:
+                view = self.sorted_views[sort_field]
+            else:
+                view = sorted(self.sort_key(ref, sort_field) for ref in objects)
+            if after is not None:
+                if reverse:
+                    end = bisect.bisect_left(view, after)
+                else:
+                    start = bisect.bisect_right(view, after)
+            elif reverse:
+                end = len(view) - start
+            if reverse:
+                keys = view[max(end - count, 0):max(end, 0)][::-1]
+            else:
+                keys = view[start:start + count]
+            items = [self.listing[key[2].lower()] for key in keys]
+        finally:
+            self.lock.release()
+        return (items, keys)
+
     SEARCH_REKEY = {
         'kopts': 'kernel_options',
         'kopts_post': 'kernel_options_post',
@@ -253,7 +426,10 @@ class Collection(object):
         newref = ref.make_clone()
         newref.set_name(newname)
 
-        self.add(newref, with_triggers=with_triggers, save=True)
+        # the add and the delete are recorded as a single rename in the change log
+        change_log = self.collection_mgr.change_log()
+        with change_log.renaming(self.collection_type(), oldname, newname):
+            self.add(newref, with_triggers=with_triggers, save=True)
 
         # for mgmt classes, update all objects that use it
         if ref.COLLECTION_TYPE == "mgmtclass":
@@ -315,7 +491,8 @@ class Collection(object):
                 raise CX(_("internal error, unknown child type (%s), cannot finish rename" % k.COLLECTION_TYPE))
 
         # now delete the old version
-        self.remove(oldname, with_delete=True, with_triggers=with_triggers)
+        with change_log.renaming(self.collection_type(), oldname, newname):
+            self.remove(oldname, with_delete=True, with_triggers=with_triggers)
         return
 
     def add(self, ref, save=False, with_copy=False, with_triggers=True, with_sync=True, quick_pxe_update=False,
@@ -341,6 +518,7 @@ class Collection(object):
         :param logger: The logger to audit the action with.
         """
         item_base.Item.remove_from_cache(ref)
+        utils.blender_cache_invalidate(ref)
         if ref is None:
             raise CX("Unable to add a None object")
         if ref.name is None:
@@ -381,14 +559,20 @@ class Collection(object):
 
         self.lock.acquire()
         try:
+            if ref.name.lower() in self.listing:
+                change = "modify"
+            else:
+                change = "add"
             self.listing[ref.name.lower()] = ref
+            self.add_to_indexes(ref)
+            self.version += 1
         finally:
             self.lock.release()
 
         # perform filesystem operations
         if save:
             # Save just this item if possible, if not, save the whole collection
-            self.collection_mgr.serialize_item(self, ref)
+            self.collection_mgr.serialize_item(self, ref, change)
 
             if with_sync:
                 if isinstance(ref, system.System):
@@ -80,6 +80,8 @@ class Distros(collection.Collection):
             self.lock.acquire()
             try:
                 del self.listing[name]
+                self.remove_from_indexes(name)
+                self.version += 1
             finally:
                 self.lock.release()
 
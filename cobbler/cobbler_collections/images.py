@@ -76,6 +76,8 @@ class Images(collection.Collection):
             self.lock.acquire()
             try:
                 del self.listing[name]
+                self.remove_from_indexes(name)
+                self.version += 1
             finally:
                 self.lock.release()
             self.collection_mgr.serialize_delete(self, obj)
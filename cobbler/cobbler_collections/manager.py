@@ -27,6 +27,8 @@ import uuid
 
 from cobbler.cexceptions import CX
 from cobbler.cobbler_collections import files, systems, mgmtclasses, distros, profiles, repos, packages, images
+from cobbler import autoinstallgen
+from cobbler import change_log
 from cobbler import settings
 from cobbler import serializer
 
@@ -65,6 +67,7 @@ class CollectionManager(object):
         self._packages = packages.Packages(weakref.proxy(self))
         self._files = files.Files(weakref.proxy(self))
         self._settings = settings.Settings()         # not a true collection
+        self._change_log = change_log.ChangeLog()
 
     def generate_uid(self):
         """
@@ -129,6 +132,12 @@ class CollectionManager(object):
         """
         return self._files
 
+    def change_log(self):
+        """
+        Return the log of the changes to all objects
+        """
+        return self._change_log
+
     def serialize(self):
         """
         Save all cobbler_collections to disk
@@ -143,15 +152,33 @@ class CollectionManager(object):
         serializer.serialize(self._packages)
         serializer.serialize(self._files)
 
-    def serialize_item(self, collection, item):
+    def serialize_item(self, collection, item, change="modify"):
         """
         Save a collection item to disk
 
         :param collection: Collection
         :param item: collection item
+        :param change: "add" or "modify", recorded in the change log
         """
 
-        return serializer.serialize_item(collection, item)
+        result = serializer.serialize_item(collection, item)
+        self._change_log.record(change, collection.collection_type(), item)
+        return result
+
+    def serialize_items(self, items, changes=None):
+        """
+        Save many collection items to disk at once
+
+        :param items: list of (collection, collection item) tuples
+        :param changes: list with "add" or "modify" for every item, recorded in the change log
+        """
+
+        result = serializer.serialize_items(items)
+        if changes is None:
+            changes = ["modify"] * len(items)
+        for ((collection, item), change) in zip(items, changes):
+            self._change_log.record(change, collection.collection_type(), item)
+        return result
 
     def serialize_delete(self, collection, item):
         """
@@ -161,7 +188,11 @@ class CollectionManager(object):
         :param item: collection item
         """
 
-        return serializer.serialize_delete(collection, item)
+        result = serializer.serialize_delete(collection, item)
+        self._change_log.record("delete", collection.collection_type(), item)
+        # a removed or renamed object must not keep its rendered automatic installation file in memory
+        autoinstallgen.forget_autoinstall(collection.collection_type(), item.name)
+        return result
 
     def deserialize(self):
         """
@@ -185,6 +216,7 @@ class CollectionManager(object):
                 serializer.deserialize(collection)
             except Exception as e:
                 raise CX("serializer: error loading collection %s: %s. Check /etc/cobbler/modules.conf" % (collection.collection_type(), e))
+        self._change_log.load()
 
     def get_items(self, collection_type):
         """
@@ -61,6 +61,8 @@ class Mgmtclasses(collection.Collection):
             self.lock.acquire()
             try:
                 del self.listing[name]
+                self.remove_from_indexes(name)
+                self.version += 1
             finally:
                 self.lock.release()
             self.collection_mgr.serialize_delete(self, obj)
@@ -73,7 +73,8 @@ def do_xmlrpc_rw(cobbler_api, settings, port):
     :param port: The port where the xmlrpc api should run on.
     """
     xinterface = remote.ProxiedXMLRPCInterface(cobbler_api, remote.CobblerXMLRPCInterface)
-    server = remote.CobblerXMLRPCServer(('127.0.0.1', port))
+    server = remote.CobblerXMLRPCServer(('127.0.0.1', port), settings.xmlrpc_threads, settings.xmlrpc_queue_size,
+                                        settings.xmlrpc_gzip_threshold)
     server.logRequests = 0      # don't print stuff
     xinterface.logger.debug("XMLRPC running on %s" % port)
     server.register_instance(xinterface)
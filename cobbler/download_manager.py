@@ -40,20 +40,22 @@ class DownloadManager(object):
         else:
             self.proxies = {}
 
-    def urlread(self, url, proxies=None, cert=None):
+    def urlread(self, url, proxies=None, cert=None, verify=True, timeout=None):
         """
         Read the content of a given URL and pass the requests. Response object to the caller.
 
         :param url: The URL the request.
         :param proxies: Override the default Cobbler proxies.
         :param cert: Override the default Cobbler certs.
+        :param verify: Whether to verify the certificate of the server.
+        :param timeout: Seconds to wait for the server at most, None to wait forever.
         :returns: The Python ``requests.Response`` object.
         """
         if proxies is None:
             proxies = self.proxies
         if cert is None:
             cert = self.cert
-        return requests.get(url, proxies=proxies, cert=cert)
+        return requests.get(url, proxies=proxies, cert=cert, verify=verify, timeout=timeout)
 
     def download_file(self, url, dst, proxies=None, cert=None):
         """
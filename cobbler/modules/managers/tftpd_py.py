@@ -33,6 +33,11 @@ def register():
 
 
 class TftpdPyManager(object):
+    """
+    Manages Cobbler's own TFTP server. It finds the files of the systems itself and has the boot loader configurations
+    of their interfaces generated on request (see ``TFTPGen.generate_system_config()``), so no per-system files are
+    written.
+    """
 
     def what(self):
         return "tftpd"
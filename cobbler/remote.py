@@ -22,16 +22,23 @@ from builtins import str
 from builtins import range
 from builtins import object
 import base64
+import collections
 import errno
 import fcntl
+import heapq
 import os
+import queue
 import random
+import selectors
+import socket
+import xmlrpc.client
 import xmlrpc.server
-from socketserver import ThreadingMixIn
 import stat
-from threading import Thread
+from threading import BoundedSemaphore, Condition, Lock, Thread
 import time
 
+import simplejson
+
 from cobbler import autoinstall_manager
 from cobbler import clogger
 from cobbler import configgen
@@ -43,16 +50,101 @@ from cobbler.cexceptions import CX
 
 EVENT_TIMEOUT = 7 * 24 * 60 * 60        # 1 week
 CACHE_TIMEOUT = 10 * 60                 # 10 minutes
+CACHE_SIZE = 10000                      # object handles kept at most
+EVENT_LOG_CHUNK = 64 * 1024             # bytes of a task log returned at most per call
+EVENT_POLL_TIMEOUT = 60                 # seconds a caller may wait for new events
+EVENT_WAITERS_SHARE = 4                 # at most 1/n of the XML-RPC threads may wait for new events
 
 # task codes
+EVENT_QUEUED = "queued"
 EVENT_RUNNING = "running"
 EVENT_COMPLETE = "complete"
 EVENT_FAILED = "failed"
+EVENT_CANCELED = "canceled"
 
 # normal events
 EVENT_INFO = "notification"
 
 
+class ExpiringCache(dict):
+    """
+    A dict for the tokens, object handles and events of the XML-RPC interface. The values are tuples or lists whose
+    first element is the time the entry was created or last used. Entries expire ``timeout`` seconds after that time.
+
+    Every key has an entry in a heap ordered by time, so expiring entries only looks at the oldest entries instead of
+    scanning all of them. Refreshing the time of an entry doesn't touch the heap, an entry which was refreshed is put
+    back into the heap when it reaches the top.
+    """
+
+    def __init__(self, timeout, max_entries=0):
+        """
+        Constructor
+
+        :param timeout: The lifetime of the entries in seconds, or a function returning it.
+        :param max_entries: If set, the oldest entries are dropped when more entries are added.
+        """
+        dict.__init__(self)
+        self.timeout = timeout
+        self.max_entries = max_entries
+        self.heap = []
+        self.lock = Lock()
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            if key not in self:
+                heapq.heappush(self.heap, (value[0], key))
+            dict.__setitem__(self, key, value)
+            while self.max_entries and len(self) > self.max_entries:
+                self.__pop_oldest()
+
+    def __delitem__(self, key):
+        with self.lock:
+            dict.__delitem__(self, key)
+
+    def pop(self, key, *default):
+        with self.lock:
+            return dict.pop(self, key, *default)
+
+    def expire(self, now=None):
+        """
+        Remove the expired entries.
+
+        :param now: The current time.
+        :return: The keys of the removed entries.
+        :rtype: list
+        """
+        if now is None:
+            now = time.time()
+        timeout = self.timeout() if callable(self.timeout) else self.timeout
+        expired = []
+        with self.lock:
+            while self.heap and now > self.heap[0][0] + timeout:
+                key = self.__pop_oldest(now - timeout)
+                if key is not None:
+                    expired.append(key)
+        return expired
+
+    def __pop_oldest(self, before=None):
+        """
+        Take the oldest entry from the heap and remove it from the dict if it is older than ``before``. An entry which
+        was refreshed since it was put into the heap is put back with its current time instead. The caller must hold
+        the lock.
+
+        :param before: Only remove the entry if its time is before this. If None it is removed in any case.
+        :return: The key of the removed entry or None.
+        """
+        (stamp, key) = heapq.heappop(self.heap)
+        value = dict.get(self, key)
+        if value is None:
+            # deleted in between
+            return None
+        if value[0] != stamp and (before is None or value[0] >= before):
+            heapq.heappush(self.heap, (value[0], key))
+            return None
+        dict.pop(self, key, None)
+        return key
+
+
 class CobblerThread(Thread):
     """
     Code for Cobbler's XMLRPC API.
@@ -77,6 +169,10 @@ class CobblerThread(Thread):
         self.options = options
         self.task_name = task_name
         self.api = api
+        self.priority = 0
+        self.queued_time = time.time()
+        self.start_time = None
+        self.end_time = None
 
     def on_done(self):
         """
@@ -90,7 +186,6 @@ class CobblerThread(Thread):
 
         :return: The return code of the action. This may possibly a boolean or a Linux return code.
         """
-        time.sleep(1)
         try:
             if utils.run_triggers(self.api, None, "/var/lib/cobbler/triggers/task/%s/pre/*" % self.task_name, self.options, self.logger):
                 self.remote._set_task_state(self, self.event_id, EVENT_FAILED)
@@ -108,6 +203,178 @@ class CobblerThread(Thread):
             self.remote._set_task_state(self, self.event_id, EVENT_FAILED)
             return False
 
+    def timings(self):
+        """
+        How long the task waited in the queue and how long it has been running so far.
+
+        :return: The wait time and the run time in seconds.
+        :rtype: tuple
+        """
+        now = time.time()
+        if self.start_time is None:
+            return (now - self.queued_time, 0)
+        return (self.start_time - self.queued_time, (self.end_time or now) - self.start_time)
+
+
+class TaskQueue(object):
+    """
+    Runs the background tasks of the XML-RPC interface on a fixed number of worker threads. Tasks wait in a queue
+    ordered by priority and submission; a task whose type already runs as often as its limit allows stays queued until
+    one of them is done.
+    """
+
+    # Task types for which an identical task which is still waiting in the queue would only do the same work again.
+    COALESCED_TASKS = ["sync", "hardlink", "reposync", "get_loaders", "sigupdate", "validate_autoinstall_files"]
+
+    def __init__(self, workers, limits):
+        """
+        Constructor
+
+        :param workers: The number of tasks which run at the same time.
+        :param limits: The maximum number of running tasks per task type, e.g. ``{"sync": 1}``.
+        """
+        self.workers = max(1, workers)
+        self.limits = limits
+        self.queued = []
+        self.running = {}
+        self.tasks = ExpiringCache(EVENT_TIMEOUT)
+        self.sequence = 0
+        self.threads = []
+        self.cond = Condition()
+
+    def submit(self, task, on_queued=None):
+        """
+        Queue a task. The worker threads are started with the first task.
+
+        :param task: The task to run.
+        :type task: CobblerThread
+        :param on_queued: Called with the task before it is queued, unless it was merged with a queued task.
+        :return: The task, or the identical task already waiting in the queue which it was merged with.
+        :rtype: CobblerThread
+        """
+        self.tasks.expire()
+        with self.cond:
+            if task.task_name in self.COALESCED_TASKS:
+                for (index, (_, sequence, queued)) in enumerate(self.queued):
+                    if queued.task_name == task.task_name and \
+                            self.__work_options(queued) == self.__work_options(task):
+                        if task.priority > queued.priority:
+                            # the merged task inherits the higher priority and moves up in the queue
+                            queued.priority = task.priority
+                            self.queued[index] = (-queued.priority, sequence, queued)
+                            self.queued.sort(key=lambda entry: entry[:2])
+                        return queued
+            if on_queued is not None:
+                on_queued(task)
+            self.sequence += 1
+            self.queued.append((-task.priority, self.sequence, task))
+            self.queued.sort(key=lambda entry: entry[:2])
+            self.tasks[task.event_id] = (task.queued_time, task)
+            while len(self.threads) < self.workers:
+                worker = Thread(target=self.__work, name="cobbler-task-%d" % len(self.threads))
+                worker.daemon = True
+                self.threads.append(worker)
+                worker.start()
+            self.cond.notify()
+        return task
+
+    @staticmethod
+    def __work_options(task):
+        """
+        The options which decide what a task does. The priority only decides when it runs.
+
+        :param task: The task.
+        :return: The options without the priority.
+        :rtype: dict
+        """
+        return dict((key, value) for (key, value) in list(task.options.items()) if key != "priority")
+
+    def cancel(self, event_id):
+        """
+        Remove a task from the queue. Tasks which already run cannot be canceled.
+
+        :param event_id: The id of the task.
+        :return: The canceled task or None if the task is not waiting in the queue.
+        :rtype: CobblerThread
+        """
+        with self.cond:
+            for entry in self.queued:
+                if entry[2].event_id == event_id:
+                    self.queued.remove(entry)
+                    return entry[2]
+        return None
+
+    def get(self, event_id):
+        """
+        Get a queued, running or finished task.
+
+        :param event_id: The id of the task.
+        :return: The task or None if there is no task with this id.
+        :rtype: CobblerThread
+        """
+        entry = self.tasks.get(event_id)
+        if entry is None:
+            return None
+        return entry[1]
+
+    def position(self, task):
+        """
+        The position of a task in the queue.
+
+        :param task: The task.
+        :return: The number of tasks which run before the task, or -1 if it is not queued.
+        :rtype: int
+        """
+        with self.cond:
+            for (index, entry) in enumerate(self.queued):
+                if entry[2] is task:
+                    return index
+        return -1
+
+    def depth(self):
+        """
+        :return: The number of queued and the number of running tasks.
+        :rtype: tuple
+        """
+        with self.cond:
+            return (len(self.queued), sum(self.running.values()))
+
+    def __next_task(self):
+        """
+        Take the first task from the queue whose type is below its limit. The caller must hold the lock.
+
+        :return: The task or None if no queued task may run now.
+        """
+        for entry in self.queued:
+            task = entry[2]
+            limit = self.limits.get(task.task_name, 0)
+            if limit <= 0 or self.running.get(task.task_name, 0) < limit:
+                self.queued.remove(entry)
+                self.running[task.task_name] = self.running.get(task.task_name, 0) + 1
+                return task
+        return None
+
+    def __work(self):
+        """
+        The loop of a worker thread.
+        """
+        while True:
+            with self.cond:
+                task = self.__next_task()
+                while task is None:
+                    self.cond.wait()
+                    task = self.__next_task()
+            try:
+                task.start_time = time.time()
+                task.remote._set_task_state(task, task.event_id, EVENT_RUNNING)
+                task.run()
+            finally:
+                task.end_time = time.time()
+                with self.cond:
+                    self.running[task.task_name] -= 1
+                    # a task of this type may be runnable now
+                    self.cond.notify_all()
+
 # *********************************************************************
 
 
@@ -117,6 +384,12 @@ class CobblerXMLRPCInterface(object):
 
     Most read-write operations require a token returned from "login". Read operations do not.
     """
+
+    # The attributes of a rendered system bin/tftpd.py uses to map requested file names, see get_system_for_tftp().
+    TFTP_SYSTEM_FIELDS = ["name", "hostname", "profile_name", "distro_name", "arch", "kernel", "initrd", "img_path",
+                          "kernel_options", "kernel_options_post", "boot_files", "fetchable_files", "server",
+                          "http_port", "pxelinux.cfg"]
+
     def __init__(self, api):
         """
         Constructor. Requires a Cobbler API handle.
@@ -125,10 +398,17 @@ class CobblerXMLRPCInterface(object):
         """
         self.api = api
         self.logger = self.api.logger
-        self.token_cache = {}
-        self.object_cache = {}
+        self.token_cache = ExpiringCache(lambda: self.api.settings().auth_token_expiration)
+        self.object_cache = ExpiringCache(CACHE_TIMEOUT, CACHE_SIZE)
         self.timestamp = self.api.last_modified_time()
-        self.events = {}
+        self.events = ExpiringCache(EVENT_TIMEOUT)
+        # event id -> sequence number of its last change, ordered by it
+        self.event_changes = collections.OrderedDict()
+        self.event_sequence = 0
+        self.event_cursors = {}
+        self.event_cond = Condition()
+        self.event_waiters = BoundedSemaphore(max(1, self.api.settings().xmlrpc_threads // EVENT_WAITERS_SHARE))
+        self.task_queue = TaskQueue(self.api.settings().task_workers, self.api.settings().task_limits)
         self.shared_secret = utils.get_shared_secret()
         random.seed(time.time())
         self.tftpgen = tftpgen.TFTPGen(api._collection_mgr, self.logger)
@@ -324,10 +604,10 @@ class CobblerXMLRPCInterface(object):
             nofail = options.get("nofail", len(repos) > 0)
 
             if len(repos) > 0:
-                for name in repos:
-                    self.remote.api.reposync(
-                        tries=self.options.get("tries", 3),
-                        name=name, nofail=nofail, logger=self.logger)
+                # a single run, so the repos can be synced in parallel
+                self.remote.api.reposync(
+                    tries=self.options.get("tries", 3),
+                    name=repos, nofail=nofail, logger=self.logger)
             else:
                 self.remote.api.reposync(
                     tries=self.options.get("tries", 3),
@@ -394,23 +674,88 @@ class CobblerXMLRPCInterface(object):
         :return: A dictionary with all the events (or all filtered events).
         :rtype: dict
         """
-        # return only the events the user has not seen
-        self.events_filtered = {}
-        for (k, x) in list(self.events.items()):
-            if for_user in x[3]:
-                pass
-            else:
-                self.events_filtered[k] = x
+        if for_user is None or for_user == "":
+            return dict(self.events)
+
+        # return only the events the user has not seen and mark them as read so user will not get them again
+        with self.event_cond:
+            (events_filtered, sequence) = self.__events_since(self.event_cursors.get(for_user, 0))
+            self.event_cursors[for_user] = sequence
+            for event in events_filtered.values():
+                if for_user not in event[3]:
+                    event[3].append(for_user)
+        return events_filtered
+
+    def wait_events(self, cursor=-1, timeout=0, for_user=""):
+        """
+        Get the events which were added or changed their state after a cursor. If there are none, wait for them.
+
+        :param cursor: The cursor returned by the last call, 0 for all events. If negative, the cursor stored for
+                       ``for_user`` is used and the returned one is stored for the user.
+        :param timeout: How many seconds to wait for a new event at most. Capped at EVENT_POLL_TIMEOUT. If already
+                        1/EVENT_WAITERS_SHARE of the XML-RPC threads are waiting, the call returns without waiting.
+        :param for_user: The user whose cursor is used if ``cursor`` is negative.
+        :return: The events like get_events() returns them under "events" and the cursor for the next call under
+                 "cursor".
+        :rtype: dict
+        """
+        cursor = int(cursor)
+        remember = cursor < 0 and for_user != ""
+        deadline = time.time() + min(max(float(timeout), 0), EVENT_POLL_TIMEOUT)
+        with self.event_cond:
+            if cursor < 0:
+                cursor = self.event_cursors.get(for_user, 0)
+            (events, sequence) = self.__events_since(cursor)
+            if not events and deadline > time.time() and self.event_waiters.acquire(blocking=False):
+                try:
+                    while not events:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            break
+                        self.event_cond.wait(remaining)
+                        (events, sequence) = self.__events_since(cursor)
+                finally:
+                    self.event_waiters.release()
+            if remember:
+                self.event_cursors[for_user] = sequence
+        return {"events": events, "cursor": sequence}
 
-        # mark as read so user will not get events again
-        if for_user is not None and for_user != "":
-            for (k, x) in list(self.events.items()):
-                if for_user in x[3]:
-                    pass
-                else:
-                    self.events[k][3].append(for_user)
+    def __events_since(self, cursor):
+        """
+        Collect the events changed after a cursor by walking the changes backwards, so only new changes are looked at.
+        The caller must hold ``event_cond``.
 
-        return self.events_filtered
+        :param cursor: The sequence number of the last change the caller has seen.
+        :return: The changed events and the current sequence number.
+        :rtype: tuple
+        """
+        events = {}
+        for event_id in reversed(self.event_changes):
+            if self.event_changes[event_id] <= cursor:
+                break
+            event = self.events.get(event_id)
+            if event is not None:
+                events[event_id] = event
+        return (events, self.event_sequence)
+
+    def _event_changed(self, event_id):
+        """
+        Record that an event was added or changed its state and wake up the callers of wait_events(). (For internal use
+        only)
+
+        :param event_id: The id of the event.
+        """
+        with self.event_cond:
+            self.event_sequence += 1
+            self.event_changes.pop(event_id, None)
+            self.event_changes[event_id] = self.event_sequence
+            # forget the changes of expired events
+            while self.event_changes:
+                oldest = next(iter(self.event_changes))
+                if oldest in self.events:
+                    break
+                del self.event_changes[oldest]
+            self.event_cond.notify_all()
 
     def get_event_log(self, event_id):
         """
@@ -431,6 +776,41 @@ class CobblerXMLRPCInterface(object):
         else:
             return "?"
 
+    def get_event_log_tail(self, event_id, offset=0, limit=EVENT_LOG_CHUNK):
+        """
+        Returns a part of a task log, so a caller following the log only gets the new output each time.
+
+        :param event_id: The event-id generated by Cobbler.
+        :param offset: The byte offset to start reading at, the "offset" returned by the last call.
+        :param limit: How many bytes to return at most. Capped at EVENT_LOG_CHUNK.
+        :return: The text under "data", the offset to continue at under "offset", the size of the log under "size" (-1 if
+                 there is no log) and the state of the task under "state" ("" if there is no such event anymore).
+        :rtype: dict
+        """
+        event_id = str(event_id).replace("..", "").replace("/", "")
+        path = "/var/log/cobbler/tasks/%s.log" % event_id
+        offset = max(int(offset), 0)
+        limit = min(max(int(limit), 1), EVENT_LOG_CHUNK)
+        event = self.events.get(event_id)
+        result = {"data": "", "offset": offset, "size": -1, "state": event[2] if event is not None else ""}
+        try:
+            with open(path, "rb") as fh:
+                size = os.fstat(fh.fileno()).st_size
+                if offset > size:
+                    # the log was truncated, start over
+                    offset = 0
+                fh.seek(offset)
+                chunk = fh.read(limit)
+        except (IOError, OSError):
+            return result
+        if offset + len(chunk) < size and b"\n" in chunk:
+            # don't cut a line, or a multibyte character, in half
+            chunk = chunk[:chunk.rindex(b"\n") + 1]
+        result["data"] = chunk.decode("utf-8", "replace")
+        result["offset"] = offset + len(chunk)
+        result["size"] = size
+        return result
+
     def __generate_event_id(self, optype):
         """
         Generate an event id based on the current timestamp
@@ -454,40 +834,72 @@ class CobblerXMLRPCInterface(object):
         event_id = self.__generate_event_id("event")
         event_id = str(event_id)
         self.events[event_id] = [float(time.time()), str(name), EVENT_INFO, []]
+        self._event_changed(event_id)
 
     def __start_task(self, thr_obj_fn, token, role_name, name, args, on_done=None):
         """
-        Starts a new background task.
+        Queues a new background task.
 
         :param thr_obj_fn: function handle to run in a background thread
         :param token: The API-token obtained via the login() method. The API-token obtained via the login() method. All
                       tasks require tokens.
         :param role_name: used to check token against authn/authz layers
         :param name: display name to show in logs/events
-        :param args: usually this is a single dict, containing options
+        :param args: usually this is a single dict, containing options. An integer "priority" in it moves the task
+                     ahead of queued tasks with a lower priority.
         :param on_done: an optional second function handle to run after success (and only success)
-        :return: a task id.
+        :return: a task id. If an identical task was already waiting in the queue, the id of that task.
         """
         self.check_access(token, role_name)
         event_id = self.__generate_event_id(role_name)          # use short form for logfile suffix
         event_id = str(event_id)
-        self.events[event_id] = [float(time.time()), str(name), EVENT_RUNNING, []]
-
-        self._log("start_task(%s); event_id(%s)" % (name, event_id))
-        logatron = clogger.Logger("/var/log/cobbler/tasks/%s.log" % event_id)
 
-        thr_obj = CobblerThread(event_id, self, logatron, args, role_name, self.api)
+        thr_obj = CobblerThread(event_id, self, None, args, role_name, self.api)
         thr_obj._run = thr_obj_fn
         if on_done is not None:
             thr_obj.on_done = on_done.__get__(thr_obj, CobblerThread)
-        thr_obj.start()
+        try:
+            thr_obj.priority = int(thr_obj.options.get("priority", 0))
+        except (TypeError, ValueError):
+            raise CX("invalid task priority: %s" % thr_obj.options.get("priority"))
+
+        def on_queued(task):
+            task.logger = clogger.Logger("/var/log/cobbler/tasks/%s.log" % event_id)
+            self.events[event_id] = [float(time.time()), str(name), EVENT_QUEUED, []]
+            self._event_changed(event_id)
+
+        queued = self.task_queue.submit(thr_obj, on_queued)
+        if queued is not thr_obj:
+            self._log("start_task(%s); merged with queued event_id(%s)" % (name, queued.event_id))
+            return queued.event_id
+        self._log("start_task(%s); event_id(%s)" % (name, event_id))
         return event_id
 
+    def cancel_task(self, event_id, token):
+        """
+        Cancel a background task which is still waiting in the queue. Running tasks cannot be canceled.
+
+        :param event_id: The unique id of the task.
+        :param token: The API-token obtained via the login() method.
+        :return: True if the task was canceled.
+        :rtype: bool
+        """
+        event_id = str(event_id)
+        task = self.task_queue.get(event_id)
+        if task is None:
+            raise CX("no task with that id")
+        self.check_access(token, task.task_name)
+        if self.task_queue.cancel(event_id) is None:
+            raise CX("task %s is not queued anymore" % event_id)
+        self._log("cancel_task(%s)" % event_id, token=token)
+        self._set_task_state(task, event_id, EVENT_CANCELED)
+        return True
+
     def _set_task_state(self, thread_obj, event_id, new_state):
         """
         Set the state of the task. (For internal use only)
 
-        :param thread_obj: Not known what this actually does.
+        :param thread_obj: The task whose state changes, or None.
         :param event_id: The event id, generated by __generate_event_id()
         :param new_state: The new state of the task.
         """
@@ -495,24 +907,41 @@ class CobblerXMLRPCInterface(object):
         if event_id in self.events:
             self.events[event_id][2] = new_state
             self.events[event_id][3] = []           # clear the list of who has read it
-        if thread_obj is not None:
+            self._event_changed(event_id)
+        if thread_obj is not None and thread_obj.logger is not None:
             if new_state == EVENT_COMPLETE:
                 thread_obj.logger.info("### TASK COMPLETE ###")
             if new_state == EVENT_FAILED:
                 thread_obj.logger.error("### TASK FAILED ###")
+            if new_state == EVENT_CANCELED:
+                thread_obj.logger.warning("### TASK CANCELED ###")
 
     def get_task_status(self, event_id):
         """
         Get the current status of the task.
 
         :param event_id: The unique id of the task.
-        :return: The event status.
+        :return: The event status: ``[statetime, name, state, [read_by_who]]``. For background tasks a dict follows
+                 with the priority, the position in the queue (-1 if the task does not wait anymore), the numbers of
+                 queued and running tasks and the seconds the task waited and ran.
         """
         event_id = str(event_id)
-        if event_id in self.events:
-            return self.events[event_id]
-        else:
+        if event_id not in self.events:
             raise CX("no event with that id")
+        status = list(self.events[event_id])
+        task = self.task_queue.get(event_id)
+        if task is not None:
+            (queued, running) = self.task_queue.depth()
+            (wait_time, run_time) = task.timings()
+            status.append({
+                "priority": task.priority,
+                "queue_position": self.task_queue.position(task),
+                "queue_depth": queued,
+                "running_tasks": running,
+                "wait_time": wait_time,
+                "run_time": run_time,
+            })
+        return status
 
     def last_modified_time(self, token=None):
         """
@@ -542,10 +971,11 @@ class CobblerXMLRPCInterface(object):
         :return: The username if the token was valid.
         :raises CX: If the token supplied to the function is invalid.
         """
-        if token not in self.token_cache:
+        entry = self.token_cache.get(token)
+        if entry is None:
             raise CX("invalid token: %s" % token)
         else:
-            return self.token_cache[token][1]
+            return entry[1]
 
     def _log(self, msg, user=None, token=None, name=None, object_id=None, attribute=None, debug=False, error=False):
         """
@@ -627,6 +1057,18 @@ class CobblerXMLRPCInterface(object):
         :param token: The API-token obtained via the login() method.
         :return: The paginated items.
         """
+        pageinfo = self.__pageinfo(len(data), page, items_per_page)
+        return (data[pageinfo["start_item"]:pageinfo["end_item"]], pageinfo)
+
+    def __pageinfo(self, num_items, page=None, items_per_page=None):
+        """
+        Helper function which calculates which part of a selection a page shows.
+
+        :param num_items: The number of items in the selection.
+        :param page: The page to show.
+        :param items_per_page: The number of items per page.
+        :return: A dict describing the page and its neighbours.
+        """
         default_page = 1
         default_items_per_page = 25
 
@@ -643,7 +1085,6 @@ class CobblerXMLRPCInterface(object):
         except:
             items_per_page = default_items_per_page
 
-        num_items = len(data)
         num_pages = ((num_items - 1) // items_per_page) + 1
         if num_pages == 0:
             num_pages = 1
@@ -655,7 +1096,6 @@ class CobblerXMLRPCInterface(object):
             start_item = num_items - 1
         if end_item > num_items:
             end_item = num_items
-        data = data[start_item:end_item]
 
         if page > 1:
             prev_page = page - 1
@@ -666,7 +1106,7 @@ class CobblerXMLRPCInterface(object):
         else:
             next_page = None
 
-        return (data, {
+        return {
             'page': page,
             'prev_page': prev_page,
             'next_page': next_page,
@@ -677,7 +1117,57 @@ class CobblerXMLRPCInterface(object):
             'end_item': end_item,
             'items_per_page': items_per_page,
             'items_per_page_list': [10, 20, 50, 100, 200, 500],
-        })
+        }
+
+    def __sorted_page(self, what, criteria=None, sort_field=None, page=None, items_per_page=None, cursor=None):
+        """
+        Helper function to get a page of a sorted selection from the sorted views of a collection, so only the items
+        of the page have to be looked at and serialized.
+
+        :param what: The object type to find.
+        :param criteria: The criteria the items need to match. If empty the whole collection is paged through.
+        :param sort_field: The field to sort after, if it starts with "!" the order is descending.
+        :param page: The page to return. Ignored for the slicing if a cursor is given.
+        :param items_per_page: The number of items per page.
+        :param cursor: The ``next_cursor`` of the previous page.
+        :return: The items and the page information with a ``next_cursor`` for the following page, or None if the sort
+                 field has no sorted view.
+        """
+        if sort_field is None:
+            sort_field = "name"
+        reverse = sort_field.startswith("!")
+        if reverse:
+            sort_field = sort_field[1:]
+        collection = self.api.get_items(what)
+        if sort_field not in collection.SORTED_FIELDS:
+            return None
+
+        after = None
+        if cursor:
+            try:
+                (cursor_field, cursor_reverse, after) = simplejson.loads(base64.urlsafe_b64decode(cursor))
+                after = tuple(after)
+            except (TypeError, ValueError):
+                raise CX("invalid cursor: %s" % cursor)
+            if cursor_field != sort_field or cursor_reverse != reverse:
+                raise CX("the cursor does not belong to the sort order %s" % sort_field)
+
+        objects = None
+        if criteria:
+            objects = self.api.find_items(what, criteria=criteria)
+            num_items = len(objects)
+        else:
+            num_items = len(collection)
+        pageinfo = self.__pageinfo(num_items, page, items_per_page)
+        count = pageinfo["items_per_page"]
+        (items, keys) = collection.sorted_page(sort_field, reverse, pageinfo["start_item"], count + 1, after, objects)
+        if len(items) > count:
+            items = items[:count]
+            pageinfo["next_cursor"] = base64.urlsafe_b64encode(
+                simplejson.dumps([sort_field, reverse, keys[count - 1]]).encode()).decode()
+        else:
+            pageinfo["next_cursor"] = None
+        return (items, pageinfo)
 
     def __get_object(self, object_id):
         """
@@ -687,7 +1177,10 @@ class CobblerXMLRPCInterface(object):
         :return: The item to the corresponding id.
         """
         if object_id.startswith("___NEW___"):
-            return self.object_cache[object_id][1]
+            entry = self.object_cache.get(object_id)
+            if entry is None:
+                raise CX("unknown or expired object handle: %s" % object_id)
+            return entry[1]
         (otype, oname) = object_id.split("::", 1)
         return self.api.get_item(otype, oname)
 
@@ -804,14 +1297,21 @@ class CobblerXMLRPCInterface(object):
         """
         return self.get_item("file", name, flatten=flatten)
 
-    def get_items(self, what):
+    def get_items(self, what, page=None, results_per_page=None):
         """
         Individual list elements are the same for get_item.
 
         :param what: is the name of a Cobbler object type, as described for get_item.
+        :param page: If given only this page of the items sorted by name is returned.
+        :param results_per_page: The number of items per page.
         :return: This returns a list of dicts.
         """
-        items = [x.to_dict() for x in self.api.get_items(what)]
+        # older clients pass their token in place of the page
+        if not isinstance(page, int) and results_per_page is None:
+            items = self.api.get_items(what)
+        else:
+            (items, pageinfo) = self.__sorted_page(what, page=page, items_per_page=results_per_page)
+        items = [x.to_dict() for x in items]
 
         for item in items:
             if "autoinstall" in item:
@@ -838,97 +1338,97 @@ class CobblerXMLRPCInterface(object):
         """
         This returns all distributions.
 
-        :param page: This parameter is not used currently.
-        :param results_per_page: This parameter is not used currently.
+        :param page: If given only this page of the items sorted by name is returned.
+        :param results_per_page: The number of items per page.
         :param token: The API-token obtained via the login() method. The API-token obtained via the login() method.
         :param rest: This parameter is not used currently.
         :return: The list with all distros.
         """
-        return self.get_items("distro")
+        return self.get_items("distro", page, results_per_page)
 
     def get_profiles(self, page=None, results_per_page=None, token=None, **rest):
         """
         This returns all profiles.
 
-        :param page: This parameter is not used currently.
-        :param results_per_page: This parameter is not used currently.
+        :param page: If given only this page of the items sorted by name is returned.
+        :param results_per_page: The number of items per page.
         :param token: The API-token obtained via the login() method. The API-token obtained via the login() method.
         :param rest: This parameter is not used currently.
         :return: The list with all profiles.
         """
-        return self.get_items("profile")
+        return self.get_items("profile", page, results_per_page)
 
     def get_systems(self, page=None, results_per_page=None, token=None, **rest):
         """
         This returns all Systems.
 
-        :param page: This parameter is not used currently.
-        :param results_per_page: This parameter is not used currently.
+        :param page: If given only this page of the items sorted by name is returned.
+        :param results_per_page: The number of items per page.
         :param token: The API-token obtained via the login() method. The API-token obtained via the login() method.
         :param rest: This parameter is not used currently.
         :return: The list of all systems.
         """
-        return self.get_items("system")
+        return self.get_items("system", page, results_per_page)
 
     def get_repos(self, page=None, results_per_page=None, token=None, **rest):
         """
         This returns all repositories.
 
-        :param page: This parameter is not used currently.
-        :param results_per_page: This parameter is not used currently.
+        :param page: If given only this page of the items sorted by name is returned.
+        :param results_per_page: The number of items per page.
         :param token: The API-token obtained via the login() method. The API-token obtained via the login() method.
         :param rest: This parameter is not used currently.
         :return: The list of all repositories.
         """
-        return self.get_items("repo")
+        return self.get_items("repo", page, results_per_page)
 
     def get_images(self, page=None, results_per_page=None, token=None, **rest):
         """
         This returns all images.
 
-        :param page: This parameter is not used currently.
-        :param results_per_page: This parameter is not used currently.
+        :param page: If given only this page of the items sorted by name is returned.
+        :param results_per_page: The number of items per page.
         :param token: The API-token obtained via the login() method. The API-token obtained via the login() method.
         :param rest: This parameter is not used currently.
         :return: The list of all images.
         """
-        return self.get_items("image")
+        return self.get_items("image", page, results_per_page)
 
     def get_mgmtclasses(self, page=None, results_per_page=None, token=None, **rest):
         """
         This returns all managementclasses.
 
-        :param page: This parameter is not used currently.
-        :param results_per_page: This parameter is not used currently.
+        :param page: If given only this page of the items sorted by name is returned.
+        :param results_per_page: The number of items per page.
         :param token: The API-token obtained via the login() method. The API-token obtained via the login() method.
         :param rest: This parameter is not used currently.
         :return: The list of all managementclasses.
         """
-        return self.get_items("mgmtclass")
+        return self.get_items("mgmtclass", page, results_per_page)
 
     def get_packages(self, page=None, results_per_page=None, token=None, **rest):
         """
         This returns all packages.
 
-        :param page: This parameter is not used currently.
-        :param results_per_page: This parameter is not used currently.
+        :param page: If given only this page of the items sorted by name is returned.
+        :param results_per_page: The number of items per page.
         :param token: The API-token obtained via the login() method. The API-token obtained via the login() method.
         :param rest: This parameter is not used currently.
         :return: The list of all packages tracked in Cobbler.
         """
-        return self.get_items("package")
+        return self.get_items("package", page, results_per_page)
 
     def get_files(self, page=None, results_per_page=None, token=None, **rest):
         """
         This returns all files.
 
-        :param page: This parameter is not used currently.
-        :param results_per_page: This parameter is not used currently.
+        :param page: If given only this page of the items sorted by name is returned.
+        :param results_per_page: The number of items per page.
         :param token: The API-token obtained via the login() method.
         :param rest: This parameter is not used currently.
         :return: The list of all files.
         """
-        return self.get_items("file")
+        return self.get_items("file", page, results_per_page)
 
     def find_items(self, what, criteria=None, sort_field=None, expand=True):
         """Works like get_items but also accepts criteria as a dict to search on.
@@ -1050,23 +1550,35 @@ class CobblerXMLRPCInterface(object):
         """
         return self.find_items("file", criteria, expand=expand)
 
-    def find_items_paged(self, what, criteria=None, sort_field=None, page=None, items_per_page=None, token=None):
+    def find_items_paged(self, what, criteria=None, sort_field=None, page=None, items_per_page=None, token=None,
+                         cursor=None):
         """
         Returns a list of dicts as with find_items but additionally supports returning just a portion of the total
         list, for instance in supporting a web app that wants to show a limited amount of items per page.
 
+        Pages can either be requested by number or by passing the ``next_cursor`` of the page information of the
+        previous page. A cursor continues right after the last item of the previous page even if items were added or
+        removed in between.
+
         :param what: The object type to find.
         :param criteria: The criteria a distribution needs to match.
         :param sort_field: The field to sort the results after.
         :param page: The page to return
         :param items_per_page: The number of items per page.
         :param token: The API-token obtained via the login() method.
+        :param cursor: The ``next_cursor`` of the previous page.
         :return: The found items.
         """
         self._log("find_items_paged(%s); criteria(%s); sort(%s)" % (what, criteria, sort_field), token=token)
-        items = self.api.find_items(what, criteria=criteria)
-        items = self.__sort(items, sort_field)
-        (items, pageinfo) = self.__paginate(items, page, items_per_page)
+        result = self.__sorted_page(what, criteria, sort_field, page, items_per_page, cursor)
+        if result is not None:
+            (items, pageinfo) = result
+        else:
+            if cursor:
+                raise CX("cursors are not supported for the sort field %s" % sort_field)
+            items = self.api.find_items(what, criteria=criteria)
+            items = self.__sort(items, sort_field)
+            (items, pageinfo) = self.__paginate(items, page, items_per_page)
         items = [x.to_dict() for x in items]
         return self.xmlrpc_hacks({
             'items': items,
@@ -1646,6 +2158,9 @@ class CobblerXMLRPCInterface(object):
             return False
             # raise CX("object has no method: %s" % attribute)
         method(arg)
+        if not object_id.startswith("___NEW___"):
+            # the live object was edited in place, keep the lookup indexes of its collection and the caches in step
+            self.api.get_items(what).reindex(obj)
         return True
 
     def modify_distro(self, object_id, attribute, arg, token):
@@ -1784,6 +2299,52 @@ class CobblerXMLRPCInterface(object):
                 return True
         return False
 
+    def __xapi_modify_attributes(self, object_type, object_name, handle, attributes, token):
+        """
+        Apply the attributes of an extended API edit to an object handle.
+
+        :param object_type: The object type which corresponds to the collection type the object is in.
+        :param object_name: The name of the object under question.
+        :param handle: The handle of the object to modify.
+        :param attributes: The attributes which shall be edited.
+        :param token: The API-token obtained via the login() method.
+        """
+        # FIXME: this doesn't know about interfaces yet!
+        # if object type is system and fields add to dict and then
+        # modify when done, rather than now.
+        imods = {}
+        # FIXME: needs to know about how to delete interfaces too!
+        for (k, v) in list(attributes.items()):
+            if object_type != "system" or not self.__is_interface_field(k):
+                # in place modifications allow for adding a key/value pair while keeping other k/v
+                # pairs intact.
+                if k in ["autoinstall_meta", "kernel_options", "kernel_options_post", "template_files", "boot_files", "fetchable_files", "params"] and \
+                        "in_place" in attributes and attributes["in_place"]:
+                    details = self.get_item(object_type, object_name)
+                    v2 = details[k]
+                    (ok, input) = utils.input_string_or_dict(v)
+                    for (a, b) in list(input.items()):
+                        if a.startswith("~") and len(a) > 1:
+                            del v2[a[1:]]
+                        else:
+                            v2[a] = b
+                    v = v2
+
+                self.modify_item(object_type, handle, k, v, token)
+
+            else:
+                modkey = "%s-%s" % (k, attributes.get("interface", ""))
+                imods[modkey] = v
+
+        if object_type == "system":
+            if "delete_interface" not in attributes and "rename_interface" not in attributes:
+                self.modify_system(handle, 'modify_interface', imods, token)
+            elif "delete_interface" in attributes:
+                self.modify_system(handle, 'delete_interface', attributes.get("interface", ""), token)
+            elif "rename_interface" in attributes:
+                ifargs = [attributes.get("interface", ""), attributes.get("rename_interface", "")]
+                self.modify_system(handle, 'rename_interface', ifargs, token)
+
     def xapi_object_edit(self, object_type, object_name, edit_type, attributes, token):
         """Extended API: New style object manipulations, 2.0 and later.
 
@@ -1850,41 +2411,7 @@ class CobblerXMLRPCInterface(object):
             del attributes["newname"]
 
         if edit_type != "remove":
-            # FIXME: this doesn't know about interfaces yet!
-            # if object type is system and fields add to dict and then
-            # modify when done, rather than now.
-            imods = {}
-            # FIXME: needs to know about how to delete interfaces too!
-            for (k, v) in list(attributes.items()):
-                if object_type != "system" or not self.__is_interface_field(k):
-                    # in place modifications allow for adding a key/value pair while keeping other k/v
-                    # pairs intact.
-                    if k in ["autoinstall_meta", "kernel_options", "kernel_options_post", "template_files", "boot_files", "fetchable_files", "params"] and \
-                            "in_place" in attributes and attributes["in_place"]:
-                        details = self.get_item(object_type, object_name)
-                        v2 = details[k]
-                        (ok, input) = utils.input_string_or_dict(v)
-                        for (a, b) in list(input.items()):
-                            if a.startswith("~") and len(a) > 1:
-                                del v2[a[1:]]
-                            else:
-                                v2[a] = b
-                        v = v2
-
-                    self.modify_item(object_type, handle, k, v, token)
-
-                else:
-                    modkey = "%s-%s" % (k, attributes.get("interface", ""))
-                    imods[modkey] = v
-
-            if object_type == "system":
-                if "delete_interface" not in attributes and "rename_interface" not in attributes:
-                    self.modify_system(handle, 'modify_interface', imods, token)
-                elif "delete_interface" in attributes:
-                    self.modify_system(handle, 'delete_interface', attributes.get("interface", ""), token)
-                elif "rename_interface" in attributes:
-                    ifargs = [attributes.get("interface", ""), attributes.get("rename_interface", "")]
-                    self.modify_system(handle, 'rename_interface', ifargs, token)
+            self.__xapi_modify_attributes(object_type, object_name, handle, attributes, token)
         else:
             # remove item
             recursive = attributes.get("recursive", False)
@@ -1900,6 +2427,66 @@ class CobblerXMLRPCInterface(object):
         self.save_item(object_type, handle, token)
         return True
 
+    def xapi_object_edit_batch(self, edits, token):
+        """Extended API: Add or edit many objects with a single call.
+
+        All edits are applied to copies of the objects and validated before anything is changed. The objects are then
+        persisted together and the files depending on them are regenerated once for the whole batch, which makes this
+        much faster than calling ``xapi_object_edit()`` for every object when importing many systems.
+
+        Ex: xapi_object_edit_batch([["system", "host1", "add", {"profile": "el5", "mac_address": "..."}], ...], token)
+
+        :param edits: A list of ``[object_type, object_name, edit_type, attributes]`` entries, see
+                      ``xapi_object_edit()``. Only the edit types 'add' and 'edit' are supported. New objects can't be
+                      referenced by other entries of the same batch, see ``CobblerAPI.add_items()``.
+        :param token: The API-token obtained via the login() method.
+        :return: True if the action succeeded.
+        """
+        self._log("xapi_object_edit_batch(%d)" % len(edits), token=token)
+        items = []
+        seen = set()
+        for (object_type, object_name, edit_type, attributes) in edits:
+            if object_name.strip() == "":
+                raise CX("xapi_object_edit_batch() called without an object name")
+            if edit_type not in ("add", "edit"):
+                raise CX("xapi_object_edit_batch() does not support the edit type %s" % edit_type)
+            if (object_type, object_name.lower()) in seen:
+                raise CX("the %s %s is edited more than once in this batch" % (object_type, object_name))
+            seen.add((object_type, object_name.lower()))
+
+            self.check_access(token, "xedit_%s" % object_type, token)
+
+            if edit_type == "add":
+                if self.api.get_item(object_type, object_name) is not None:
+                    raise CX("it seems unwise to overwrite the object %s, try 'edit'" % object_name)
+                is_subobject = object_type == "profile" and "parent" in attributes
+                if is_subobject and "distro" in attributes:
+                    raise CX("You can't change both 'parent' and 'distro'")
+                if object_type == "system":
+                    if "profile" not in attributes and "image" not in attributes:
+                        raise CX("You must specify a 'profile' or 'image' for new systems")
+                handle = self.new_item(object_type, token, is_subobject=is_subobject)
+                self.modify_item(object_type, handle, "name", object_name, token)
+            else:
+                found = self.api.get_item(object_type, object_name)
+                if found is None:
+                    raise CX("internal error, unknown %s name %s" % (object_type, object_name))
+                # work on a copy, so a failing edit does not leave the object half modified
+                clone = found.make_clone()
+                clone.children = found.children
+                handle = "___NEW___%s::%s" % (object_type, self.__get_random(25))
+                self.object_cache[handle] = (time.time(), clone)
+
+            self.__xapi_modify_attributes(object_type, object_name, handle, attributes, token)
+            obj = self.__get_object(handle)
+            # the handle is not needed anymore, don't let a big batch fill the cache
+            del self.object_cache[handle]
+            self.check_access(token, "save_%s" % object_type, obj)
+            items.append((object_type, obj))
+
+        self.api.add_items(items, logger=self.logger)
+        return True
+
     def save_item(self, what, object_id, token, editmode="bypass"):
         """
         Saves a newly created or modified object to disk. Calling save is required for any changes to persist.
@@ -2115,6 +2702,19 @@ class CobblerXMLRPCInterface(object):
         self._log("generate_bootcfg")
         return self.api.generate_bootcfg(profile, system)
 
+    def generate_system_config(self, mac_address, loader="pxe", **rest):
+        """
+        Generate the boot loader configuration of the system interface with a MAC address on request, so a TFTP server
+        doesn't need the files ``cobbler sync`` writes to ``pxelinux.cfg`` and ``grub/system``.
+
+        :param mac_address: The MAC address of the interface.
+        :param loader: Either "pxe" or "grub".
+        :param rest: This is dropped in this method since it is not needed here.
+        :return: The configuration or an empty string if there is no such interface or it doesn't boot from one.
+        """
+        self._log("generate_system_config")
+        return self.api.generate_system_config(mac_address, loader) or ""
+
     def generate_script(self, profile=None, system=None, name=None, **rest):
         """
         Not known what this does exactly.
@@ -2555,6 +3155,41 @@ class CobblerXMLRPCInterface(object):
         self._log("version", token=token)
         return self.api.version(extended=True)
 
+    def get_changes(self, sequence, what="", expand=False, epoch="", token=None, **rest):
+        """
+        Return the changes to the objects after a sequence number. Clients should remember the returned sequence number
+        and epoch and pass them to the next call. This is cheaper than the ``get_*_since`` functions and also reports
+        deletions.
+
+        Ex: get_changes(0) -> {"changes": [{"sequence": 1, "change": "add", "type": "system", "name": "foo",
+        "uid": "...", "time": 1589386486.9}, ...], "sequence": 1, "complete": True, "epoch": "..."}
+
+        :param sequence: The sequence number returned by the last call, 0 for everything in the change log.
+        :param what: Only return the changes of this object type, e.g. "system". Empty for all types.
+        :param expand: Add the current state of every changed object which still exists as "item" to its change.
+        :param epoch: The epoch returned by the last call. Empty if unknown.
+        :param token: The API-token obtained via the login() method.
+        :param rest: This is dropped in this method since it is not needed here.
+        :return: The changes, the sequence number and epoch to pass next time and whether the changes are complete. If
+                 they are not, the change log was compacted past the sequence number or started over and all objects
+                 have to be fetched again.
+        """
+        self._log("get_changes(%s)" % sequence, token=token)
+        (changes, sequence, complete, epoch) = self.api.get_changes(int(sequence), what or None, epoch or None)
+        if expand:
+            changes = [dict(change) for change in changes]
+            for change in changes:
+                if change["change"] != "delete":
+                    item = self.api.get_item(change["type"], change["name"])
+                    if item is not None:
+                        change["item"] = item.to_dict()
+        return self.xmlrpc_hacks({
+            "changes": changes,
+            "sequence": sequence,
+            "epoch": epoch,
+            "complete": complete,
+        })
+
     def get_distros_since(self, mtime):
         """
         Return all of the distro objects that have been modified after mtime.
@@ -2739,38 +3374,157 @@ class CobblerXMLRPCInterface(object):
         self._log("get_system_as_rendered", name=name, token=token)
         obj = self.api.find_system(name=name)
         if obj is not None:
-            _dict = utils.blender(self.api, True, obj)
-            # Generate a pxelinux.cfg?
-            image_based = False
-            profile = obj.get_conceptual_parent()
-            distro = profile.get_conceptual_parent()
+            return self.xmlrpc_hacks(self.__render_system(obj))
+        return self.xmlrpc_hacks({})
 
-            # The management classes stored in the system are just a list of names, so we need to turn it into a full
-            # list of dictionaries (right now we just use the params field).
-            mcs = _dict["mgmt_classes"]
-            _dict["mgmt_classes"] = {}
-            for m in mcs:
-                c = self.api.find_mgmtclass(name=m)
-                if c:
-                    _dict["mgmt_classes"][m] = c.to_dict()
+    def __render_system(self, obj):
+        """
+        Pass a system through Cobbler's inheritance engine and add its management classes and pxelinux.cfg.
 
-            arch = None
-            if distro is None and profile.COLLECTION_TYPE == "image":
-                image_based = True
-                arch = profile.arch
+        :param obj: The system.
+        :return: The rendered system.
+        :rtype: dict
+        """
+        _dict = utils.blender(self.api, True, obj)
+        # Generate a pxelinux.cfg?
+        image_based = False
+        profile = obj.get_conceptual_parent()
+        distro = profile.get_conceptual_parent()
+
+        # The management classes stored in the system are just a list of names, so we need to turn it into a full
+        # list of dictionaries (right now we just use the params field).
+        mcs = _dict["mgmt_classes"]
+        _dict["mgmt_classes"] = {}
+        for m in mcs:
+            c = self.api.find_mgmtclass(name=m)
+            if c:
+                _dict["mgmt_classes"][m] = c.to_dict()
+
+        arch = None
+        if distro is None and profile.COLLECTION_TYPE == "image":
+            image_based = True
+            arch = profile.arch
+        else:
+            arch = distro.arch
+
+        if obj.is_management_supported():
+            if not image_based:
+                _dict["pxelinux.cfg"] = self.tftpgen.write_pxe_file(
+                    None, obj, profile, distro, arch)
             else:
-                arch = distro.arch
+                _dict["pxelinux.cfg"] = self.tftpgen.write_pxe_file(
+                    None, obj, None, None, arch, image=profile)
 
-            if obj.is_management_supported():
-                if not image_based:
-                    _dict["pxelinux.cfg"] = self.tftpgen.write_pxe_file(
-                        None, obj, profile, distro, arch)
-                else:
-                    _dict["pxelinux.cfg"] = self.tftpgen.write_pxe_file(
-                        None, obj, None, None, arch, image=profile)
+        return _dict
 
-            return self.xmlrpc_hacks(_dict)
-        return self.xmlrpc_hacks({})
+    def get_system_for_tftp(self, ip_address=None, mac_address=None, token=None, **rest):
+        """
+        Find a system by the MAC or IP address of one of its interfaces and return the attributes a TFTP server needs to
+        serve its files. This is a lot less data than ``get_system_as_rendered()`` and needs only one call.
+
+        :param ip_address: The IP address of the client. Only used if no MAC address is given.
+        :type ip_address: str
+        :param mac_address: The MAC address of the client.
+        :type mac_address: str
+        :param token: The API-token obtained via the login() method.
+        :param rest: This is dropped in this method since it is not needed here.
+        :return: The attributes, see ``TFTP_SYSTEM_FIELDS``, or an empty dict if no or more than one system matched.
+        :rtype: dict
+        """
+        self._log("get_system_for_tftp", token=token)
+        return self.xmlrpc_hacks(self.__system_for_tftp({"ip_address": ip_address, "mac_address": mac_address}))
+
+    def get_systems_for_tftp(self, queries, token=None, **rest):
+        """
+        The batched version of ``get_system_for_tftp()``.
+
+        :param queries: A list of dicts, each with a "name", "mac_address" or "ip_address" key.
+        :type queries: list
+        :param token: The API-token obtained via the login() method.
+        :param rest: This is dropped in this method since it is not needed here.
+        :return: A list with the attributes of the systems in the same order as the queries. Queries which didn't match
+                 exactly one system get an empty dict.
+        :rtype: list
+        """
+        self._log("get_systems_for_tftp", token=token)
+        return self.xmlrpc_hacks([self.__system_for_tftp(query) for query in queries])
+
+    def get_system_names_for_tftp_since(self, mtime, token=None, **rest):
+        """
+        Get the names of the systems whose attributes for ``get_systems_for_tftp()`` may have changed since a given
+        time: The systems which were modified and those which inherit from a modified distro, profile or image. Systems
+        which were removed are not reported, compare with ``get_item_names()`` for those.
+
+        :param mtime: The time after which changes should be included.
+        :param token: The API-token obtained via the login() method.
+        :param rest: This is dropped in this method since it is not needed here.
+        :return: The names of the systems.
+        :rtype: list
+        """
+        self._log("get_system_names_for_tftp_since", token=token)
+        names = dict.fromkeys([obj.name for obj in self.api.get_systems_since(mtime)])
+        changed = self.api.get_distros_since(mtime) + self.api.get_profiles_since(mtime) + \
+            self.api.get_images_since(mtime)
+        for obj in changed:
+            names.update(dict.fromkeys(self.__systems_inheriting(obj)))
+        return self.xmlrpc_hacks(list(names.keys()))
+
+    def __systems_inheriting(self, obj):
+        """
+        Get the names of the systems whose inheritance chain contains a distro, profile or image. Only the objects below
+        it are visited, they are looked up with the distro, parent, profile and image indexes of the collections.
+
+        :param obj: The distro, profile or image.
+        :return: The names of the systems.
+        :rtype: list
+        """
+        if obj.COLLECTION_TYPE == "image":
+            return [system.name for system in self.api.find_items("system", criteria={"image": obj.name})]
+        if obj.COLLECTION_TYPE == "distro":
+            profiles = self.api.find_items("profile", criteria={"distro": obj.name})
+        else:
+            profiles = [obj]
+        names = []
+        seen = set()
+        while profiles:
+            profile = profiles.pop()
+            if profile.name in seen:
+                continue
+            seen.add(profile.name)
+            profiles.extend(self.api.find_items("profile", criteria={"parent": profile.name}))
+            names.extend([system.name for system in self.api.find_items("system", criteria={"profile": profile.name})])
+        return names
+
+    def __system_for_tftp(self, query):
+        """
+        Look up a system for ``get_systems_for_tftp()`` and strip the rendered system down to the attributes a TFTP server
+        needs.
+
+        :param query: A dict with a "name", "mac_address" or "ip_address" key.
+        :return: The attributes or an empty dict.
+        :rtype: dict
+        """
+        if query.get("name"):
+            criteria = {"name": query["name"]}
+        elif query.get("mac_address"):
+            criteria = {"mac_address": query["mac_address"].replace("-", ":").upper()}
+        elif query.get("ip_address"):
+            criteria = {"ip_address": query["ip_address"]}
+        else:
+            return {}
+        systems = self.api.find_items("system", criteria=criteria)
+        if len(systems) != 1:
+            return {}
+        rendered = self.__render_system(systems[0])
+        result = {"mtime": systems[0].mtime}
+        for key in self.TFTP_SYSTEM_FIELDS:
+            if key in rendered:
+                result[key] = rendered[key]
+        # The TFTP server maps and strips the MAC and IP addresses of all interfaces, so flatten them.
+        for (name, interface) in list(rendered.get("interfaces", {}).items()):
+            result["mac_address_%s" % name] = interface.get("mac_address", "")
+            result["ip_address_%s" % name] = interface.get("ip_address", "")
+        return result
 
     def get_repo_as_rendered(self, name, token=None, **rest):
         """
@@ -3085,21 +3839,12 @@ class CobblerXMLRPCInterface(object):
         Deletes any login tokens that might have expired. Also removes expired events.
         """
         timenow = time.time()
-        for token in list(self.token_cache.keys()):
-            (tokentime, user) = self.token_cache[token]
-            if (timenow > tokentime + self.api.settings().auth_token_expiration):
-                self._log("expiring token", token=token, debug=True)
-                del self.token_cache[token]
+        for token in self.token_cache.expire(timenow):
+            self._log("expiring token", token=token, debug=True)
         # and also expired objects
-        for oid in list(self.object_cache.keys()):
-            (tokentime, entry) = self.object_cache[oid]
-            if (timenow > tokentime + CACHE_TIMEOUT):
-                del self.object_cache[oid]
-        for tid in list(self.events.keys()):
-            (eventtime, name, status, who) = self.events[tid]
-            if (timenow > eventtime + EVENT_TIMEOUT):
-                del self.events[tid]
-            # logfile cleanup should be dealt w/ by logrotate
+        self.object_cache.expire(timenow)
+        self.events.expire(timenow)
+        # logfile cleanup should be dealt w/ by logrotate
 
     def __validate_user(self, input_user, input_password):
         """
@@ -3127,8 +3872,9 @@ class CobblerXMLRPCInterface(object):
         """
         self.__invalidate_expired_tokens()
 
-        if token in self.token_cache:
-            user = self.get_user_from_token(token)
+        entry = self.token_cache.get(token)
+        if entry is not None:
+            user = entry[1]
             if user == "<system>":
                 # system token is only valid over Unix socket
                 return False
@@ -3249,10 +3995,7 @@ class CobblerXMLRPCInterface(object):
         :rtype: bool
         """
         self._log("logout", token=token)
-        if token in self.token_cache:
-            del self.token_cache[token]
-            return True
-        return False
+        return self.token_cache.pop(token, None) is not None
 
     def token_check(self, token):
         """
@@ -3428,20 +4171,224 @@ class CobblerXMLRPCInterface(object):
 # *********************************************************************************
 
 
-class CobblerXMLRPCServer(ThreadingMixIn, xmlrpc.server.SimpleXMLRPCServer):
+class CobblerXMLRPCRequestHandler(xmlrpc.server.SimpleXMLRPCRequestHandler):
+    """
+    Handles the requests of a connection. Connections are kept open between requests (HTTP/1.1 keep-alive), but an idle
+    connection doesn't keep its worker: It is handed back to the server, which queues it again when the next request
+    arrives.
+    """
+    protocol_version = "HTTP/1.1"
+    # How long reading a request which started to arrive may take
+    timeout = 30
+
+    @property
+    def encode_threshold(self):
+        """
+        Responses larger than this are gzip encoded if the client accepts it, None disables the compression.
+        """
+        return self.server.gzip_threshold or None
+
+    def handle(self):
+        """
+        Handle the requests which arrived on the connection without waiting for more.
+        """
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection and self.__has_pending_request():
+            self.handle_one_request()
+        self.keep_alive = not self.close_connection
+
+    def __has_pending_request(self):
+        """
+        Check if the client already sent the next request, e.g. because it pipelines them.
+
+        :return: True if data is waiting to be read.
+        :rtype: bool
+        """
+        self.connection.setblocking(False)
+        try:
+            return len(self.rfile.peek(1)) > 0
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
+
+class CobblerXMLRPCBusyHandler(CobblerXMLRPCRequestHandler):
+    """
+    Answers a request with a fault instead of executing it. Used when all workers are busy and the queue is full.
+    """
+    timeout = 2
+
+    def do_POST(self):
+        """
+        Read the request and reply with the fault.
+        """
+        self.rfile.read(int(self.headers.get("content-length", 0)))
+        fault = xmlrpc.client.Fault(1, "<class 'cobbler.cexceptions.CX'>:'server busy, %d requests are queued, retry "
+                                       "later'" % self.server.request_queue.qsize())
+        response = xmlrpc.client.dumps(fault, methodresponse=True, allow_none=self.server.allow_none).encode()
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header("Content-type", "text/xml")
+        self.send_header("Content-length", str(len(response)))
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(response)
+
+
+class CobblerXMLRPCServer(xmlrpc.server.SimpleXMLRPCServer):
     """
     This is the class for the main Cobbler XMLRPC Server. This class does not directly contain all XMLRPC methods. It
     just starts the server.
+
+    Requests are handled by a fixed number of worker threads. Connections with a request wait in a bounded queue for a
+    worker. If the queue is full, the connection is handed to a rejector thread which answers the request with a fault,
+    so neither the acceptor nor the keep-alive thread ever read from a client. Idle persistent connections are watched
+    by a single thread until their next request arrives or they time out.
     """
+    # How long an idle persistent connection is kept open
+    keepalive_timeout = 15
+    # How many rejected connections may wait for the rejector thread, connections beyond that are closed unanswered
+    reject_queue_size = 64
 
-    def __init__(self, args):
+    def __init__(self, args, threads=16, queue_size=128, gzip_threshold=16384):
         """
         The constructor for the main Cobbler XMLRPC server.
 
         :param args: Arguments which are handed to the Python XMLRPC server.
+        :param threads: The number of worker threads.
+        :param queue_size: How many connections may wait for a worker.
+        :param gzip_threshold: Responses larger than this are gzip encoded if the client accepts it. ``0`` disables the
+                               compression.
         """
         self.allow_reuse_address = True
-        xmlrpc.server.SimpleXMLRPCServer.__init__(self, args)
+        self.request_queue = queue.Queue(max(queue_size, 1))
+        self.reject_queue = queue.Queue(self.reject_queue_size)
+        self.gzip_threshold = gzip_threshold
+        self.idle = []
+        self.idle_lock = Lock()
+        (self.wakeup_r, self.wakeup_w) = socket.socketpair()
+        self.wakeup_w.setblocking(False)
+        xmlrpc.server.SimpleXMLRPCServer.__init__(self, args, requestHandler=CobblerXMLRPCRequestHandler)
+        for i in range(max(threads, 1)):
+            worker = Thread(target=self.__worker, name="xmlrpc-worker-%d" % i)
+            worker.daemon = True
+            worker.start()
+        watcher = Thread(target=self.__watch_idle, name="xmlrpc-keepalive")
+        watcher.daemon = True
+        watcher.start()
+        rejector = Thread(target=self.__reject, name="xmlrpc-rejector")
+        rejector.daemon = True
+        rejector.start()
+
+    def process_request(self, request, client_address):
+        """
+        Queue a connection with a request for the workers or reject it if the queue is full.
+
+        :param request: The socket of the connection.
+        :param client_address: The address of the client.
+        """
+        try:
+            self.request_queue.put_nowait((request, client_address))
+        except queue.Full:
+            self.reject_request(request, client_address)
+
+    def reject_request(self, request, client_address):
+        """
+        Hand a connection to the rejector thread, which answers its request with a "server busy" fault. This never
+        blocks: If the rejector is behind as well, the connection is closed right away.
+
+        :param request: The socket of the connection.
+        :param client_address: The address of the client.
+        """
+        try:
+            self.reject_queue.put_nowait((request, client_address))
+        except queue.Full:
+            self.shutdown_request(request)
+
+    def __reject(self):
+        """
+        Answer the requests of the rejected connections with a "server busy" fault and close them.
+        """
+        while True:
+            (request, client_address) = self.reject_queue.get()
+            try:
+                CobblerXMLRPCBusyHandler(request, client_address, self)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def finish_request(self, request, client_address):
+        """
+        Handle the requests of a connection.
+
+        :param request: The socket of the connection.
+        :param client_address: The address of the client.
+        :return: The request handler.
+        """
+        return self.RequestHandlerClass(request, client_address, self)
+
+    def __worker(self):
+        """
+        Handle the queued connections until the process exits.
+        """
+        while True:
+            (request, client_address) = self.request_queue.get()
+            keep_alive = False
+            try:
+                keep_alive = self.finish_request(request, client_address).keep_alive
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                if keep_alive:
+                    self.__add_idle(request, client_address)
+                else:
+                    self.shutdown_request(request)
+
+    def __add_idle(self, request, client_address):
+        """
+        Hand an idle persistent connection to the keep-alive thread.
+
+        :param request: The socket of the connection.
+        :param client_address: The address of the client.
+        """
+        with self.idle_lock:
+            self.idle.append((request, client_address))
+        try:
+            self.wakeup_w.send(b"\0")
+        except BlockingIOError:
+            # the thread has enough wakeups pending already
+            pass
+
+    def __watch_idle(self):
+        """
+        Queue idle persistent connections again once their next request arrives and close those which time out.
+        """
+        selector = selectors.DefaultSelector()
+        selector.register(self.wakeup_r, selectors.EVENT_READ)
+        last_expiry = time.time()
+        while True:
+            for (key, events) in selector.select(1):
+                if key.fileobj is self.wakeup_r:
+                    self.wakeup_r.recv(4096)
+                    continue
+                selector.unregister(key.fileobj)
+                self.process_request(key.fileobj, key.data[0])
+
+            now = time.time()
+            with self.idle_lock:
+                (idle, self.idle) = (self.idle, [])
+            for (request, client_address) in idle:
+                selector.register(request, selectors.EVENT_READ, (client_address, now))
+
+            if now - last_expiry >= 1:
+                last_expiry = now
+                for key in list(selector.get_map().values()):
+                    if key.fileobj is not self.wakeup_r and now - key.data[1] > self.keepalive_timeout:
+                        selector.unregister(key.fileobj)
+                        self.shutdown_request(key.fileobj)
 
 # *********************************************************************************
 
@@ -98,6 +98,22 @@ def serialize_item(collection, item):
     __release_lock(with_changes=True)
 
 
+def serialize_items(items):
+    """
+    Save many collection items to disk while holding the lock only once.
+
+    :param items: A list of tuples with the Cobbler collection and the collection item to serialize.
+    """
+
+    __grab_lock()
+    try:
+        for (collection, item) in items:
+            storage_module = __get_storage_module(collection.collection_type())
+            storage_module.serialize_item(collection, item)
+    finally:
+        __release_lock(with_changes=True)
+
+
 def serialize_delete(collection, item):
     """
     Delete a collection item from disk
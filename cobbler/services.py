@@ -23,13 +23,80 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
 
 from builtins import str
 from builtins import object
+import os
 import simplejson
+import threading
 import time
 import xmlrpc.client
 import yaml
 from cobbler.cobbler_collections import manager
 from cobbler import download_manager
 
+# Idle XML-RPC proxies to cobblerd per server URL. A proxy is used by one request at a time, its transport keeps the
+# HTTP connection open between requests if the server allows it.
+XMLRPC_POOL = {}
+XMLRPC_POOL_LOCK = threading.Lock()
+# The number of idle proxies kept per server URL, additional ones are closed.
+XMLRPC_POOL_SIZE = 16
+
+# The parsed settings file together with its mtime and size. See read_settings().
+SETTINGS_CACHE = {}
+SETTINGS_CACHE_LOCK = threading.Lock()
+
+
+def acquire_xmlrpc_proxy(server):
+    """
+    Get an idle XML-RPC proxy from the pool or create a new one.
+
+    :param server: The URL of the XML-RPC server.
+    :type server: str
+    :return: The proxy. Hand it back with ``release_xmlrpc_proxy()`` when the request is done.
+    """
+    with XMLRPC_POOL_LOCK:
+        idle = XMLRPC_POOL.get(server)
+        if idle:
+            return idle.pop()
+    return xmlrpc.client.Server(server, allow_none=True)
+
+
+def release_xmlrpc_proxy(server, proxy):
+    """
+    Put a proxy back into the pool, so the next request can reuse its connection.
+
+    :param server: The URL of the XML-RPC server.
+    :type server: str
+    :param proxy: The proxy from ``acquire_xmlrpc_proxy()``.
+    """
+    with XMLRPC_POOL_LOCK:
+        idle = XMLRPC_POOL.setdefault(server, [])
+        if len(idle) < XMLRPC_POOL_SIZE:
+            idle.append(proxy)
+            return
+    proxy("close")()
+
+
+def read_settings(filename="/etc/cobbler/settings"):
+    """
+    Read the settings file. The parsed settings are cached and the file is only parsed again if its mtime or size
+    changed.
+
+    :param filename: The path of the settings file.
+    :type filename: str
+    :return: The settings.
+    :rtype: dict
+    """
+    stat = os.stat(filename)
+    signature = (stat.st_mtime, stat.st_size)
+    with SETTINGS_CACHE_LOCK:
+        cached = SETTINGS_CACHE.get(filename)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+    with open(filename) as fd:
+        data = yaml.safe_load(fd.read())
+    with SETTINGS_CACHE_LOCK:
+        SETTINGS_CACHE[filename] = (signature, data)
+    return data
+
 
 class CobblerSvc(object):
     """
@@ -56,7 +123,16 @@ class CobblerSvc(object):
         Sets up the connection to the Cobbler XMLRPC server. This is the version that does not require a login.
         """
         if self.remote is None:
-            self.remote = xmlrpc.client.Server(self.server, allow_none=True)
+            self.remote = acquire_xmlrpc_proxy(self.server)
+
+    def _close(self):
+        """
+        Hand the connection to the Cobbler XMLRPC server back to the pool. Call this when the request is done. It is not
+        an operation, so it is named like a private method and the svc front end doesn't dispatch to it.
+        """
+        if self.remote is not None:
+            release_xmlrpc_proxy(self.server, self.remote)
+            self.remote = None
 
     def index(self, **args):
         """
@@ -127,6 +203,22 @@ class CobblerSvc(object):
         data = self.remote.generate_gpxe(profile, system)
         return "%s" % data
 
+    def bootconfig(self, mac=None, loader="pxe", **rest):
+        """
+        Generate the pxelinux or GRUB configuration of a system interface, as it would be written to
+        pxelinux.cfg/01-<mac> or grub/system/<mac>.
+
+        :param mac: The MAC address of the interface.
+        :param loader: Either "pxe" or "grub".
+        :param rest: This parameter is unused.
+        :return:
+        """
+        self.__xmlrpc_setup()
+        data = self.remote.generate_system_config(mac or "", loader)
+        if not data:
+            return "# system not found"
+        return "%s" % data
+
     def bootcfg(self, profile=None, system=None, **rest):
         """
         Generate a boot.cfg config file. Used primarily for VMware ESXi.
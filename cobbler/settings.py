@@ -40,6 +40,7 @@ DEFAULTS = {
     "anamon_enabled": [0, "bool"],
     "auth_token_expiration": [3600, "int"],
     "authn_pam_service": ["login", "str"],
+    "autoinstall_cache_size": [1024, "int"],
     "autoinstall_snippets_dir": ["/var/lib/cobbler/snippets", "str"],
     "autoinstall_templates_dir": ["/var/lib/cobbler/templates", "str"],
     "bind_chroot_path": ["", "str"],
@@ -75,6 +76,7 @@ DEFAULTS = {
     "enable_menu": [1, "bool"],
     "http_port": [80, "int"],
     "include": [["/etc/cobbler/settings.d/*.settings"], "list"],
+    "incremental_sync": [0, "bool"],
     "iso_template_dir": ["/etc/cobbler/iso", "str"],
     "kernel_options": [{}, "dict"],
     "ldap_anonymous_bind": [1, "bool"],
@@ -117,8 +119,11 @@ DEFAULTS = {
     "register_new_installs": [0, "bool"],
     "remove_old_puppet_certs_automatically": [0, "bool"],
     "replicate_repo_rsync_options": ["-avzH", "str"],
+    "replicate_rsync_jobs": [4, "int"],
     "replicate_rsync_options": ["-avzH", "str"],
     "reposync_flags": ["-l -m -d", "str"],
+    "reposync_host_connections": [2, "int"],
+    "reposync_workers": [1, "int"],
     "restart_dhcp": [1, "bool"],
     "restart_dns": [1, "bool"],
     "run_install_triggers": [1, "bool"],
@@ -129,13 +134,21 @@ DEFAULTS = {
     "serializer_pretty_json": [0, "bool"],
     "server": ["127.0.0.1", "str"],
     "sign_puppet_certs_automatically": [0, "bool"],
+    "snippet_cache_interval": [5, "int"],
+    "sync_workers": [1, "int"],
     "signature_path": ["/var/lib/cobbler/distro_signatures.json", "str"],
     "signature_url": ["https://cobbler.github.io/signatures/3.0.x/latest.json", "str"],
+    "task_limits": [{"sync": 1, "replicate": 1, "import": 1, "buildiso": 1}, "dict"],
+    "task_workers": [4, "int"],
+    "template_cache_size": [256, "int"],
     "tftpboot_location": ["/var/lib/tftpboot", "str"],
     "virt_auto_boot": [0, "bool"],
     "webdir": ["/var/www/cobbler", "str"],
     "webdir_whitelist": [".link_cache", "misc", "distro_mirror", "images", "links", "localmirror", "pub", "rendered", "repo_mirror", "repo_profile", "repo_system", "svc", "web", "webui"],
+    "xmlrpc_gzip_threshold": [16384, "int"],
     "xmlrpc_port": [25151, "int"],
+    "xmlrpc_queue_size": [128, "int"],
+    "xmlrpc_threads": [16, "int"],
     "yum_distro_priority": [1, "int"],
     "yum_post_install_mirror": [1, "bool"],
     "yumdownloader_flags": ["--resolve", "str"],
@@ -262,6 +275,7 @@ class Settings(object):
 
         self._clear()
         self.__dict__.update(_dict)
+        utils.blender_cache_invalidate(self)
 
         return self
 
@@ -295,6 +309,7 @@ class Settings(object):
                 raise AttributeError
 
             self.__dict__[name] = value
+            utils.blender_cache_invalidate(self)
             if not utils.update_settings_file(self.to_dict()):
                 raise AttributeError
 
@@ -0,0 +1,297 @@
+"""
+Manifest of the files generated by "cobbler sync". It allows an incremental sync to only regenerate the files whose
+inputs changed, to replace changed files atomically and to delete only the files which are not generated anymore.
+
+This program is free software; you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation; either version 2 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program; if not, write to the Free Software
+Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
+02110-1301  USA
+"""
+
+from builtins import object
+import glob
+import hashlib
+import os
+import tempfile
+import threading
+
+import simplejson
+
+from cobbler import clogger
+from cobbler import utils
+
+MANIFEST_FILE = "/var/lib/cobbler/sync_manifest.json"
+MANIFEST_VERSION = 1
+
+# The manifest of the sync running in the current thread. Code generating files asks for it with get_active(). It is
+# kept per thread, so a lite sync which runs next to a full sync doesn't record its files in the other manifest.
+ACTIVE = threading.local()
+
+
+def activate(manifest):
+    """
+    Make a manifest the one all files generated by the current thread are recorded in.
+
+    :param manifest: The manifest of the sync which is starting.
+    """
+    ACTIVE.manifest = manifest
+
+
+def deactivate():
+    """
+    Stop recording the files generated by the current thread.
+    """
+    ACTIVE.manifest = None
+
+
+def get_active():
+    """
+    Get the manifest of the sync which is running in the current thread.
+
+    :return: The manifest or None if no sync is running.
+    """
+    return getattr(ACTIVE, "manifest", None)
+
+
+def write_file(path, data):
+    """
+    Write a generated file. If a sync is running the file is recorded in its manifest and only replaced if the content
+    changed, otherwise it is simply written.
+
+    :param path: The path of the file.
+    :param data: The new content of the file.
+    :type data: str
+    """
+    manifest = get_active()
+    if manifest is not None:
+        manifest.write(path, data)
+    else:
+        with open(path, "w") as fd:
+            fd.write(data)
+
+
+def object_sources(api_handle, obj):
+    """
+    Describe the inputs a file generated for an object depends on: The object itself and all objects it inherits from.
+
+    :param api_handle: The api to resolve the inheritance tree with.
+    :param obj: The item files are generated for.
+    :return: A list with the type, name and mtime of the objects.
+    :rtype: list
+    """
+    sources = []
+    for node in utils.grab_tree(api_handle, obj)[:-1]:
+        sources.append([node.COLLECTION_TYPE, node.name, node.mtime])
+    return sources
+
+
+def file_sources(patterns):
+    """
+    Describe files which are used as inputs, e.g. templates or the settings file.
+
+    :param patterns: A list of file paths or glob patterns.
+    :return: A list with the path and mtime of all matching files.
+    :rtype: list
+    """
+    sources = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            sources.append([path, os.path.getmtime(path)])
+    return sources
+
+
+class SyncManifest(object):
+    """
+    The files generated by a sync with their content hashes and the sources of the objects they were generated for.
+    """
+
+    def __init__(self, filename=MANIFEST_FILE, logger=None):
+        """
+        Constructor
+
+        :param filename: Where the manifest is persisted.
+        :param logger: The logger to audit all actions with.
+        """
+        self.filename = filename
+        self.logger = logger
+        if self.logger is None:
+            self.logger = clogger.Logger()
+        self.files = {}
+        self.owners = {}
+        self.seen = set()
+        self.seen_owners = set()
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def load(self):
+        """
+        Load the manifest of the last sync. A missing or unreadable manifest is treated as empty, which means that
+        everything is regenerated.
+        """
+        self.files = {}
+        self.owners = {}
+        if not os.path.exists(self.filename):
+            return
+        try:
+            with open(self.filename, "r") as fd:
+                data = simplejson.load(fd)
+        except (IOError, OSError, ValueError) as e:
+            self.logger.warning("ignoring unreadable sync manifest %s: %s" % (self.filename, e))
+            return
+        if data.get("version") != MANIFEST_VERSION:
+            return
+        self.files = data.get("files", {})
+        self.owners = data.get("owners", {})
+
+    def save(self):
+        """
+        Persist the manifest.
+        """
+        data = {"version": MANIFEST_VERSION, "files": self.files, "owners": self.owners}
+        self.__write_atomic(self.filename, simplejson.dumps(data))
+
+    def is_unchanged(self, owner, sources):
+        """
+        Check if the files of an object are still up to date. If they are, they are kept by this sync.
+
+        :param owner: The key of the object, e.g. "system/foo".
+        :param sources: The current sources of the object. See ``object_sources()`` and ``file_sources()``.
+        :return: True if the sources are the same as during the last generation and all files still exist.
+        :rtype: bool
+        """
+        with self.lock:
+            entry = self.owners.get(owner)
+            if entry is None or entry["sources"] != sources:
+                return False
+            for path in entry["files"]:
+                if not self.__is_current(path):
+                    return False
+            self.seen.update(entry["files"])
+            self.seen_owners.add(owner)
+            return True
+
+    def begin(self, owner, sources):
+        """
+        Start generating the files of an object in the current thread. All files written until ``end()`` belong to it.
+
+        :param owner: The key of the object, e.g. "system/foo".
+        :param sources: The current sources of the object.
+        """
+        with self.lock:
+            self.owners[owner] = {"sources": sources, "files": []}
+            self.seen_owners.add(owner)
+        self.local.owner = owner
+
+    def end(self):
+        """
+        Stop recording files for the object of the current thread.
+        """
+        self.local.owner = None
+
+    def write(self, path, data):
+        """
+        Write a generated file unless it already has the same content. Changed files are replaced atomically.
+
+        :param path: The path of the file.
+        :param data: The new content of the file.
+        :type data: str
+        """
+        digest = hashlib.sha1(data.encode("utf-8")).hexdigest()
+        with self.lock:
+            entry = self.files.get(path)
+            unchanged = entry is not None and entry.get("sha1") == digest and self.__is_current(path)
+        if not unchanged:
+            self.__write_atomic(path, data)
+            stat = os.stat(path)
+            entry = {"sha1": digest, "size": stat.st_size, "mtime": stat.st_mtime}
+        self.record(path, entry)
+
+    def record(self, path, entry=None):
+        """
+        Record a file which was generated without ``write()``, e.g. a symlink.
+
+        :param path: The path of the file.
+        :param entry: The size and mtime of the file and, for files from ``write()``, its hash. Without them the file is
+                      only checked for existence.
+        """
+        with self.lock:
+            self.files[path] = entry or {}
+            self.seen.add(path)
+            owner = getattr(self.local, "owner", None)
+            if owner is not None:
+                self.owners[owner]["files"].append(path)
+
+    def is_previous_output(self, path):
+        """
+        Check if a file was generated by the last sync but not yet by the running one.
+
+        :param path: The path of the file.
+        :rtype: bool
+        """
+        with self.lock:
+            return path in self.files and path not in self.seen
+
+    def remove_orphans(self):
+        """
+        Delete all files of the last sync which were not generated again by this one and forget about the objects which
+        don't exist anymore.
+        """
+        with self.lock:
+            orphans = [path for path in self.files if path not in self.seen]
+            for path in orphans:
+                if os.path.lexists(path):
+                    self.logger.info("removing orphaned file: %s" % path)
+                    utils.rmfile(path, logger=self.logger)
+                del self.files[path]
+            for owner in list(self.owners.keys()):
+                if owner not in self.seen_owners:
+                    del self.owners[owner]
+
+    def __is_current(self, path):
+        """
+        Check if a file on disk is still the one which was recorded in the manifest.
+
+        :param path: The path of the file.
+        :return: True if the file exists and, if known, size and mtime match.
+        :rtype: bool
+        """
+        entry = self.files.get(path)
+        if entry is None or not os.path.lexists(path):
+            return False
+        if "size" not in entry:
+            return True
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # a dangling symlink
+            return False
+        return stat.st_size == entry["size"] and stat.st_mtime == entry["mtime"]
+
+    def __write_atomic(self, path, data):
+        """
+        Write a file via a temporary file in the same directory, so readers either see the old or the new content.
+
+        :param path: The path of the file.
+        :param data: The content of the file.
+        :type data: str
+        """
+        (fd, tmp_path) = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".%s." % os.path.basename(path))
+        try:
+            with os.fdopen(fd, "w") as tmp_fd:
+                tmp_fd.write(data)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
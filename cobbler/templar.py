@@ -24,12 +24,15 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
 
 from builtins import str
 from builtins import object
+import collections
+import hashlib
 import re
 import Cheetah
 import functools
 import os
 import os.path
 import pprint
+import threading
 
 jinja2_available = False
 try:
@@ -47,6 +50,20 @@ from . import utils
 major, minor, release = Cheetah.Version.split('.')[0:3]
 fix_cheetah_class = (int(major), int(minor), int(release)) >= (2, 4, 2)
 
+CHEETAH_COMPILER_SETTINGS = {'useStackFrame': False}
+
+# Compiled Cheetah template classes and Jinja2 templates, keyed by the hash of the source, the template type and the
+# compiler settings. The least recently used entries are evicted first. See Templar.compile_template().
+TEMPLATE_CACHE = collections.OrderedDict()
+TEMPLATE_CACHE_LOCK = threading.Lock()
+TEMPLATE_CACHE_STATS = {"hits": 0, "misses": 0}
+# Used if the Templar was created without a collection manager and therefore without settings.
+DEFAULT_TEMPLATE_CACHE_SIZE = 256
+
+# One Jinja2 environment per include directory. Environments cache the templates they load and reload them if the
+# files change.
+JINJA2_ENVIRONMENTS = {}
+
 
 class Templar(object):
 
@@ -205,12 +222,17 @@ class Templar(object):
             "template_universe": table_copy
         })
 
-        # Now do full templating scan, where we will also templatify the snippet insertions
-        t = Template(source=raw_data, searchList=[search_table], compilerSettings={'useStackFrame': False})
+        # Now do full templating scan, where we will also templatify the snippet insertions. Snippets are included
+        # at render time, so the compiled class can be reused even if the snippet files change.
+        template_class = self.compile_template(raw_data, "cheetah")
+        if template_class is not None:
+            t = template_class(searchList=[search_table])
+        else:
+            t = Template(source=raw_data, searchList=[search_table], compilerSettings=CHEETAH_COMPILER_SETTINGS)
 
-        if fix_cheetah_class:
-            t.SNIPPET = functools.partial(t.SNIPPET, t)
-            t.read_snippet = functools.partial(t.read_snippet, t)
+            if fix_cheetah_class:
+                t.SNIPPET = functools.partial(t.SNIPPET, t)
+                t.read_snippet = functools.partial(t.read_snippet, t)
 
         try:
             data_out = t.respond()
@@ -235,10 +257,9 @@ class Templar(object):
         """
 
         try:
-            if self.settings and self.settings.jinja2_includedir:
-                template = jinja2.Environment(loader=jinja2.FileSystemLoader(self.settings.jinja2_includedir)).from_string(raw_data)
-            else:
-                template = jinja2.Template(raw_data)
+            template = self.compile_template(raw_data, "jinja2")
+            if template is None:
+                template = self.__get_jinja2_environment().from_string(raw_data)
             data_out = template.render(search_table)
         except Exception as exc:
             self.logger.warning("errors were encountered rendering the template")
@@ -246,3 +267,92 @@ class Templar(object):
             data_out = "# EXCEPTION OCCURRED DURING JINJA2 TEMPLATE PROCESSING\n"
 
         return data_out
+
+    def compile_template(self, raw_data, template_type):
+        """
+        Get the compiled form of a template from the cache or compile it. For Cheetah this is the template class, for
+        Jinja2 the template object.
+
+        :param raw_data: The template code.
+        :param template_type: May currently be "cheetah" or "jinja2".
+        :type template_type: str
+        :return: The compiled template or None if the cache is disabled.
+        """
+        size = self.__template_cache_size()
+        if size <= 0:
+            return None
+        if template_type == "cheetah":
+            compiler_settings = tuple(sorted(CHEETAH_COMPILER_SETTINGS.items()))
+        else:
+            compiler_settings = self.__jinja2_includedir()
+        key = (hashlib.sha1(raw_data.encode("utf-8")).hexdigest(), template_type, compiler_settings)
+
+        with TEMPLATE_CACHE_LOCK:
+            compiled = TEMPLATE_CACHE.get(key)
+            if compiled is not None:
+                TEMPLATE_CACHE.move_to_end(key)
+                TEMPLATE_CACHE_STATS["hits"] += 1
+                return compiled
+            TEMPLATE_CACHE_STATS["misses"] += 1
+
+        # Compile outside of the lock, in the worst case two threads compile the same template.
+        if template_type == "cheetah":
+            compiled = Template.compile(source=raw_data, compilerSettings=CHEETAH_COMPILER_SETTINGS,
+                                        cacheCompilationResults=False)
+        else:
+            compiled = self.__get_jinja2_environment().from_string(raw_data)
+
+        with TEMPLATE_CACHE_LOCK:
+            TEMPLATE_CACHE[key] = compiled
+            while len(TEMPLATE_CACHE) > size:
+                TEMPLATE_CACHE.popitem(last=False)
+        return compiled
+
+    def __template_cache_size(self):
+        """
+        Get the maximum number of compiled templates to keep.
+
+        :rtype: int
+        """
+        if self.settings:
+            return self.settings.template_cache_size
+        return DEFAULT_TEMPLATE_CACHE_SIZE
+
+    def __jinja2_includedir(self):
+        """
+        Get the directory Jinja2 templates may include other templates from.
+
+        :return: The directory or None if including is not configured.
+        """
+        if self.settings and self.settings.jinja2_includedir:
+            return self.settings.jinja2_includedir
+        return None
+
+    def __get_jinja2_environment(self):
+        """
+        Get the Jinja2 environment for the configured include directory. It is created only once.
+
+        :return: The Jinja2 environment.
+        """
+        includedir = self.__jinja2_includedir()
+        environment = JINJA2_ENVIRONMENTS.get(includedir)
+        if environment is None:
+            if includedir:
+                environment = jinja2.Environment(loader=jinja2.FileSystemLoader(includedir))
+            else:
+                environment = jinja2.Environment()
+            JINJA2_ENVIRONMENTS[includedir] = environment
+        return environment
+
+
+def template_cache_stats():
+    """
+    Get the counters of the compiled template cache.
+
+    :return: A dict with the number of hits, misses and cached templates.
+    :rtype: dict
+    """
+    with TEMPLATE_CACHE_LOCK:
+        stats = TEMPLATE_CACHE_STATS.copy()
+        stats["entries"] = len(TEMPLATE_CACHE)
+    return stats
@@ -25,12 +25,63 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
 import Cheetah.Template as cheetah_template
 import os.path
 import re
+import threading
+import time
 
 from cobbler.cexceptions import FileNotFoundException
 from cobbler import utils
 
 CHEETAH_MACROS_FILE = '/etc/cobbler/cheetah_macros'
 
+BUILTIN_TEMPLATE_SOURCE = "\n".join([
+
+    # This part (see 'Template' below
+    # for the other part) handles the actual inclusion of the file contents. We
+    # still need to make the snippet's namespace (searchList) available to the
+    # template calling SNIPPET (done in the other part).
+
+    # Moved the other functions into /etc/cobbler/cheetah_macros
+    # Left SNIPPET here since it is very important.
+
+    # This function can be used in two ways:
+    # Cheetah syntax:
+    #
+    # $SNIPPET('my_snippet')
+    #
+    # SNIPPET syntax:
+    #
+    # SNIPPET::my_snippet
+    #
+    # This follows all of the rules of snippets and advanced snippets. First it
+    # searches for a per-system snippet, then a per-profile snippet, then a
+    # general snippet. If none is found, a comment explaining the error is
+    # substituted.
+    "#def SNIPPET($file)",
+    "#set $snippet = $read_snippet($file)",
+    "#if $snippet",
+    "#include source=$snippet",
+    "#else",
+    "# Error: no snippet data for $file",
+    "#end if",
+    "#end def",
+]) + "\n"
+
+# The compiled builtin template and the compiled macros file together with the mtime and size of the file. Compiling
+# them once instead of for every template saves a lot of time, see get_builtin_template() and get_macros_template().
+BUILTIN_TEMPLATE = None
+MACROS_TEMPLATE = (None, None)
+
+# The contents of local snippet files keyed by path, together with the mtime and size they were read with and when
+# they were last checked. Missing files are cached as well, since most per-system and per-profile snippets don't exist.
+# See read_snippet_file().
+SNIPPET_CACHE = {}
+SNIPPET_CACHE_LOCK = threading.Lock()
+SNIPPET_CACHE_STATS = {"hits": 0, "stats": 0, "reads": 0}
+# Used if the templates search list doesn't contain the "snippet_cache_interval" setting.
+DEFAULT_SNIPPET_CACHE_INTERVAL = 5
+# Collects the snippet files the renders of the current thread look at, see start_recording_snippets().
+SNIPPET_RECORDER = threading.local()
+
 # This class is defined using the Cheetah language. Using the 'compile' function
 # we can compile the source directly into a python class. This class will allow
 # us to define the cheetah builtins.
@@ -49,39 +100,8 @@ class Template(cheetah_template.Template):
 
         :param kwargs: These arguments get passed to the super constructor of this class.
         """
-        self.MacrosTemplate = Template.compile(file=CHEETAH_MACROS_FILE)
-        self.BuiltinTemplate = Template.compile(source="\n".join([
-
-            # This part (see 'Template' below
-            # for the other part) handles the actual inclusion of the file contents. We
-            # still need to make the snippet's namespace (searchList) available to the
-            # template calling SNIPPET (done in the other part).
-
-            # Moved the other functions into /etc/cobbler/cheetah_macros
-            # Left SNIPPET here since it is very important.
-
-            # This function can be used in two ways:
-            # Cheetah syntax:
-            #
-            # $SNIPPET('my_snippet')
-            #
-            # SNIPPET syntax:
-            #
-            # SNIPPET::my_snippet
-            #
-            # This follows all of the rules of snippets and advanced snippets. First it
-            # searches for a per-system snippet, then a per-profile snippet, then a
-            # general snippet. If none is found, a comment explaining the error is
-            # substituted.
-            "#def SNIPPET($file)",
-            "#set $snippet = $read_snippet($file)",
-            "#if $snippet",
-            "#include source=$snippet",
-            "#else",
-            "# Error: no snippet data for $file",
-            "#end if",
-            "#end def",
-        ]) + "\n")
+        self.MacrosTemplate = get_macros_template()
+        self.BuiltinTemplate = get_builtin_template()
         super(Template, self).__init__(**kwargs)
 
     # OK, so this function gets called by Cheetah.Template.Template.__init__ to compile the template into a class. This
@@ -144,19 +164,20 @@ class Template(cheetah_template.Template):
         :return: None (if the snippet file was not found) or the string with the read snippet.
         :rtype: str
         """
+        interval = self.getVar('snippet_cache_interval', DEFAULT_SNIPPET_CACHE_INTERVAL)
         for snipclass in ('system', 'profile', 'distro'):
             if self.varExists('%s_name' % snipclass):
                 fullpath = '%s/per_%s/%s/%s' % (self.getVar('autoinstall_snippets_dir'),
                                                 snipclass, file,
                                                 self.getVar('%s_name' % snipclass))
                 try:
-                    contents = utils.read_file_contents(fullpath, fetch_if_remote=True)
+                    contents = read_snippet_file(fullpath, interval)
                     return contents
                 except FileNotFoundException:
                     pass
 
         try:
-            return "#errorCatcher ListErrors\n" + utils.read_file_contents('%s/%s' % (self.getVar('autoinstall_snippets_dir'), file), fetch_if_remote=True)
+            return "#errorCatcher ListErrors\n" + read_snippet_file('%s/%s' % (self.getVar('autoinstall_snippets_dir'), file), interval)
         except FileNotFoundException:
             return None
 
@@ -214,3 +235,170 @@ class Template(cheetah_template.Template):
             else:
                 return c
         return ''.join([escchar(c) for c in value])
+
+
+def get_builtin_template():
+    """
+    Get the compiled template with the Cheetah part of the SNIPPET function. It is compiled only once.
+
+    :return: The compiled template class.
+    """
+    global BUILTIN_TEMPLATE
+    if BUILTIN_TEMPLATE is None:
+        BUILTIN_TEMPLATE = Template.compile(source=BUILTIN_TEMPLATE_SOURCE)
+    return BUILTIN_TEMPLATE
+
+
+def get_macros_template():
+    """
+    Get the compiled macros file. It is compiled again only if the mtime or size of the file changed.
+
+    :return: The compiled template class.
+    """
+    global MACROS_TEMPLATE
+    try:
+        stat = os.stat(CHEETAH_MACROS_FILE)
+        signature = (stat.st_mtime, stat.st_size)
+    except OSError:
+        signature = None
+    (cached_signature, macros_template) = MACROS_TEMPLATE
+    if macros_template is None or cached_signature != signature:
+        macros_template = Template.compile(file=CHEETAH_MACROS_FILE)
+        MACROS_TEMPLATE = (signature, macros_template)
+    return macros_template
+
+
+def read_snippet_file(path, interval=DEFAULT_SNIPPET_CACHE_INTERVAL):
+    """
+    Read a snippet file through the snippet cache. A cached file is checked again with stat at most once per interval
+    and only read again if its mtime or size changed. Remote files are always fetched.
+
+    :param path: The path of the snippet file.
+    :param interval: The number of seconds a cached file is used without checking it. 0 checks it every time.
+    :type interval: int
+    :return: The contents of the file.
+    :rtype: str
+    :raises FileNotFoundException: if the file does not exist.
+    """
+    if not path.startswith("/"):
+        __record_snippet(path, False)
+        return utils.read_file_contents(path, fetch_if_remote=True)
+
+    now = time.time()
+    with SNIPPET_CACHE_LOCK:
+        entry = SNIPPET_CACHE.get(path)
+        if entry is not None and now - entry["checked"] < interval:
+            SNIPPET_CACHE_STATS["hits"] += 1
+            return __snippet_contents(path, entry)
+
+    signature = snippet_file_signature(path)
+    with SNIPPET_CACHE_LOCK:
+        SNIPPET_CACHE_STATS["stats"] += 1
+        entry = SNIPPET_CACHE.get(path)
+        if entry is not None and entry["signature"] == signature:
+            entry["checked"] = now
+            SNIPPET_CACHE_STATS["hits"] += 1
+            return __snippet_contents(path, entry)
+
+    contents = None
+    if signature is not None:
+        try:
+            contents = utils.read_file_contents(path)
+        except FileNotFoundException:
+            signature = None
+    entry = {"signature": signature, "checked": now, "contents": contents}
+    with SNIPPET_CACHE_LOCK:
+        if signature is not None:
+            SNIPPET_CACHE_STATS["reads"] += 1
+        SNIPPET_CACHE[path] = entry
+    return __snippet_contents(path, entry)
+
+
+def __snippet_contents(path, entry):
+    """
+    Get the contents of a snippet cache entry.
+
+    :param path: The path of the snippet file.
+    :param entry: The cache entry.
+    :return: The contents of the file.
+    :rtype: str
+    :raises FileNotFoundException: if the file did not exist when it was checked.
+    """
+    __record_snippet(path, entry["signature"])
+    if entry["contents"] is None:
+        raise FileNotFoundException("%s: %s" % (utils._("File not found"), path))
+    return entry["contents"]
+
+
+def __record_snippet(path, signature):
+    """
+    Remember that the current render looked at a snippet file, if recording is enabled for this thread.
+
+    :param path: The path of the snippet file.
+    :param signature: The mtime and size of the file the contents were read with, None for a missing file and False
+                      for a remote file.
+    """
+    snippets = getattr(SNIPPET_RECORDER, "snippets", None)
+    if snippets is not None:
+        snippets[path] = signature
+
+
+def snippet_file_signature(path):
+    """
+    Describe the state of a snippet file.
+
+    :param path: The path of the snippet file.
+    :return: A tuple with the mtime and size of the file or None if it does not exist.
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime, stat.st_size)
+
+
+def start_recording_snippets():
+    """
+    Start collecting the snippet files which are looked at by the renders in the current thread. This allows to cache
+    the results of a render until one of the snippets changes.
+    """
+    SNIPPET_RECORDER.snippets = {}
+
+
+def stop_recording_snippets():
+    """
+    Stop collecting snippet files in the current thread.
+
+    :return: A dict with the paths of the snippet files and the signatures they were read with. See
+             ``snippet_file_signature()``, remote files have the signature False.
+    :rtype: dict
+    """
+    snippets = getattr(SNIPPET_RECORDER, "snippets", None)
+    SNIPPET_RECORDER.snippets = None
+    return snippets or {}
+
+
+def snippet_cache_invalidate(path=None):
+    """
+    Drop snippet files from the cache, e.g. after they were written through the API.
+
+    :param path: The path of the snippet file. If None the whole cache is dropped.
+    """
+    with SNIPPET_CACHE_LOCK:
+        if path is None:
+            SNIPPET_CACHE.clear()
+        else:
+            SNIPPET_CACHE.pop(path, None)
+
+
+def snippet_cache_stats():
+    """
+    Get the counters of the snippet cache. Every hit is a disk read which was saved.
+
+    :return: A dict with the number of hits, stat calls, disk reads and cached files.
+    :rtype: dict
+    """
+    with SNIPPET_CACHE_LOCK:
+        stats = SNIPPET_CACHE_STATS.copy()
+        stats["entries"] = len(SNIPPET_CACHE)
+    return stats
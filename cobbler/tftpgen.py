@@ -21,16 +21,121 @@ Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA
 02110-1301  USA
 """
 
+import hashlib
+import multiprocessing
 import os
 import os.path
 import re
 import socket
 from time import sleep
 
+from cobbler import sync_manifest
 from cobbler import templar
 from cobbler import utils
 from cobbler.cexceptions import CX
 
+# The generated menu items per architecture together with the signature of the state they were generated from. See
+# TFTPGen.get_menu_items().
+MENU_ITEMS_CACHE = {}
+
+
+# Starting a worker process of write_all_systems_files() and loading the objects takes about as long as generating the
+# files of this many systems, fewer systems per worker are generated in the process running the sync.
+SYNC_WORKER_MIN_SYSTEMS = 200
+
+# The TFTPGen instance and the menu items the worker processes of write_all_systems_files() render the files with, or
+# the error which prevented the worker from loading the objects.
+WORKER_TFTPGEN = None
+WORKER_MENU_ITEMS = None
+WORKER_ERROR = None
+
+
+def invalidate_menu_items():
+    """
+    Forget all cached menu items, so they are generated again the next time they are needed.
+    """
+    MENU_ITEMS_CACHE.clear()
+
+
+class FileCollector(object):
+    """
+    Takes the place of the sync manifest in the worker processes of ``TFTPGen.write_all_systems_files()``: The
+    generated files are collected instead of written, so the process running the sync writes them and keeps its
+    manifest up to date.
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.files = []
+
+    def write(self, path, data):
+        """
+        Collect a generated file.
+
+        :param path: The path of the file.
+        :param data: The content of the file.
+        :type data: str
+        """
+        self.files.append(("write", path, data))
+
+    def record(self, path, entry=None):
+        """
+        Collect a file which the worker created itself, e.g. a symlink, so it gets recorded in the manifest.
+
+        :param path: The path of the file.
+        :param entry: Unused, the manifest of the sync computes it.
+        """
+        self.files.append(("record", path, None))
+
+
+def init_systems_worker(menu_items):
+    """
+    Set up a worker process of ``TFTPGen.write_all_systems_files()``. The workers are spawned instead of forked from
+    the multithreaded cobblerd, so they load the objects from disk instead of inheriting locks other threads may hold.
+
+    :param menu_items: The pxe menu items, see ``TFTPGen.get_menu_items()``.
+    """
+    global WORKER_TFTPGEN, WORKER_MENU_ITEMS, WORKER_ERROR
+    WORKER_MENU_ITEMS = menu_items
+    try:
+        # cobbler.api imports this module
+        from cobbler import api
+        cobbler_api = api.CobblerAPI()
+        WORKER_TFTPGEN = TFTPGen(cobbler_api._collection_mgr, cobbler_api.logger)
+    except Exception as e:
+        # raising here would make the pool start new workers forever, report the error for every system instead
+        WORKER_ERROR = "could not load the objects: %s" % e
+
+
+def render_systems_chunk(names):
+    """
+    Render the files of a chunk of systems in a worker process of ``TFTPGen.write_all_systems_files()``.
+
+    :param names: The names of the systems.
+    :return: A list of tuples with the system name, the collected files (see ``FileCollector``) and the error message
+             or None.
+    """
+    results = []
+    for name in names:
+        collector = FileCollector()
+        sync_manifest.activate(collector)
+        error = None
+        try:
+            if WORKER_ERROR is not None:
+                raise CX(WORKER_ERROR)
+            system = WORKER_TFTPGEN.systems.find(name=name)
+            if system is None:
+                raise CX("system %s is not stored on disk" % name)
+            WORKER_TFTPGEN.write_all_system_files(system, WORKER_MENU_ITEMS)
+        except Exception as e:
+            error = str(e)
+        finally:
+            sync_manifest.deactivate()
+        results.append((name, collector.files, error))
+    return results
+
 
 class TFTPGen(object):
     """
@@ -104,11 +209,14 @@ class TFTPGen(object):
         if not utils.file_is_remote(full_path):
             b_file = os.path.basename(full_path)
             dst = os.path.join(distro_dir, b_file)
-            utils.linkfile(full_path, dst, symlink_ok=symlink_ok, api=self.api, logger=self.logger)
+            self.link_boot_file(full_path, dst, symlink_ok=symlink_ok)
         else:
             b_file = os.path.basename(full_path)
             dst = os.path.join(distro_dir, b_file)
             utils.copyremotefile(full_path, dst, api=None, logger=self.logger)
+            manifest = sync_manifest.get_active()
+            if manifest is not None:
+                manifest.record(dst)
 
     def copy_single_distro_files(self, d, dirtree, symlink_ok):
         """
@@ -140,7 +248,34 @@ class TFTPGen(object):
         if not os.path.exists(images_dir):
             os.makedirs(images_dir)
         newfile = os.path.join(images_dir, img.name)
-        utils.linkfile(filename, newfile, api=self.api, logger=self.logger)
+        self.link_boot_file(filename, newfile)
+
+    def link_boot_file(self, src, dst, symlink_ok=False):
+        """
+        Link or copy a kernel, initrd or image into place. If a sync manifest is active and it recorded the file as
+        linked from the unchanged source, the file is kept as it is.
+
+        :param src: The local source file.
+        :param dst: The destination of the link or copy.
+        :param symlink_ok: If it is okay to use a symlink to link the destination to the source.
+        :type symlink_ok: bool
+        """
+        manifest = sync_manifest.get_active()
+        if manifest is None:
+            utils.linkfile(src, dst, symlink_ok=symlink_ok, api=self.api, logger=self.logger)
+            return
+        owner = "file/%s" % dst
+        stat = os.stat(src)
+        sources = [[src, stat.st_size, stat.st_mtime]]
+        if manifest.is_unchanged(owner, sources):
+            return
+        manifest.begin(owner, sources)
+        try:
+            utils.linkfile(src, dst, symlink_ok=symlink_ok, api=self.api, logger=self.logger)
+            stat = os.stat(dst)
+            manifest.record(dst, {"size": stat.st_size, "mtime": stat.st_mtime})
+        finally:
+            manifest.end()
 
     def write_all_system_files(self, system, menu_items):
         """
@@ -282,6 +417,9 @@ class TFTPGen(object):
                         if os.path.exists(link_path):
                             utils.rmfile(link_path)
                         os.symlink(os.path.join("..", "system", grub_name), link_path)
+                        manifest = sync_manifest.get_active()
+                        if manifest is not None:
+                            manifest.record(link_path)
                 else:
                     self.write_pxe_file(pxe_path, system, None, None, working_arch, image=profile, metadata=pxe_metadata)
             else:
@@ -290,6 +428,122 @@ class TFTPGen(object):
                 if grub_path:
                     utils.rmfile(grub_path)
 
+    def write_systems_chunk(self, chunk, menu_items):
+        """
+        Generate the files for a chunk of systems in the process running the sync.
+
+        :param chunk: A list of tuples with the system name, the manifest owner key and the sources of the system.
+        :param menu_items: The pxe menu items, see ``get_menu_items()``.
+        :return: A list of (system name, error message) tuples.
+        """
+        manifest = sync_manifest.get_active()
+        errors = []
+        for (name, owner, sources) in chunk:
+            system = self.systems.find(name=name)
+            if system is None:
+                continue
+            if manifest is not None:
+                manifest.begin(owner, sources)
+            try:
+                self.write_all_system_files(system, menu_items)
+            except Exception as e:
+                errors.append((name, str(e)))
+            finally:
+                if manifest is not None:
+                    manifest.end()
+        return errors
+
+    def store_systems_chunk(self, chunk, rendered):
+        """
+        Write the files a worker process rendered for a chunk of systems and record them in the manifest of the sync.
+
+        :param chunk: A list of tuples with the system name, the manifest owner key and the sources of the system.
+        :param rendered: The result of ``render_systems_chunk()`` for the chunk.
+        :return: A list of (system name, error message) tuples.
+        """
+        manifest = sync_manifest.get_active()
+        errors = []
+        for ((name, owner, sources), (_, files, error)) in zip(chunk, rendered):
+            if manifest is not None:
+                manifest.begin(owner, sources)
+            try:
+                for (operation, path, data) in files:
+                    if operation == "write":
+                        sync_manifest.write_file(path, data)
+                    elif manifest is not None:
+                        manifest.record(path)
+            except Exception as e:
+                error = error or str(e)
+            finally:
+                if manifest is not None:
+                    manifest.end()
+            if error is not None:
+                errors.append((name, error))
+        return errors
+
+    def write_all_systems_files(self, systems, menu_items):
+        """
+        Writes the files of many systems. The systems are split into chunks which are rendered by a pool of
+        ``sync_workers`` processes, the files are written and recorded in the manifest by the calling process. The
+        workers are spawned and load the objects from disk, so all changes have to be saved before. Every system only
+        has its own files, so the result doesn't depend on the order the chunks are processed in. Errors are collected
+        and reported after all systems were processed.
+
+        If a sync manifest is active, systems whose files are up to date are skipped.
+
+        :param systems: The systems to generate the files for.
+        :param menu_items: The pxe menu items, see ``get_menu_items()``.
+        :raises CX: If the files of one or more systems could not be generated.
+        """
+        manifest = sync_manifest.get_active()
+        common_sources = []
+        if manifest is not None:
+            # The system files also depend on the settings, the templates and the menu
+            common_sources = sync_manifest.file_sources([
+                "/etc/cobbler/settings",
+                os.path.join(self.settings.boot_loader_conf_template_dir, "*")
+            ])
+            common_sources.append(["menu", hashlib.sha1(menu_items.encode("utf-8")).hexdigest()])
+
+        pending = []
+        for system in systems:
+            owner = "system/%s" % system.name
+            sources = []
+            if manifest is not None:
+                sources = sync_manifest.object_sources(self.api, system) + common_sources
+                if manifest.is_unchanged(owner, sources):
+                    continue
+            pending.append((system.name, owner, sources))
+        if not pending:
+            return
+
+        workers = self.settings.sync_workers
+        if workers <= 0:
+            workers = multiprocessing.cpu_count()
+        workers = max(1, min(workers, len(pending) // SYNC_WORKER_MIN_SYSTEMS))
+
+        errors = []
+        if workers == 1:
+            errors = self.write_systems_chunk(pending, menu_items)
+        else:
+            # several chunks per worker, so one slow chunk doesn't keep the other workers idle
+            chunk_size = max(1, len(pending) // (workers * 4))
+            chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+            self.logger.info("generating files for %d systems with %d workers" % (len(pending), workers))
+            pool = multiprocessing.get_context("spawn").Pool(workers, init_systems_worker, (menu_items,))
+            try:
+                rendered = pool.imap(render_systems_chunk, [[name for (name, _, _) in chunk] for chunk in chunks])
+                for chunk in chunks:
+                    errors.extend(self.store_systems_chunk(chunk, next(rendered)))
+            finally:
+                pool.close()
+                pool.join()
+
+        if errors:
+            for (name, error) in errors:
+                self.logger.error("failed to generate files for system %s: %s" % (name, error))
+            raise CX("failed to generate files for %d system(s): %s" % (len(errors), ", ".join([e[0] for e in errors])))
+
     def make_pxe_menu(self):
         """
         Generates both pxe and grub boot menus.
@@ -309,7 +563,7 @@ class TFTPGen(object):
         outfile = os.path.join(self.bootloc, "pxelinux.cfg", "default")
         template_src = open(os.path.join(self.settings.boot_loader_conf_template_dir, "pxedefault.template"))
         template_data = template_src.read()
-        self.templar.render(template_data, metadata, outfile, None)
+        sync_manifest.write_file(outfile, self.templar.render(template_data, metadata, None))
         template_src.close()
 
         # Write the grub menu:
@@ -317,9 +571,7 @@ class TFTPGen(object):
             arch_menu_items = self.get_menu_items(arch)
             if(arch_menu_items['grub']):
                 outfile = os.path.join(self.bootloc, "grub", "{0}_menu_items.cfg".format(arch))
-                fd = open(outfile, "w+")
-                fd.write(arch_menu_items['grub'])
-                fd.close()
+                sync_manifest.write_file(outfile, arch_menu_items['grub'])
 
     def get_menu_items(self, arch=None):
         """
@@ -330,6 +582,34 @@ class TFTPGen(object):
         :returns: A dictionary with the pxe and grub menu items. It has the keys "pxe" and "grub".
         :rtype: dict
         """
+        # The menu only depends on the distros, profiles and images, the settings and the templates. Saving a system
+        # doesn't change any of them, so the menu items are reused until one of them changes.
+        signature = self.__menu_items_signature()
+        cached = MENU_ITEMS_CACHE.get(arch)
+        if cached is not None and cached[0] == signature:
+            return dict(cached[1])
+        menu_items = self.__generate_menu_items(arch)
+        MENU_ITEMS_CACHE[arch] = (signature, menu_items)
+        return dict(menu_items)
+
+    def __menu_items_signature(self):
+        """
+        Describe the state the menu items are generated from.
+
+        :return: The signature as a tuple.
+        """
+        return (id(self.collection_mgr), self.distros.version, self.profiles.version, self.images.version,
+                utils.blender_cache_generation(self.settings),
+                sync_manifest.file_sources([os.path.join(self.settings.boot_loader_conf_template_dir, "*")]))
+
+    def __generate_menu_items(self, arch=None):
+        """
+        Generates menu items for pxe and grub without looking at the cache. See ``get_menu_items()``.
+
+        :param arch: The processor architecture to generate the menu items for. (Optional)
+        :type arch: str
+        :rtype: dict
+        """
         # sort the profiles
         profile_list = [profile for profile in self.profiles]
         profile_list = sorted(profile_list, key=lambda profile: profile.name)
@@ -386,8 +666,51 @@ class TFTPGen(object):
 
         return {'pxe': pxe_menu_items, 'grub': grub_menu_items}
 
+    def generate_system_config(self, system, interface, format="pxe"):
+        """
+        Generate the boot loader configuration ``write_all_system_files()`` writes for one interface of a system, without
+        writing it. This allows a TFTP server to serve ``pxelinux.cfg/01-<mac>`` and ``grub/system/<mac>`` on request
+        instead of having them written by every sync.
+
+        :param system: The system to generate the configuration for.
+        :param interface: The name of the interface.
+        :param format: May be "grub" or "pxe".
+        :type format: str
+        :return: The configuration or None if the interface doesn't boot from such a file, e.g. on s390x or with yaboot.
+        :rtype: str
+        """
+        profile = system.get_conceptual_parent()
+        if profile is None or not system.is_management_supported():
+            return None
+        distro = profile.get_conceptual_parent()
+        image = None
+        if distro is None:
+            if profile.COLLECTION_TYPE == "profile":
+                return None
+            image = profile
+            arch = image.arch
+        else:
+            arch = distro.arch
+        if arch not in ["i386", "x86", "x86_64", "arm", "aarch64", "ppc64le", "ppc64el", "standard"]:
+            return None
+
+        filename = system.get_config_filename(interface=interface, loader=format)
+        if filename is None:
+            return None
+        if image is not None:
+            if format == "grub":
+                return None
+            metadata = {'pxe_menu_items': self.get_menu_items()['pxe']}
+            return self.write_pxe_file(filename, system, None, None, arch, image=image, metadata=metadata,
+                                       write_file=False)
+        metadata = None
+        if format == "pxe":
+            metadata = {'pxe_menu_items': self.get_menu_items()['pxe']}
+        return self.write_pxe_file(filename, system, profile, distro, arch, metadata=metadata, format=format,
+                                   write_file=False)
+
     def write_pxe_file(self, filename, system, profile, distro, arch,
-                       image=None, include_header=True, metadata=None, format="pxe"):
+                       image=None, include_header=True, metadata=None, format="pxe", write_file=True):
         """
         Write a configuration file for the boot loader(s).
 
@@ -409,6 +732,9 @@ class TFTPGen(object):
         :param metadata: Pass additional parameters to the ones being collected during the method.
         :param format: May be "grub" or "pxe".
         :type format: str
+        :param write_file: If False the configuration is only generated. The filename is still used to name the file
+                           in the configuration where needed.
+        :type write_file: bool
         :return: The generated filecontent for the required item.
         :rtype: str
         """
@@ -611,19 +937,17 @@ class TFTPGen(object):
         # save file and/or return results, depending on how called.
         buffer += self.templar.render(template_data, metadata, None)
 
-        if filename is not None:
+        if filename is not None and write_file:
             self.logger.info("generating: %s" % filename)
             # This try-except is a work-around for the cases where 'open' throws
             # the FileNotFoundError for not apparent reason.
             try:
-                with open(filename, "w") as fd:
-                    fd.write(buffer)
+                sync_manifest.write_file(filename, buffer)
             except FileNotFoundError as e:
                 self.logger.error("Got \"{}\" while trying to write {}".format(e, filename))
                 self.logger.error("Trying to write {} again after some delay.".format(filename))
                 sleep(1)
-                with open(filename, "w") as fd:
-                    fd.write(buffer)
+                sync_manifest.write_file(filename, buffer)
         return buffer
 
     def build_kernel_options(self, system, profile, distro, image, arch, autoinstall_path):
@@ -926,7 +1250,7 @@ class TFTPGen(object):
                 raise CX("template source %s does not exist" % template)
             elif write_file and not os.path.isdir(dest_dir):
                 raise CX("template destination (%s) is invalid" % dest_dir)
-            elif write_file and os.path.exists(dest):
+            elif write_file and os.path.exists(dest) and not self.__is_previous_sync_output(dest):
                 raise CX("template destination (%s) already exists" % dest)
             elif write_file and os.path.isdir(dest):
                 raise CX("template destination (%s) is a directory" % dest)
@@ -942,12 +1266,24 @@ class TFTPGen(object):
 
             if write_file:
                 self.logger.info("generating: %s" % dest)
-                fd = open(dest, "w")
-                fd.write(buffer)
-                fd.close()
+                sync_manifest.write_file(dest, buffer)
 
         return results
 
+    def __is_previous_sync_output(self, path):
+        """
+        An incremental sync doesn't clean the trees, so files from the last sync are still present. Those may be
+        overwritten, files generated twice during the same sync may not.
+
+        :param path: The path of the file.
+        :return: True if the file was generated by the last sync and not yet by the running one.
+        :rtype: bool
+        """
+        manifest = sync_manifest.get_active()
+        if manifest is None:
+            return False
+        return manifest.is_previous_output(path)
+
     def generate_gpxe(self, what, name):
         """
         Generate the gpxe files.
@@ -25,6 +25,7 @@ from builtins import map, str, object
 import copy
 import errno
 import glob
+import hashlib
 import netaddr
 import os
 import random
@@ -32,8 +33,10 @@ import re
 import shlex
 import shutil
 import simplejson
+import sqlite3
 import subprocess
 import sys
+import threading
 import traceback
 import urllib.request
 import urllib.error
@@ -64,6 +67,12 @@ CHEETAH_ERROR_DISCLAIMER = """
 #
 """
 
+# Blended data per object, see blender(). The generations are bumped whenever an object is (re-)added to a collection
+# or the settings are changed, so in memory modifications which don't touch the mtime still invalidate the cache.
+BLENDER_CACHE = {}
+BLENDER_CACHE_GENERATIONS = {}
+BLENDER_CACHE_STATS = {"hits": 0, "misses": 0}
+
 
 # placeholder for translation
 def _(foo):
@@ -73,6 +82,14 @@ def _(foo):
 MODULE_CACHE = {}
 SIGNATURE_CACHE = {}
 
+# The sha1 sums of the files linked into a link cache, see hashfile(). Every cache directory has its own database, the
+# connections are kept open. While a batch is open, e.g. during a sync, new sums are committed once at its end.
+HASH_DB_FILE = "link_cache.db"
+HASH_DBS = {}
+HASH_DB_LOCK = threading.RLock()
+HASH_CHUNK_SIZE = 1024 * 1024
+hash_batch_depth = 0
+
 _re_kernel = re.compile(r'(vmlinu[xz]|kernel.img)')
 _re_initrd = re.compile(r'(initrd(.*).img|ramdisk.image.gz)')
 _re_is_mac = re.compile(':'.join(('[0-9A-Fa-f][0-9A-Fa-f]',) * 6) + '$')
@@ -635,6 +652,19 @@ def blender(api_handle, remove_dicts, root_obj):
     """
 
     tree = grab_tree(api_handle, root_obj)
+    cache_enabled = api_handle.settings().cache_enabled
+    if cache_enabled:
+        cache_key = (root_obj.COLLECTION_TYPE, root_obj.name, remove_dicts)
+        signature = [__blender_cache_signature(node) for node in tree]
+        cached = BLENDER_CACHE.get(cache_key)
+        if cached is not None:
+            # the repo data is part of the result too, so the repos have to be unchanged as well
+            (cached_signature, repo_names, cached_results) = cached
+            if cached_signature == signature + __blender_cache_repo_signature(api_handle, repo_names):
+                BLENDER_CACHE_STATS["hits"] += 1
+                return copy.deepcopy(cached_results)
+        BLENDER_CACHE_STATS["misses"] += 1
+
     tree.reverse()  # start with top of tree, override going down
     results = {}
     for node in tree:
@@ -649,9 +679,11 @@ def blender(api_handle, remove_dicts, root_obj):
                 results["%s_%s" % (key, name)] = interface[key]
 
     # If the root object is a profile or system, add in all repo data for repos that belong to the object chain
+    repo_names = []
     if root_obj.COLLECTION_TYPE in ("profile", "system"):
         repo_data = []
-        for r in results.get("repos", []):
+        repo_names = list(results.get("repos", []))
+        for r in repo_names:
             repo = api_handle.find_repo(name=r)
             if repo:
                 repo_data.append(repo.to_dict())
@@ -695,9 +727,93 @@ def blender(api_handle, remove_dicts, root_obj):
         results["distro_name"] = "N/A"
         results["image_name"] = results["name"]
 
+    if cache_enabled:
+        signature += __blender_cache_repo_signature(api_handle, repo_names)
+        BLENDER_CACHE[cache_key] = (signature, repo_names, copy.deepcopy(results))
     return results
 
 
+def __blender_cache_key(node):
+    """
+    Get the key which identifies an object of the inheritance tree in the blender cache.
+
+    :param node: An item or the settings.
+    :return: The key as a tuple.
+    """
+    collection_type = getattr(node, "COLLECTION_TYPE", None)
+    if collection_type is None:
+        return ("setting",)
+    return (collection_type, node.name)
+
+
+def __blender_cache_signature(node):
+    """
+    Describe the state of an object of the inheritance tree. A cached blender result is only valid as long as the
+    signatures of all nodes it was built from are unchanged.
+
+    :param node: An item or the settings.
+    :return: The signature as a tuple.
+    """
+    key = __blender_cache_key(node)
+    generation = BLENDER_CACHE_GENERATIONS.get(key, 0)
+    if key[0] == "setting":
+        return (key, id(node), generation)
+    return (key, id(node), node.mtime, generation)
+
+
+def __blender_cache_repo_signature(api_handle, repo_names):
+    """
+    Describe the state of the repos which are referenced by a blender result.
+
+    :param api_handle: The api to look up the repos with.
+    :param repo_names: The names of the repos.
+    :return: The signatures of the repos. Repos which don't exist are represented by None.
+    :rtype: list
+    """
+    signature = []
+    for r in repo_names:
+        repo = api_handle.find_repo(name=r)
+        signature.append(__blender_cache_signature(repo) if repo else None)
+    return signature
+
+
+def blender_cache_invalidate(node):
+    """
+    Mark an object as changed. Cached blender results of the object itself and of all objects which inherit from it
+    won't be used anymore.
+
+    :param node: An item or the settings.
+    """
+    key = __blender_cache_key(node)
+    BLENDER_CACHE_GENERATIONS[key] = BLENDER_CACHE_GENERATIONS.get(key, 0) + 1
+    if key[0] != "setting":
+        for remove_dicts in (True, False):
+            BLENDER_CACHE.pop(key + (remove_dicts,), None)
+
+
+def blender_cache_generation(node):
+    """
+    Get the number of times an object was marked as changed. Other caches can use it to notice changes of objects which
+    were not saved yet.
+
+    :param node: An item or the settings.
+    :rtype: int
+    """
+    return BLENDER_CACHE_GENERATIONS.get(__blender_cache_key(node), 0)
+
+
+def blender_cache_stats():
+    """
+    Get the counters of the blender cache.
+
+    :return: A dict with the number of hits, misses and cached entries.
+    :rtype: dict
+    """
+    stats = BLENDER_CACHE_STATS.copy()
+    stats["entries"] = len(BLENDER_CACHE)
+    return stats
+
+
 def flatten(data):
     """
     Convert certain nested dicts to strings. This is only really done for the ones koan needs as strings this should
@@ -1091,41 +1207,104 @@ def is_safe_to_hardlink(src, dst, api):
     return False
 
 
+def hash_db(lcache, logger=None):
+    """
+    Get the database with the sha1 sums of the files linked into a link cache. It is created if it doesn't exist.
+
+    :param lcache: The link cache directory.
+    :param logger: The logger to audit the action with.
+    :return: The sqlite connection or None if the database can't be used. The caller must hold ``HASH_DB_LOCK``.
+    """
+    dbfile = os.path.join(lcache, HASH_DB_FILE)
+    conn = HASH_DBS.get(dbfile)
+    if conn is not None and not os.path.exists(dbfile):
+        # the cache directory was cleaned out
+        conn.close()
+        conn = None
+    if conn is None:
+        try:
+            conn = sqlite3.connect(dbfile, check_same_thread=False)
+            conn.execute("CREATE TABLE IF NOT EXISTS hashes (path TEXT PRIMARY KEY, inode INTEGER, size INTEGER, "
+                         "mtime INTEGER, sha1 TEXT)")
+            conn.commit()
+        except sqlite3.Error as e:
+            if logger is not None:
+                logger.warning("cannot use link cache database %s: %s" % (dbfile, e))
+            HASH_DBS.pop(dbfile, None)
+            return None
+        HASH_DBS[dbfile] = conn
+    return conn
+
+
+def begin_hash_batch():
+    """
+    Defer committing new sha1 sums to the link cache databases until the matching end_hash_batch().
+    """
+    global hash_batch_depth
+    with HASH_DB_LOCK:
+        hash_batch_depth += 1
+
+
+def end_hash_batch(logger=None):
+    """
+    Close a batch opened by begin_hash_batch(). When the outermost batch is closed, the new sha1 sums are committed.
+
+    :param logger: The logger to audit the action with.
+    """
+    global hash_batch_depth
+    with HASH_DB_LOCK:
+        hash_batch_depth -= 1
+        if hash_batch_depth > 0:
+            return
+        for (dbfile, conn) in list(HASH_DBS.items()):
+            try:
+                conn.commit()
+            except sqlite3.Error as e:
+                if logger is not None:
+                    logger.warning("cannot write link cache database %s: %s" % (dbfile, e))
+
+
 def hashfile(fn, lcache=None, logger=None):
     r"""
     Returns the sha1sum of the file
 
     :param fn: The file to get the sha1sum of.
-    :param lcache: This is a directory where Cobbler would store its ``link_cache.json`` file to speed up the return
-                   of the hash. The hash looked up would be checked against the Cobbler internal mtime of the object.
+    :param lcache: This is a directory where Cobbler stores its ``link_cache.db`` database to speed up the return of the
+                   hash. A stored hash is used as long as the inode, size and mtime of the file are unchanged.
     :param logger: The logger to audit the action with.
     :return: The sha1 sum or None if the file doesn't exist.
     """
-    db = {}
-    # FIXME: The directory from the following line may not exist.
-    dbfile = os.path.join(lcache, 'link_cache.json')
     try:
-        if os.path.exists(dbfile):
-            db = simplejson.load(open(dbfile, 'r'))
-    except:
-        pass
-
-    mtime = os.stat(fn).st_mtime
-    if fn in db:
-        if db[fn][0] >= mtime:
-            return db[fn][1]
-
-    if os.path.exists(fn):
-        # TODO: Replace this with the follwing: https://stackoverflow.com/a/22058673
-        cmd = '/usr/bin/sha1sum %s' % fn
-        key = subprocess_get(logger, cmd).split(' ')[0]
-        if lcache is not None:
-            db[fn] = (mtime, key)
-            # TODO: Safeguard this against above mentioned directory does not exist error.
-            simplejson.dump(db, open(dbfile, 'w'))
-        return key
-    else:
+        st = os.stat(fn)
+    except OSError:
         return None
+    key = (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    db = None
+    if lcache is not None:
+        with HASH_DB_LOCK:
+            db = hash_db(lcache, logger)
+            if db is not None:
+                row = db.execute("SELECT inode, size, mtime, sha1 FROM hashes WHERE path = ?", (fn,)).fetchone()
+                if row is not None and tuple(row[:3]) == key:
+                    return row[3]
+
+    digest = hashlib.sha1()
+    with open(fn, "rb") as fh:
+        for chunk in iter(lambda: fh.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    sha1 = digest.hexdigest()
+
+    if db is not None:
+        with HASH_DB_LOCK:
+            try:
+                db.execute("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?)", (fn,) + key + (sha1,))
+                if hash_batch_depth == 0:
+                    db.commit()
+            except sqlite3.Error as e:
+                if logger is not None:
+                    logger.warning("cannot write link cache database in %s: %s" % (lcache, e))
+    return sha1
 
 
 def cachefile(src, dst, api=None, logger=None):
@@ -1961,7 +2140,7 @@ def is_remote_file(file):
         return False
 
 
-def subprocess_sp(logger, cmd, shell=True, input=None):
+def subprocess_sp(logger, cmd, shell=True, input=None, env=None):
     """
     Call a shell process and redirect the output for internal usage.
 
@@ -1970,6 +2149,8 @@ def subprocess_sp(logger, cmd, shell=True, input=None):
     :param shell: Whether to use a shell or not for the execution of the command.
     :type shell: bool
     :param input: If there is any input needed for that command to stdin.
+    :param env: The environment of the process. If None, the process inherits the one of Cobbler.
+    :type env: dict
     :return: A tuple of the output and the return code.
     """
     if logger is not None:
@@ -1981,7 +2162,7 @@ def subprocess_sp(logger, cmd, shell=True, input=None):
 
     try:
         sp = subprocess.Popen(cmd, shell=shell, stdin=stdin, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                              encoding="utf-8", close_fds=True)
+                              encoding="utf-8", close_fds=True, env=env)
     except OSError:
         if logger is not None:
             log_exc(logger)
@@ -1995,7 +2176,7 @@ def subprocess_sp(logger, cmd, shell=True, input=None):
     return out, rc
 
 
-def subprocess_call(logger, cmd, shell=True, input=None):
+def subprocess_call(logger, cmd, shell=True, input=None, env=None):
     """
     A simple subprocess call with no output capturing.
 
@@ -2004,9 +2185,11 @@ def subprocess_call(logger, cmd, shell=True, input=None):
     :param shell: Whether to use a shell or not for the execution of the commmand.
     :type shell: bool
     :param input: If there is any input needed for that command to stdin.
+    :param env: The environment of the process. If None, the process inherits the one of Cobbler.
+    :type env: dict
     :return: The return code of the process
     """
-    _, rc = subprocess_sp(logger, cmd, shell=shell, input=input)
+    _, rc = subprocess_sp(logger, cmd, shell=shell, input=input, env=env)
     return rc
 
 
@@ -41,8 +41,7 @@ def application(environ, start_response):
         site.addsitedir(distutils.sysconfig.get_python_lib(prefix=environ['VIRTUALENV']))
         # Now all modules are available even under a virtualenv
 
-    import yaml
-    from cobbler.services import CobblerSvc
+    from cobbler.services import CobblerSvc, read_settings
 
     my_uri = urllib.parse.unquote(environ['REQUEST_URI'])
 
@@ -81,18 +80,19 @@ def application(environ, start_response):
     # it's always present in this context.
     form["REMOTE_ADDR"] = environ.get("REMOTE_ADDR", None)
 
-    # Read config for the XMLRPC port to connect to:
-    with open("/etc/cobbler/settings") as fd:
-        data = fd.read()
-    ydata = yaml.safe_load(data)
+    # Read config for the XMLRPC port to connect to. The parsed settings are cached by the process.
+    ydata = read_settings()
     remote_port = ydata.get("xmlrpc_port", 25151)
 
-    # instantiate a CobblerWeb object
+    # instantiate a CobblerWeb object, its connection to the XMLRPC server comes from a pool shared by all requests
     cw = CobblerSvc(server="http://127.0.0.1:%s" % remote_port)
 
     # check for a valid path/mode
     # handle invalid paths gracefully
     mode = form.get('op', 'index')
+    if mode.startswith("_"):
+        # helpers like _close() are not operations
+        mode = "index"
 
     # TODO: We could do proper exception handling here and return
     # corresponding HTTP status codes:
@@ -116,6 +116,8 @@ def application(environ, start_response):
     except xmlrpc.server.Fault as err:
         status = "500 SERVER ERROR"
         content = err.faultString
+    finally:
+        cw._close()
 
     # req.content_type = "text/plain;charset=utf-8"
     response_headers = [('Content-type', 'text/plain;charset=utf-8'),
@@ -0,0 +1,157 @@
+import pytest
+
+from cobbler import settings
+from cobbler.actions import replicate
+from cobbler.cexceptions import CX
+
+
+class FakeItem:
+    def __init__(self, name, uid, depth=0):
+        self.name = name
+        self.uid = uid
+        self.depth = depth
+
+
+class FakeAPI:
+    def __init__(self, broken=None):
+        self.broken = broken or []
+        self.batches = []
+        self.added = []
+        self.removed = []
+
+    def add_items(self, items, with_sync=True, logger=None):
+        if any(ref.name in self.broken for (what, ref) in items):
+            raise CX("broken batch")
+        self.batches.append([(what, ref.name) for (what, ref) in items])
+
+    def add_item(self, what, ref, logger=None):
+        if ref.name in self.broken:
+            raise CX("broken item")
+        self.added.append((what, ref.name))
+
+    def remove_item(self, what, name, recursive=False, logger=None):
+        if name in self.broken:
+            raise CX("broken item")
+        self.removed.append((what, name))
+
+
+class FakeCollectionManager:
+    def __init__(self, api):
+        self.api = api
+
+    def settings(self):
+        return settings.Settings()
+
+
+class FakeRemote:
+    def __init__(self, changes, sequence, epoch="epoch1", items=None):
+        self.changes = changes
+        self.sequence = sequence
+        self.epoch = epoch
+        self.items = items or {}
+
+    def get_changes(self, sequence, what="", expand=False, epoch=""):
+        changes = [change for change in self.changes if change["sequence"] > sequence]
+        complete = sequence <= self.sequence and epoch in ("", self.epoch)
+        return {"changes": changes, "sequence": self.sequence, "complete": complete, "epoch": self.epoch}
+
+    def get_item(self, what, name):
+        return self.items.get((what, name), "~")
+
+
+@pytest.fixture()
+def make_replicate(tmp_path, monkeypatch):
+    monkeypatch.setattr(replicate, "REPLICATE_STATE_FILE", str(tmp_path / "replicate_state.json"))
+
+    def _make_replicate(api=None, remote=None):
+        action = replicate.Replicate(FakeCollectionManager(api or FakeAPI()))
+        action.uri = "http://master/cobbler_api"
+        action.options = []
+        action.remote = remote
+        return action
+    return _make_replicate
+
+
+def change(sequence, kind, what, name, uid):
+    return {"sequence": sequence, "change": kind, "type": what, "name": name, "uid": uid,
+            "item": {"name": name, "uid": uid}}
+
+
+def test_query_changes_keeps_latest_change_and_retries_failed(make_replicate):
+    # Arrange
+    changes = [change(4, "add", "system", "a", "u1"), change(5, "modify", "profile", "p", "u2"),
+               change(6, "rename", "system", "b", "u1"), change(7, "modify", "repo", "r", "u5")]
+    items = {("distro", "d"): {"name": "d", "uid": "u3"}}
+    action = make_replicate(remote=FakeRemote(changes, 7, items=items))
+    action.sequence = 3
+    action.epoch = "epoch1"
+    action.failed = {("distro", "u3"): "d", ("image", "u4"): "i", ("repo", "u5"): "r"}
+    action.save_state()
+
+    # Act
+    result = action.query_changes()
+
+    # Assert
+    latest = dict(((c["type"], c["uid"]), (c["change"], c["name"])) for c in result)
+    assert latest == {
+        ("system", "u1"): ("rename", "b"),
+        ("profile", "u2"): ("modify", "p"),
+        ("repo", "u5"): ("modify", "r"),
+        ("distro", "u3"): ("modify", "d"),
+        ("image", "u4"): ("delete", "i"),
+    }
+    assert action.sequence == 7
+
+
+def test_query_changes_replicates_everything_after_epoch_change(make_replicate):
+    # Arrange
+    action = make_replicate(remote=FakeRemote([change(1, "add", "system", "a", "u1")], 1, epoch="epoch2"))
+    action.sequence = 1
+    action.epoch = "epoch1"
+    action.save_state()
+
+    # Act
+    result = action.query_changes()
+
+    # Assert
+    assert result is None
+    assert (action.sequence, action.epoch) == (1, "epoch2")
+
+
+def test_commit_pending_order_and_failures(make_replicate):
+    # Arrange
+    api = FakeAPI(broken=["broken"])
+    action = make_replicate(api=api)
+    action.pending = [("system", FakeItem("s", "u1")), ("profile", FakeItem("sub", "u2", depth=2)),
+                      ("profile", FakeItem("p", "u3", depth=1)), ("distro", FakeItem("d", "u4")),
+                      ("system", FakeItem("broken", "u5"))]
+
+    # Act
+    action.commit_pending()
+
+    # Assert
+    assert api.batches == [[("distro", "d")], [("profile", "p")], [("profile", "sub")]]
+    assert api.added == [("system", "s")]
+    assert action.failed == {("system", "u5"): "broken"}
+    assert action.pending == []
+
+
+def test_remove_objects_deleted_on_master(make_replicate):
+    # Arrange
+    api = FakeAPI(broken=["broken"])
+    action = make_replicate(api=api)
+    action.system_patterns = []
+    action.local_data = dict((what, []) for what in replicate.OBJ_TYPES)
+    action.local_data["profile"] = [{"uid": "u1", "name": "p"}, {"uid": "u2", "name": "broken"},
+                                    {"uid": "u3", "name": "kept"}]
+    action.local_data["system"] = [{"uid": "u4", "name": "s"}]
+    changes = [change(1, "delete", "profile", "p", "u1"), change(2, "delete", "profile", "broken", "u2"),
+               change(3, "modify", "profile", "kept", "u3"), change(4, "delete", "system", "s", "u4"),
+               change(5, "delete", "profile", "unknown", "u9")]
+
+    # Act
+    action.remove_objects_deleted_on_master(changes)
+
+    # Assert
+    assert api.removed == [("profile", "p")]
+    assert action.failed == {("profile", "u2"): "broken"}
@@ -0,0 +1,259 @@
+from functools import partial
+import http.server
+import os
+import threading
+import time
+
+import pytest
+
+from cobbler import settings
+from cobbler.actions import reposync
+from cobbler.cexceptions import CX
+
+
+class FakeRepo:
+    def __init__(self, name, mirror, environment=None, breed="yum"):
+        self.name = name
+        self.mirror = mirror
+        self.environment = environment or {}
+        self.keep_updated = True
+        self.breed = breed
+        self.mirror_type = "baseurl"
+        self.mirror_locally = True
+        self.arch = "x86_64"
+        self.rpm_list = []
+        self.yumopts = {}
+        self.apt_dists = ["stable"]
+        self.apt_components = ["main"]
+        self.proxy = "<<None>>"
+        self.priority = 99
+
+
+class FakeLibrepo:
+    LibrepoException = Exception
+
+    class Handle:
+        def setopt(self, option, value):
+            pass
+
+        def perform(self, result):
+            pass
+
+    class Result:
+        pass
+
+    def __getattr__(self, name):
+        return name
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class FakeCollectionManager:
+    def __init__(self, test_settings, repos):
+        self.api = None
+        self.test_settings = test_settings
+        self.test_repos = repos
+
+    def distros(self):
+        return []
+
+    def profiles(self):
+        return []
+
+    def systems(self):
+        return []
+
+    def settings(self):
+        return self.test_settings
+
+    def repos(self):
+        return self.test_repos
+
+
+@pytest.fixture()
+def make_reposync(tmp_path):
+    def _make_reposync(repos, workers=1, host_connections=0, nofail=False):
+        test_settings = settings.Settings()
+        test_settings.webdir = str(tmp_path)
+        test_settings.reposync_workers = workers
+        test_settings.reposync_host_connections = host_connections
+        action = reposync.RepoSync(FakeCollectionManager(test_settings, repos), tries=1, nofail=nofail)
+        action.update_permissions = lambda repo_path: None
+        return action
+    return _make_reposync
+
+
+@pytest.fixture()
+def upstream(tmp_path):
+    root = tmp_path / "upstream"
+    (root / "repodata").mkdir(parents=True)
+    (root / "repodata" / "repomd.xml").write_text("<repomd>1</repomd>")
+    (root / "dists" / "stable").mkdir(parents=True)
+    (root / "dists" / "stable" / "Release").write_text("Date: 1")
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory=str(root)))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield (root, "http://127.0.0.1:%d/" % server.server_address[1], server)
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture()
+def mirror_sync(make_reposync, monkeypatch):
+    monkeypatch.setattr(reposync, "librepo", FakeLibrepo(), raising=False)
+    monkeypatch.setattr(reposync.utils, "blender", lambda api, remove_dicts, obj: {})
+
+    def _mirror_sync(repo):
+        action = make_reposync([repo])
+        action.createrepo_walker = lambda repo, dirname, fnames: None
+        action.reposync_cmd = lambda: "/usr/bin/reposync"
+        commands = []
+
+        def subprocess_call(cmd):
+            commands.append(cmd)
+            repodata = os.path.join(action.settings.webdir, "repo_mirror", repo.name, "repodata")
+            os.makedirs(repodata, exist_ok=True)
+            open(os.path.join(repodata, "repomd.xml"), "w").close()
+            return 0
+        action.subprocess_call = subprocess_call
+        action.yum_sync(repo)
+        return commands
+    return _mirror_sync
+
+
+def test_run_aborts_after_failure(make_reposync):
+    # Arrange
+    repos = [FakeRepo("first", "http://a/"), FakeRepo("broken", "http://a/"), FakeRepo("last", "http://a/")]
+    action = make_reposync(repos)
+    synced = []
+
+    def sync(repo):
+        synced.append(repo.name)
+        if repo.name == "broken":
+            raise CX("broken mirror")
+    action.sync = sync
+
+    # Act
+    with pytest.raises(CX) as error:
+        action.run()
+
+    # Assert
+    assert synced == ["first", "broken"]
+    assert "aborting: broken" in str(error.value)
+
+
+def test_run_nofail(make_reposync):
+    # Arrange
+    repos = [FakeRepo("first", "http://a/"), FakeRepo("broken", "http://a/"), FakeRepo("last", "http://a/")]
+    action = make_reposync(repos, nofail=True)
+    synced = []
+
+    def sync(repo):
+        synced.append(repo.name)
+        if repo.name == "broken":
+            raise CX("broken mirror")
+    action.sync = sync
+
+    # Act
+    with pytest.raises(CX) as error:
+        action.run()
+
+    # Assert
+    assert synced == ["first", "broken", "last"]
+    assert "1 of 3 repos failed to synchronize: broken" in str(error.value)
+
+
+def test_run_parallel_with_host_limit(make_reposync):
+    # Arrange
+    repos = [FakeRepo("a%d" % i, "http://a.example.org/repo%d" % i, {"REPO_VAR": "a%d" % i}) for i in range(4)]
+    repos += [FakeRepo("b%d" % i, "http://b.example.org/repo%d" % i, {"REPO_VAR": "b%d" % i}) for i in range(2)]
+    action = make_reposync(repos, workers=4, host_connections=2)
+    lock = threading.Lock()
+    running = {}
+    peak = {"all": 0}
+    environments = {}
+
+    def sync(repo):
+        host = repo.mirror.split("/")[2]
+        with lock:
+            running[host] = running.get(host, 0) + 1
+            peak[host] = max(peak.get(host, 0), running[host])
+            peak["all"] = max(peak["all"], sum(running.values()))
+        environments[repo.name] = action.local.env["REPO_VAR"]
+        time.sleep(0.2)
+        with lock:
+            running[host] -= 1
+    action.sync = sync
+
+    # Act
+    action.run()
+
+    # Assert
+    assert peak["a.example.org"] == 2
+    assert peak["all"] > 2
+    assert environments == dict((repo.name, repo.name) for repo in repos)
+    assert "REPO_VAR" not in os.environ
+
+
+def test_yum_sync_skips_unchanged_upstream(mirror_sync, upstream):
+    # Arrange
+    repo = FakeRepo("yum", upstream[1])
+    first = mirror_sync(repo)
+
+    # Act
+    second = mirror_sync(repo)
+
+    # Assert
+    assert len(first) == 1
+    assert second == []
+
+
+def test_yum_sync_reruns_on_changed_upstream(mirror_sync, upstream):
+    # Arrange
+    repo = FakeRepo("yum", upstream[1])
+    mirror_sync(repo)
+    (upstream[0] / "repodata" / "repomd.xml").write_text("<repomd>2</repomd>")
+
+    # Act
+    commands = mirror_sync(repo)
+
+    # Assert
+    assert len(commands) == 1
+    assert len(mirror_sync(repo)) == 0
+
+
+def test_yum_sync_unreachable_upstream_syncs_fully(mirror_sync, upstream, tmp_path):
+    # Arrange
+    repo = FakeRepo("yum", upstream[1])
+    mirror_sync(repo)
+    upstream[2].shutdown()
+    upstream[2].server_close()
+
+    # Act
+    commands = mirror_sync(repo)
+
+    # Assert
+    assert len(commands) == 1
+    assert not (tmp_path / "repo_mirror" / "yum" / reposync.FINGERPRINT_FILE).exists()
+
+
+def test_upstream_unchanged_apt_release(make_reposync, upstream, tmp_path, monkeypatch):
+    # Arrange
+    monkeypatch.setattr(reposync.utils, "blender", lambda api, remove_dicts, obj: {})
+    repo = FakeRepo("apt", upstream[1], breed="apt")
+    action = make_reposync([repo])
+    (tmp_path / "dists").mkdir()
+    action.store_fingerprint(str(tmp_path), action.upstream_fingerprint(repo))
+
+    # Act
+    unchanged = action.upstream_unchanged(repo, str(tmp_path), str(tmp_path / "dists"))[0]
+    (upstream[0] / "dists" / "stable" / "Release").write_text("Date: 2")
+    changed = action.upstream_unchanged(repo, str(tmp_path), str(tmp_path / "dists"))[0]
+
+    # Assert
+    assert unchanged is True
+    assert changed is False
+    assert not (tmp_path / reposync.FINGERPRINT_FILE).exists()
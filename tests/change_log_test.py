@@ -0,0 +1,43 @@
+from cobbler import change_log
+
+
+class FakeItem:
+    def __init__(self, name, uid):
+        self.name = name
+        self.uid = uid
+
+
+def test_compaction_of_superseded_changes_keeps_clients_complete(tmp_path):
+    # Arrange
+    log = change_log.ChangeLog(str(tmp_path / "change_log"), max_entries=4)
+    log.load()
+    for _ in range(3):
+        log.record("modify", "system", FakeItem("a", "u1"))
+    epoch = log.epoch
+
+    # Act
+    log.record("modify", "system", FakeItem("b", "u2"))
+    log.record("modify", "system", FakeItem("a", "u1"))
+    (changes, sequence, complete, _) = log.changes_since(2, epoch=epoch)
+
+    # Assert
+    assert log.horizon == 0
+    assert [(change["sequence"], change["name"]) for change in changes] == [(4, "b"), (5, "a")]
+    assert (sequence, complete) == (5, True)
+
+
+def test_compaction_past_unseen_changes_is_incomplete(tmp_path):
+    # Arrange
+    log = change_log.ChangeLog(str(tmp_path / "change_log"), max_entries=4)
+    log.load()
+    for index in range(4):
+        log.record("add", "system", FakeItem("s%d" % index, "u%d" % index))
+
+    # Act
+    log.record("add", "system", FakeItem("s4", "u4"))
+    log.load()
+
+    # Assert
+    assert log.horizon == 3
+    assert log.changes_since(2)[2] is False
+    assert log.changes_since(3)[2] is True
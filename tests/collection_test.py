@@ -0,0 +1,100 @@
+import pytest
+
+from cobbler import api
+
+
+@pytest.fixture()
+def cobbler_api():
+    return api.CobblerAPI()
+
+
+@pytest.fixture()
+def create_system(cobbler_api):
+    distro = cobbler_api.new_distro()
+    distro.name = "testindex_distro"
+    distro.arch = "x86_64"
+    distro.breed = "suse"
+    distro.kernel = "/var/log/cobbler/cobbler.log"
+    distro.initrd = "/var/log/cobbler/cobbler.log"
+    cobbler_api.distros().add(distro, save=False)
+    profile = cobbler_api.new_profile()
+    profile.name = "testindex_profile"
+    profile.distro = distro.name
+    cobbler_api.profiles().add(profile, save=False)
+
+    def _create_system(name, interfaces):
+        system = cobbler_api.new_system()
+        system.name = name
+        system.profile = profile.name
+        for (iname, (mac, ip, dns_name)) in interfaces.items():
+            system.set_mac_address(mac, iname)
+            system.set_ip_address(ip, iname)
+            system.set_dns_name(dns_name, iname)
+        cobbler_api.systems().add(system, save=False)
+        return system
+    yield _create_system
+
+    for name in [system.name for system in cobbler_api.systems() if system.name.startswith("testindex_")]:
+        cobbler_api.systems().remove(name, with_delete=False, with_sync=False, with_triggers=False)
+    cobbler_api.profiles().remove("testindex_profile", with_delete=False, with_sync=False, with_triggers=False)
+    cobbler_api.distros().remove("testindex_distro", with_delete=False, with_sync=False, with_triggers=False)
+
+
+def test_find_after_add_rename_and_reindex(cobbler_api, create_system):
+    # Arrange
+    systems = cobbler_api.systems()
+    create_system("testindex_a", {"eth0": ("02:00:5e:10:00:01", "192.0.2.1", "a.example.org")})
+
+    # Act
+    systems.rename(systems.find(name="testindex_a"), "testindex_b", with_sync=False, with_triggers=False)
+    renamed = systems.find(name="testindex_b")
+    found_after_rename = [systems.find(mac_address="02:00:5e:10:00:01"), systems.find(ip_address="192.0.2.1"),
+                          systems.find(dns_name="a.example.org")]
+    renamed.set_ip_address("192.0.2.9", "eth0")
+    systems.reindex(renamed)
+
+    # Assert
+    assert found_after_rename == [renamed, renamed, renamed]
+    assert systems.find(name="testindex_a") is None
+    assert systems.find(ip_address="192.0.2.9") is renamed
+    assert systems.find(ip_address="192.0.2.1") is None
+    assert renamed in systems.find(profile="testindex_profile", return_list=True)
+    assert cobbler_api.profiles().find(distro="testindex_distro", return_list=True) == \
+        [cobbler_api.find_profile(name="testindex_profile")]
+
+
+def test_find_after_remove(cobbler_api, create_system):
+    # Arrange
+    systems = cobbler_api.systems()
+    create_system("testindex_a", {"eth0": ("02:00:5e:10:00:01", "192.0.2.1", "a.example.org")})
+
+    # Act
+    systems.remove("testindex_a", with_delete=False, with_sync=False, with_triggers=False)
+
+    # Assert
+    assert systems.find(mac_address="02:00:5e:10:00:01") is None
+    assert systems.find(dns_name="a.example.org") is None
+    assert systems.find(profile="testindex_profile", return_list=True) == []
+
+
+def test_find_matches_linear_scan(cobbler_api, create_system, monkeypatch):
+    # Arrange
+    monkeypatch.setattr(cobbler_api.settings(), "allow_duplicate_ips", True)
+    monkeypatch.setattr(cobbler_api.settings(), "allow_duplicate_hostnames", True)
+    systems = cobbler_api.systems()
+    create_system("testindex_a", {"eth0": ("02:00:5e:10:00:01", "192.0.2.1", "shared.example.org"),
+                                  "eth1": ("02:00:5e:10:00:02", "192.0.2.2", "a.example.org")})
+    create_system("testindex_b", {"eth0": ("02:00:5e:10:00:03", "192.0.2.1", "shared.example.org")})
+    create_system("testindex_c", {"shared.example.org": ("02:00:5e:10:00:04", "192.0.2.4", "c.example.org")})
+    searches = [{"ip_address": "192.0.2.1"}, {"dns_name": "shared.example.org"}, {"mac_address": "02:00:5E:10:00:02"},
+                {"ip_address": "192.0.2.1", "dns_name": "shared.example.org"}, {"dns_name": "*.example.org"},
+                {"profile": "testindex_profile", "ip_address": "192.0.2.4"}]
+
+    for search in searches:
+        # Act
+        found = systems.find(return_list=True, **dict(search))
+        scanned = [system for system in systems if system.find_match(dict(search))]
+
+        # Assert
+        assert sorted(system.name for system in found) == sorted(system.name for system in scanned), search
+    assert len(systems.find(return_list=True, dns_name="shared.example.org")) == 3
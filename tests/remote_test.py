@@ -0,0 +1,170 @@
+import gzip
+import http.client
+import threading
+import time
+import xmlrpc.client
+
+import pytest
+
+from cobbler import remote
+
+
+def test_expiring_cache_expire():
+    # Arrange
+    cache = remote.ExpiringCache(10)
+    cache["old"] = (100, "a")
+    cache["new"] = (105, "b")
+
+    # Act
+    expired = cache.expire(now=112)
+
+    # Assert
+    assert expired == ["old"]
+    assert list(cache.keys()) == ["new"]
+
+
+def test_expiring_cache_refresh_requeues():
+    # Arrange
+    cache = remote.ExpiringCache(10)
+    cache["token"] = [100, "user"]
+    cache["token"][0] = 108
+
+    # Act
+    first = cache.expire(now=112)
+    second = cache.expire(now=119)
+
+    # Assert
+    assert first == []
+    assert "token" not in cache
+    assert second == ["token"]
+
+
+def test_expiring_cache_max_entries():
+    # Arrange
+    cache = remote.ExpiringCache(10, max_entries=2)
+
+    # Act
+    cache["a"] = (100, 1)
+    cache["b"] = (101, 2)
+    cache["c"] = (102, 3)
+
+    # Assert
+    assert sorted(cache.keys()) == ["b", "c"]
+
+
+def test_expiring_cache_delete_before_expiry():
+    # Arrange
+    cache = remote.ExpiringCache(10)
+    cache["a"] = (100, 1)
+    cache["b"] = (100, 2)
+
+    # Act
+    del cache["a"]
+    popped = cache.pop("b")
+    expired = cache.expire(now=200)
+
+    # Assert
+    assert popped == (100, 2)
+    assert expired == []
+    assert len(cache) == 0
+
+
+@pytest.fixture()
+def xmlrpc_server():
+    servers = []
+
+    def _xmlrpc_server(**kwargs):
+        server = remote.CobblerXMLRPCServer(("127.0.0.1", 0), **kwargs)
+        server.register_function(lambda value: value, "echo")
+        server.register_function(lambda size: "x" * size, "payload")
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        servers.append(server)
+        return server
+    yield _xmlrpc_server
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def xmlrpc_post(connection, method, *params, headers=None):
+    body = xmlrpc.client.dumps(params, method)
+    connection.request("POST", "/RPC2", body, dict({"Content-Type": "text/xml"}, **(headers or {})))
+    return connection.getresponse()
+
+
+def test_xmlrpc_server_keep_alive_reuses_connection(xmlrpc_server):
+    # Arrange
+    server = xmlrpc_server(threads=2)
+    connection = http.client.HTTPConnection(*server.server_address, timeout=5)
+    first = xmlrpc_post(connection, "echo", "first")
+    first_result = xmlrpc.client.loads(first.read())[0]
+    sock = connection.sock
+
+    # Act
+    second = xmlrpc_post(connection, "echo", "second")
+    second_result = xmlrpc.client.loads(second.read())[0]
+
+    # Assert
+    assert first_result == ("first",)
+    assert second_result == ("second",)
+    assert sock is not None
+    assert connection.sock is sock
+    connection.close()
+
+
+def test_xmlrpc_server_gzip_above_threshold(xmlrpc_server):
+    # Arrange
+    server = xmlrpc_server(gzip_threshold=1024)
+    connection = http.client.HTTPConnection(*server.server_address, timeout=5)
+
+    # Act
+    small = xmlrpc_post(connection, "payload", 10, headers={"Accept-Encoding": "gzip"})
+    small_body = small.read()
+    large = xmlrpc_post(connection, "payload", 4096, headers={"Accept-Encoding": "gzip"})
+    large_body = large.read()
+
+    # Assert
+    assert small.getheader("Content-Encoding") is None
+    assert xmlrpc.client.loads(small_body)[0] == ("x" * 10,)
+    assert large.getheader("Content-Encoding") == "gzip"
+    assert len(large_body) < 4096
+    assert xmlrpc.client.loads(gzip.decompress(large_body))[0] == ("x" * 4096,)
+    connection.close()
+
+
+def test_xmlrpc_server_busy_fault_when_queue_full(xmlrpc_server):
+    # Arrange
+    server = xmlrpc_server(threads=1, queue_size=1)
+    started = threading.Event()
+    release = threading.Event()
+
+    def block():
+        started.set()
+        return release.wait(10)
+    server.register_function(block, "block")
+    url = "http://%s:%d/RPC2" % server.server_address
+    results = []
+    clients = [threading.Thread(target=lambda: results.append(xmlrpc.client.ServerProxy(url).block())),
+               threading.Thread(target=lambda: results.append(xmlrpc.client.ServerProxy(url).echo("queued")))]
+    clients[0].start()
+    assert started.wait(5)
+    clients[1].start()
+    deadline = time.time() + 5
+    while server.request_queue.qsize() < 1 and time.time() < deadline:
+        time.sleep(0.01)
+
+    # Act
+    try:
+        with pytest.raises(xmlrpc.client.Fault) as fault:
+            xmlrpc.client.ServerProxy(url).echo("rejected")
+    finally:
+        release.set()
+        for client in clients:
+            client.join(5)
+
+    # Assert
+    assert "server busy" in fault.value.faultString
+    assert sorted(results, key=str) == [True, "queued"]
@@ -0,0 +1,68 @@
+import os
+
+from cobbler import sync_manifest
+
+
+def test_save_load_round_trip(tmp_path):
+    # Arrange
+    manifest = sync_manifest.SyncManifest(str(tmp_path / "manifest.json"))
+    manifest.begin("system/a", [["system", "a", 1.0]])
+    manifest.write(str(tmp_path / "a.cfg"), "a")
+    manifest.end()
+
+    # Act
+    manifest.save()
+    loaded = sync_manifest.SyncManifest(str(tmp_path / "manifest.json"))
+    loaded.load()
+
+    # Assert
+    assert loaded.files == manifest.files
+    assert loaded.owners == {"system/a": {"sources": [["system", "a", 1.0]], "files": [str(tmp_path / "a.cfg")]}}
+
+
+def test_is_unchanged_skips_identical_rewrite(tmp_path):
+    # Arrange
+    path = str(tmp_path / "a.cfg")
+    sources = [["system", "a", 1.0]]
+    first = sync_manifest.SyncManifest(str(tmp_path / "manifest.json"))
+    first.begin("system/a", sources)
+    first.write(path, "a")
+    first.end()
+    first.save()
+    inode = os.stat(path).st_ino
+    second = sync_manifest.SyncManifest(str(tmp_path / "manifest.json"))
+    second.load()
+
+    # Act
+    unchanged = second.is_unchanged("system/a", sources)
+    changed = second.is_unchanged("system/a", [["system", "a", 2.0]])
+    second.write(path, "a")
+
+    # Assert
+    assert unchanged is True
+    assert changed is False
+    assert os.stat(path).st_ino == inode
+
+
+def test_remove_orphans_only_removes_owned_files(tmp_path):
+    # Arrange
+    kept = str(tmp_path / "kept.cfg")
+    orphan = str(tmp_path / "orphan.cfg")
+    foreign = tmp_path / "foreign.cfg"
+    foreign.write_text("not generated")
+    first = sync_manifest.SyncManifest(str(tmp_path / "manifest.json"))
+    first.write(kept, "kept")
+    first.write(orphan, "orphan")
+    first.save()
+    second = sync_manifest.SyncManifest(str(tmp_path / "manifest.json"))
+    second.load()
+    second.write(kept, "kept")
+
+    # Act
+    second.remove_orphans()
+
+    # Assert
+    assert os.path.exists(kept)
+    assert not os.path.exists(orphan)
+    assert foreign.exists()
+    assert sorted(second.files) == [kept]
@@ -0,0 +1,145 @@
+import os
+
+import pytest
+
+from cobbler import api
+from cobbler import sync_manifest
+from cobbler import tftpgen
+from cobbler.cexceptions import CX
+
+
+@pytest.fixture()
+def cobbler_api():
+    return api.CobblerAPI()
+
+
+@pytest.fixture()
+def create_systems(cobbler_api):
+    created = []
+    bootloc = cobbler_api.settings().tftpboot_location
+    for directory in ("pxelinux.cfg", "grub/system", "grub/system_link"):
+        os.makedirs(os.path.join(bootloc, directory), exist_ok=True)
+
+    def _create_systems(name, arch, count):
+        distro = cobbler_api.new_distro()
+        distro.name = name
+        distro.arch = arch
+        distro.breed = "suse"
+        distro.kernel = "/var/log/cobbler/cobbler.log"
+        distro.initrd = "/var/log/cobbler/cobbler.log"
+        cobbler_api.distros().add(distro, save=True, with_sync=False, with_triggers=False)
+        created.append(("distro", name))
+        profile = cobbler_api.new_profile()
+        profile.name = name
+        profile.distro = name
+        cobbler_api.profiles().add(profile, save=True, with_sync=False, with_triggers=False)
+        created.append(("profile", name))
+        systems = []
+        for index in range(count):
+            system = cobbler_api.new_system()
+            system.name = "%s%d" % (name, index)
+            system.profile = name
+            system.set_mac_address("02:00:5e:00:%02x:%02x" % (len(created), index), "eth0")
+            cobbler_api.systems().add(system, save=True, with_sync=False, with_triggers=False)
+            created.append(("system", system.name))
+            systems.append(system)
+        return systems
+    yield _create_systems
+
+    for (what, name) in reversed(created):
+        if what == "system":
+            for path in system_files(cobbler_api.find_system(name=name), bootloc):
+                if os.path.lexists(path):
+                    os.remove(path)
+        cobbler_api.get_items(what).remove(name, with_delete=False, with_sync=False, with_triggers=False)
+
+
+def system_files(system, bootloc):
+    mac = system.interfaces["eth0"]["mac_address"]
+    return [os.path.join(bootloc, "pxelinux.cfg", system.get_config_filename(interface="eth0")),
+            os.path.join(bootloc, "grub", "system", mac),
+            os.path.join(bootloc, "grub", "system_link", system.name)]
+
+
+def read_files(systems, bootloc):
+    contents = {}
+    for system in systems:
+        for path in system_files(system, bootloc):
+            if os.path.islink(path):
+                contents[path] = os.readlink(path)
+            else:
+                with open(path) as fh:
+                    contents[path] = fh.read()
+            os.remove(path)
+    return contents
+
+
+def test_write_all_systems_files_workers_match_serial(cobbler_api, create_systems, monkeypatch):
+    # Arrange
+    monkeypatch.setattr(tftpgen, "SYNC_WORKER_MIN_SYSTEMS", 1)
+    systems = create_systems("testtftpgen_match", "x86_64", 4)
+    generator = tftpgen.TFTPGen(cobbler_api._collection_mgr, cobbler_api.logger)
+    menu_items = generator.get_menu_items()["pxe"]
+    bootloc = cobbler_api.settings().tftpboot_location
+    monkeypatch.setattr(cobbler_api.settings(), "sync_workers", 1)
+    generator.write_all_systems_files(systems, menu_items)
+    serial = read_files(systems, bootloc)
+
+    # Act
+    monkeypatch.setattr(cobbler_api.settings(), "sync_workers", 2)
+    generator.write_all_systems_files(systems, menu_items)
+
+    # Assert
+    assert read_files(systems, bootloc) == serial
+
+
+def test_write_all_systems_files_workers_collect_errors(cobbler_api, create_systems, monkeypatch):
+    # Arrange
+    bootloc = cobbler_api.settings().tftpboot_location
+    if os.path.exists(os.path.join(bootloc, "s390x")):
+        pytest.skip("the s390x files of the systems can be written")
+    monkeypatch.setattr(tftpgen, "SYNC_WORKER_MIN_SYSTEMS", 1)
+    monkeypatch.setattr(cobbler_api.settings(), "sync_workers", 2)
+    broken = create_systems("testtftpgen_broken", "s390x", 2)
+    systems = create_systems("testtftpgen_working", "x86_64", 2)
+    generator = tftpgen.TFTPGen(cobbler_api._collection_mgr, cobbler_api.logger)
+
+    # Act
+    with pytest.raises(CX) as error:
+        generator.write_all_systems_files(broken + systems, generator.get_menu_items()["pxe"])
+
+    # Assert
+    assert "2 system(s): testtftpgen_broken0, testtftpgen_broken1" in str(error.value)
+    assert len(read_files(systems, bootloc)) == 6
+
+
+def test_link_boot_file_skips_unchanged_source(cobbler_api, tmp_path, monkeypatch):
+    # Arrange
+    source = tmp_path / "vmlinuz"
+    source.write_text("kernel")
+    destination = str(tmp_path / "images" / "vmlinuz")
+    os.makedirs(os.path.dirname(destination))
+    linked = []
+
+    def linkfile(src, dst, symlink_ok=False, api=None, logger=None):
+        linked.append(src)
+        with open(src) as src_fh, open(dst, "w") as dst_fh:
+            dst_fh.write(src_fh.read())
+    monkeypatch.setattr(tftpgen.utils, "linkfile", linkfile)
+    generator = tftpgen.TFTPGen(cobbler_api._collection_mgr, cobbler_api.logger)
+    first = sync_manifest.SyncManifest(str(tmp_path / "manifest.json"))
+    sync_manifest.activate(first)
+    generator.link_boot_file(str(source), destination)
+    first.save()
+
+    # Act
+    second = sync_manifest.SyncManifest(str(tmp_path / "manifest.json"))
+    second.load()
+    sync_manifest.activate(second)
+    generator.link_boot_file(str(source), destination)
+    os.utime(str(source), (1, 1))
+    generator.link_boot_file(str(source), destination)
+    sync_manifest.deactivate()
+
+    # Assert
+    assert linked == [str(source), str(source)]
@@ -1,3 +1,4 @@
+import hashlib
 import os
 import re
 import shutil
@@ -317,6 +318,29 @@ def test_blender():
     assert expected == result
 
 
+def test_blender_cache():
+    # Arrange
+    api = CobblerAPI()
+    test_distro = Distro(api._collection_mgr)
+    test_distro.set_name("test_blender_cache")
+    first = utils.blender(api, False, test_distro)
+    stats_before = utils.blender_cache_stats()
+
+    # Act
+    second = utils.blender(api, False, test_distro)
+    second["kernel_options"]["changed"] = "yes"
+    third = utils.blender(api, False, test_distro)
+    test_distro.set_mtime(test_distro.mtime + 1)
+    utils.blender(api, False, test_distro)
+    stats_after = utils.blender_cache_stats()
+
+    # Assert
+    assert first == third
+    assert "changed" not in third["kernel_options"]
+    assert stats_after["hits"] - stats_before["hits"] == 2
+    assert stats_after["misses"] - stats_before["misses"] == 1
+
+
 @pytest.mark.parametrize("testinput,expected_result", [
     (None, None),
     ("data", None),
@@ -458,18 +482,22 @@ def test_is_safe_to_hardlink(test_src, test_dst, expected_result):
     assert expected_result == result
 
 
-@pytest.mark.skip("This calls a lot of os-specific stuff. Let's fix this test later.")
-def test_hashfile():
+def test_hashfile(tmp_path):
     # Arrange
-    # TODO: Create testfile
-    testfilepath = "/dev/shm/bigtestfile"
-    expected_hash = ""
+    testfile = tmp_path / "testfile"
+    testfile.write_bytes(b"cobbler" * 1024)
+    lcache = tmp_path / ".link_cache"
+    lcache.mkdir()
+    expected_hash = hashlib.sha1(b"cobbler" * 1024).hexdigest()
 
     # Act
-    result = utils.hashfile(testfilepath)
+    result = utils.hashfile(str(testfile), lcache=str(lcache))
+    cached_result = utils.hashfile(str(testfile), lcache=str(lcache))
 
     # Assert
     assert expected_hash == result
+    assert expected_hash == cached_result
+    assert (lcache / utils.HASH_DB_FILE).exists()
 
 
 @pytest.mark.skip("This calls a lot of os-specific stuff. Let's fix this test later.")
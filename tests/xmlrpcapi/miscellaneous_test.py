@@ -107,6 +107,26 @@ class TestMiscellaneous:
         assert "pages" in result["pageinfo"]
         assert result["pageinfo"]["pages"] == [1, 2]
 
+    def test_find_items_paged_cursor(self, remote, token, create_distro, remove_distro):
+        # Arrange
+        names = ["distro_items_cursor_%d" % i for i in range(3)]
+        for name in names:
+            create_distro(name, "x86_64", "suse", "/var/log/cobbler/cobbler.log", "/var/log/cobbler/cobbler.log")
+
+        # Act
+        first = remote.find_items_paged("distro", {"name": "distro_items_cursor_*"}, "!name", 1, 2)
+        second = remote.find_items_paged("distro", {"name": "distro_items_cursor_*"}, "!name", 1, 2, token,
+                                         first["pageinfo"]["next_cursor"])
+
+        # Cleanup
+        for name in names:
+            remove_distro(name)
+
+        # Assert
+        assert [item["name"] for item in first["items"]] == names[:0:-1]
+        assert [item["name"] for item in second["items"]] == names[:1]
+        assert first["pageinfo"]["num_items"] == 3
+
     @pytest.mark.skip("This functionality was implemented very quickly. The test for this needs to be fixed at a "
                       "later point!")
     def test_find_system_by_dns_name(self, remote, token, create_distro, remove_distro, create_profile, remove_profile,
@@ -222,6 +242,28 @@ class TestMiscellaneous:
         # Assert
         assert result
 
+    def test_get_blended_data_after_modify(self, remote, token, create_distro, remove_distro, create_profile,
+                                           remove_profile):
+        # Arrange
+        name_distro = "test_distro_blended_after_modify"
+        name_profile = "test_profile_blended_after_modify"
+        create_distro(name_distro, "x86_64", "suse", "/var/log/cobbler/cobbler.log",
+                      "/var/log/cobbler/cobbler.log")
+        create_profile(name_profile, name_distro, "text")
+        remote.get_blended_data(name_profile, "")
+        profile = remote.get_profile_handle(name_profile, token)
+
+        # Act
+        remote.modify_profile(profile, "comment", "edited in place", token)
+        result = remote.get_blended_data(name_profile, "")
+
+        # Cleanup
+        remove_profile(name_profile)
+        remove_distro(name_distro)
+
+        # Assert
+        assert result["comment"] == "edited in place"
+
     def test_get_config_data(self, remote, token, create_distro, remove_distro, create_profile, remove_profile,
                              create_system, remove_system):
         # Arrange
@@ -491,3 +533,45 @@ class TestMiscellaneous:
 
         # Assert
         assert result
+
+    def test_xapi_object_edit_batch(self, remote, token, create_distro, remove_distro, create_profile,
+                                    remove_profile, remove_system):
+        # Arrange
+        create_distro("testdistro_xapi_batch", "x86_64", "suse", "/var/log/cobbler/cobbler.log",
+                      "/var/log/cobbler/cobbler.log")
+        create_profile("testprofile_xapi_batch", "testdistro_xapi_batch", "")
+        names = ["testsystem_xapi_batch%d" % i for i in range(3)]
+        edits = [["system", name, "add", {"profile": "testprofile_xapi_batch"}] for name in names]
+        edits.append(["profile", "testprofile_xapi_batch", "edit", {"comment": "batch"}])
+
+        # Act
+        result = remote.xapi_object_edit_batch(edits, token)
+        systems = [remote.get_system(name) for name in names]
+        comment = remote.get_profile("testprofile_xapi_batch")["comment"]
+
+        # Cleanup
+        for name in names:
+            remove_system(name)
+        remove_profile("testprofile_xapi_batch")
+        remove_distro("testdistro_xapi_batch")
+
+        # Assert
+        assert result
+        assert all(system["profile"] == "testprofile_xapi_batch" for system in systems)
+        assert comment == "batch"
+
+    def test_get_changes(self, remote, token, create_distro, remove_distro):
+        # Arrange
+        name = "testdistro_changes"
+        sequence = remote.get_changes(0)["sequence"]
+
+        # Act
+        create_distro(name, "x86_64", "suse", "/var/log/cobbler/cobbler.log", "/var/log/cobbler/cobbler.log")
+        remove_distro(name)
+        result = remote.get_changes(sequence, "distro")
+
+        # Assert
+        assert result["complete"]
+        assert [(change["change"], change["name"]) for change in result["changes"]] == [("add", name),
+                                                                                        ("delete", name)]
+        assert result["sequence"] == result["changes"][-1]["sequence"]
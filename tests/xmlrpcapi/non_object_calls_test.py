@@ -1,3 +1,4 @@
+import os
 import pytest
 import time
 import re
@@ -76,6 +77,56 @@ class TestNonObjectCalls:
 
         event_log = remote.get_event_log(tid)
 
+    def test_event_log_tail(self, remote, token):
+        """
+        Test: follow a task log and the events incrementally
+        """
+
+        cursor = remote.wait_events(0)["cursor"]
+        tid = remote.background_sync({}, token)
+        assert tid in remote.wait_events(cursor, 5)["events"]
+
+        self._wait_task_end(tid, remote)
+
+        tail = remote.get_event_log_tail(tid, 0, 16)
+        assert 0 < tail["offset"] <= 16
+        rest = remote.get_event_log_tail(tid, tail["offset"])
+        assert rest["offset"] == rest["size"]
+        assert tail["data"] + rest["data"] == remote.get_event_log(tid)
+
+    def test_task_queue(self, remote, token):
+        """
+        Test: queued duplicate syncs are merged and can be canceled
+        """
+
+        # Keep the first sync running, so the second one has to wait because only one sync may run at a time
+        trigger_dir = "/var/lib/cobbler/triggers/task/sync/pre"
+        trigger = os.path.join(trigger_dir, "zz_test_task_queue")
+        os.makedirs(trigger_dir, exist_ok=True)
+        with open(trigger, "w") as fd:
+            fd.write("#!/bin/sh\nsleep 10\n")
+        os.chmod(trigger, 0o755)
+        try:
+            running = remote.background_sync({}, token)
+            while remote.get_task_status(running)[2] != "running":
+                time.sleep(0.1)
+            queued = remote.background_sync({"verbose": True}, token)
+            duplicate = remote.background_sync({"verbose": True, "priority": 5}, token)
+
+            status = remote.get_task_status(queued)
+            canceled = remote.cancel_task(queued, token)
+            self._wait_task_end(running, remote)
+        finally:
+            os.remove(trigger)
+
+        assert duplicate == queued
+        assert status[2] == "queued"
+        assert status[4]["priority"] == 5
+        assert status[4]["queue_depth"] >= 1
+        assert canceled
+        # the canceled task never ran
+        assert remote.get_task_status(queued)[2] == "canceled"
+
     def test_get_autoinstall_templates(self, remote, token):
         """
         Test: get autoinstall templates